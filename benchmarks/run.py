@@ -0,0 +1,275 @@
+"""
+Benchmarks for the plugin backend's hot paths, runnable on plain Linux without Decky or a real sing-box.
+
+    python3 benchmarks/run.py [--sizes 100,1000,10000] [--repeat 5] [--output bench_output.txt] [--json]
+
+The `decky` and `helpers` modules normally provided by Decky Loader are replaced with in-memory stubs
+pointing at a throwaway plugin directory. Subscriptions are generated synthetically, a local HTTP server stands in
+for subscription providers, and a fake sing-box (a shell script speaking just enough of `version`, `check` and
+`run`) is packaged the way the real release tarball is.
+
+Every operation is timed over `--repeat` runs, then run once more under `tracemalloc` for its peak Python memory,
+so timings are not skewed by allocation tracing.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import resource
+import shutil
+import ssl
+import statistics
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_VERSION = "1.10.0"
+FAKE_SINGBOX = """#!/bin/sh
+case "$1" in
+  version) echo "sing-box version %s"; echo "Environment: benchmark";;
+  check) for last; do :; done; python3 -c "import json,sys; json.load(open(sys.argv[1]))" "$last" || exit 1;;
+  run) trap 'echo "+0000 INFO reload"' HUP; trap 'exit 0' TERM; echo "+0000 INFO sing-box started"
+       while true; do sleep 0.05; done;;
+esac
+""" % FAKE_VERSION
+PROTOCOLS = ("vmess", "trojan", "shadowsocks", "hysteria2")
+CHUNK_SIZE = 64 * 1024
+
+
+def install_stubs(base):
+    """
+    Registers stand-ins for the modules Decky Loader injects, rooted at `base`.
+    """
+    decky = types.ModuleType("decky")
+    decky.logger = logging.getLogger("decky")
+    decky.DECKY_HOME = base
+    decky.DECKY_PLUGIN_DIR = os.path.join(base, "plugin")
+    decky.DECKY_PLUGIN_SETTINGS_DIR = os.path.join(base, "settings")
+    decky.DECKY_PLUGIN_LOG_DIR = os.path.join(base, "logs")
+    decky.DECKY_PLUGIN_RUNTIME_DIR = os.path.join(base, "runtime")
+    decky.events = []
+
+    async def emit(event, *args):
+        decky.events.append((event, args))
+
+    decky.emit = emit
+    decky.migrate_settings = lambda *args: {}
+    for folder in ("plugin/bin", "settings", "logs", "runtime"):
+        os.makedirs(os.path.join(base, folder), exist_ok=True)
+
+    helpers = types.ModuleType("helpers")
+    helpers.get_ssl_context = ssl.create_default_context
+
+    sys.modules.update({"decky": decky, "helpers": helpers})
+
+
+def install_fake_singbox(folder):
+    name = f"sing-box-{FAKE_VERSION}-linux-amd64"
+    with tarfile.open(os.path.join(folder, name + ".tar.gz"), "w:gz") as archive:
+        script = FAKE_SINGBOX.encode()
+        info = tarfile.TarInfo(f"{name}/sing-box")
+        info.size, info.mode = len(script), 0o755
+        archive.addfile(info, io.BytesIO(script))
+
+
+def generate_subscription(outbounds: int, rules: int) -> dict:
+    """
+    Builds a sing-box config shaped like a provider subscription: `outbounds` proxy nodes across the common
+    protocols, a selector and a urltest group over all of them, `rules` route rules and a DNS section.
+    """
+    nodes = []
+    for i in range(outbounds):
+        protocol = PROTOCOLS[i % len(PROTOCOLS)]
+        node = {"type": protocol, "tag": f"{protocol}-{i:05d}", "server": f"node{i}.example.com",
+                "server_port": 443 + i % 1000}
+        if protocol == "vmess":
+            node.update({"uuid": f"00000000-0000-4000-8000-{i:012d}", "security": "auto", "alter_id": 0})
+        elif protocol == "shadowsocks":
+            node.update({"method": "2022-blake3-aes-128-gcm", "password": f"password-{i}"})
+        else:
+            node.update({"password": f"password-{i}", "tls": {"enabled": True, "server_name": f"node{i}.example.com"}})
+        nodes.append(node)
+    tags = [node["tag"] for node in nodes]
+    route_rules = [{"protocol": "dns", "outbound": "dns-out"}]
+    for i in range(rules):
+        match = {"domain_suffix": [f"site{i}.example.org"]} if i % 2 else {"ip_cidr": [f"10.{i // 256 % 256}.{i % 256}.0/24"]}
+        route_rules.append({**match, "outbound": "direct" if i % 3 == 0 else "Proxy"})
+    return {
+        "dns": {"servers": [{"tag": "remote", "address": "https://1.1.1.1/dns-query", "detour": "Proxy"},
+                            {"tag": "local", "address": "223.5.5.5", "detour": "direct"}],
+                "rules": [{"outbound": "any", "server": "local"}]},
+        "inbounds": [{"type": "mixed", "listen": "127.0.0.1", "listen_port": 2080}],
+        "outbounds": [{"type": "selector", "tag": "Proxy", "outbounds": ["Auto"] + tags},
+                      {"type": "urltest", "tag": "Auto", "outbounds": tags}]
+                     + nodes + [{"type": "direct", "tag": "direct"}, {"type": "dns", "tag": "dns-out"}],
+        "route": {"rules": route_rules, "final": "Proxy", "auto_detect_interface": True},
+    }
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    """
+    Serves `/subscription/<n>` (a generated subscription with n outbounds and rules) and `/blob/<bytes>`.
+    """
+    subscriptions = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        kind, _, size = self.path.strip("/").partition("/")
+        if not size.isdigit() or kind not in ("subscription", "blob"):
+            self.send_error(404)
+            return
+        size = int(size)
+        if kind == "subscription":
+            if size not in self.subscriptions:
+                self.subscriptions[size] = json.dumps(generate_subscription(size, size)).encode()
+            body = self.subscriptions[size]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        chunk = bytes(CHUNK_SIZE)
+        while size > 0:
+            self.wfile.write(chunk[:min(size, CHUNK_SIZE)])
+            size -= CHUNK_SIZE
+
+
+def start_provider() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ProviderHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def measure(name, operation, repeat, setup=None, count=1) -> dict:
+    """
+    Times `count` awaits of `operation` per run over `repeat` runs, then records the peak traced memory of one more.
+
+    Returns:
+    dict: `name`, `runs`, `min`/`median`/`max` in milliseconds per call, and `peak_kib`.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            await setup()
+        start = time.perf_counter()
+        for _ in range(count):
+            await operation()
+        timings.append((time.perf_counter() - start) * 1000 / count)
+    if setup:
+        await setup()
+    tracemalloc.start()
+    try:
+        await operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"name": name, "runs": repeat * count, "min": min(timings), "median": statistics.median(timings),
+            "max": max(timings), "peak_kib": peak / 1024}
+
+
+async def run(args) -> list:
+    import main
+
+    plugin = main.Plugin()
+    await plugin._main()
+    provider = start_provider()
+    base_url = f"http://127.0.0.1:{provider.server_port}"
+    results = []
+
+    def sync(function, *function_args):
+        async def call():
+            return function(*function_args)
+        return call
+
+    async def invalidate():
+        for path in (main.RUNNING_CONFIG, main.RUNNING_CONFIG + ".key"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    try:
+        for size in args.sizes:
+            name = f"bench-{size}"
+            with open(os.path.join(main.SB_HOME, f"{name}.json"), "w") as f:
+                json.dump(generate_subscription(size, size), f)
+            results.append(await measure(f"parse_and_modify_config[{size}] cold",
+                                         sync(plugin.parse_and_modify_config, name), args.repeat, setup=invalidate))
+            results.append(await measure(f"parse_and_modify_config[{size}] cached",
+                                         sync(plugin.parse_and_modify_config, name), args.repeat))
+            results.append(await measure(f"fetch_config[{size}]",
+                                         lambda: plugin.fetch_config(name, {"url": f"{base_url}/subscription/{size}"},
+                                                                     conditional=False), args.repeat))
+
+        plugin.set_setting("configs", {f"bench-{size}": {"url": f"{base_url}/subscription/{size}"} for size in args.sizes})
+        plugin.set_setting("use_config", f"bench-{args.sizes[-1]}")
+        results.append(await measure("info", plugin.info, args.repeat, count=1000))
+        results.append(await measure("get_state", lambda: plugin.get_state(""), args.repeat, count=100))
+
+        plugin.set_setting("download_max_size", max(args.blobs) + 1)
+        for blob in args.blobs:
+            results.append(await measure(f"download_file[{blob // 1024 // 1024} MiB]",
+                                         lambda: plugin.download_file(f"{base_url}/blob/{blob}", main.SB_HOME, "blob.bin"),
+                                         args.repeat))
+
+        results.append(await measure("start_singbox", plugin.start_singbox, args.repeat, setup=plugin.stop_singbox))
+        results.append(await measure("stop_singbox", plugin.stop_singbox, args.repeat, setup=plugin.start_singbox))
+    finally:
+        await plugin._unload()
+        provider.shutdown()
+    return results
+
+
+def report(results, as_json=False) -> str:
+    if as_json:
+        return "\n".join(json.dumps(result) for result in results)
+    lines = [f"{'operation':<44}{'runs':>6}{'min ms':>11}{'median ms':>11}{'max ms':>11}{'peak KiB':>11}"]
+    for result in results:
+        lines.append(f"{result['name']:<44}{result['runs']:>6}{result['min']:>11.3f}{result['median']:>11.3f}"
+                     f"{result['max']:>11.3f}{result['peak_kib']:>11.1f}")
+    lines.append(f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="comma separated subscription sizes (outbounds and rules)")
+    parser.add_argument("--blobs", default="1,16,64", help="comma separated download sizes in MiB")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per operation")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--json", action="store_true", help="report one JSON object per operation")
+    parser.add_argument("--verbose", action="store_true", help="show the plugin's log output")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.blobs = [int(blob) * 1024 * 1024 for blob in args.blobs.split(",")]
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+    base = tempfile.mkdtemp(prefix="decky-sbox-bench-")
+    try:
+        install_stubs(base)
+        install_fake_singbox(os.path.join(base, "plugin", "bin"))
+        sys.path[:0] = [ROOT, os.path.join(ROOT, "py_modules")]
+        results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+    text = report(results, args.json)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,32 @@
 import os
 from os import W_OK, access, stat
-from os.path import dirname
-from urllib.request import Request, urlopen
 from urllib.parse import urlparse
-from helpers import get_ssl_context # type: ignore
-from settings import SettingsManager  # type: ignore
 from pathlib import Path
 import json
+import hashlib
 import asyncio
-import re
+import time
+import signal
 from subprocess import CalledProcessError
 
 # The decky plugin module is located at decky-loader/plugin
 # For easy intellisense checkout the decky-loader code one directory up
 # or add the `decky-loader/plugin` path to `python.analysis.extraPaths` in `.vscode/settings.json`
 import decky
+from sbox import config, convert, diff, dns, download, health, merge, profiles, resources, trace, tun, tuning
+from sbox.binary import SingBoxBinary
+from sbox.clash import ClashAPI, ClashAPIError
+from sbox.convert import SubscriptionConverter
+from sbox.health import HealthWatchdog
+from sbox.latency import LatencyTester, proxy_outbounds
+from sbox.logs import LEVELS as LOG_LEVELS, LogBuffer
+from sbox.metrics import TrafficMonitor
+from sbox.resources import ResourceMonitor
+from sbox.rulesets import RuleSetCache, remote_rule_sets
+from sbox.store import SettingsStore
+from sbox.supervisor import SingBoxSupervisor
+from sbox.trace import tracer
+from sbox.validate import ConfigValidator
 
 # Force LD_LIBRARY_PATH to include system paths for libssl
 env = os.environ.copy()
@@ -23,22 +35,74 @@ env['LD_LIBRARY_PATH'] = '/usr/lib:/usr/lib64'
 SB_BINARY = os.path.join(decky.DECKY_PLUGIN_DIR, 'bin', 'sing-box')
 SB_BINARY_FOLDER = os.path.join(decky.DECKY_PLUGIN_DIR, 'bin')
 SB_HOME = decky.DECKY_PLUGIN_SETTINGS_DIR
-
+SB_MANIFEST = os.path.join(SB_HOME, 'sing-box.manifest.json')
+CLASH_API = "127.0.0.1:9090"
+LATENCY_TEST_URL = "https://www.gstatic.com/generate_204"
+RUNNING_CONFIG = os.path.join(SB_HOME, 'running_config.json')
+NEXT_CONFIG = os.path.join(SB_HOME, 'running_config.next.json')
+# How long sing-box has to survive a SIGHUP before the reload counts as applied
+RELOAD_GRACE = 0.5
+TRACE_FILE = os.path.join(decky.DECKY_PLUGIN_LOG_DIR, 'trace.jsonl')
+
+# Every public coroutine is a frontend callable; time each call
+@tracer.instrument_class
 class Plugin:
 
     async def _main(self):
         decky.logger.info('Starting Decky-SBox...')
 
-        self.settings = SettingsManager(name="deckysbox", settings_directory=decky.DECKY_PLUGIN_SETTINGS_DIR)
+        self.settings = SettingsStore(os.path.join(decky.DECKY_PLUGIN_SETTINGS_DIR,"deckysbox.json"))
+        tracer.start(lag_interval=lambda: self.get_setting("loop_lag_interval",trace.DEFAULT_LAG_INTERVAL),
+                     path=TRACE_FILE if self.get_setting("trace_file",False) else None)
+        self.singbox_binary = SingBoxBinary(SB_BINARY, SB_BINARY_FOLDER, SB_MANIFEST)
+        self.validator = ConfigValidator(SB_BINARY, SB_HOME, env, os.path.join(SB_HOME,'validation.json'))
+        self.validation_slots = asyncio.Semaphore(2)
+        self.validations = {}
+        self.config_keys = {}
+        self.rule_set_urls = {}
+        self.running_group = None
+        self.singbox_log = LogBuffer(capacity=self.get_setting("log_buffer_lines",1000),
+                                     path=os.path.join(decky.DECKY_PLUGIN_LOG_DIR,'sing-box.log'))
+        self.supervisor = SingBoxSupervisor(self._singbox_command, env,
+                                            output=lambda stream: self._read_stream(stream,self.singbox_log.append),
+                                            on_state=lambda state: self.notify("status",state),
+                                            before_start=self._before_spawn)
+        self.traffic_events = None
+        self.emitting = set()
+        self.running_app = None
+        self.tun_override = None
+        self.tune_target = None
+        self.tuning_lock = asyncio.Lock()
+        # Serializes starting, stopping and reloading sing-box, which share RUNNING_CONFIG and NEXT_CONFIG
+        self.singbox_lock = asyncio.Lock()
+        self.clash = ClashAPI(CLASH_API)
+        self.metrics = TrafficMonitor(self.clash)
+        self.latency = LatencyTester(self.clash, concurrency=self.get_setting("latency_concurrency",8),
+                                     ttl=self.get_setting("latency_ttl",300))
+        self.refresh_lock = asyncio.Lock()
+        self.refresh_wakeup = asyncio.Event()
+        self.refresh_task = asyncio.create_task(self._refresh_loop())
+        self.converter = SubscriptionConverter(os.path.join(SB_HOME,'converted'))
+        self.rule_sets = RuleSetCache(os.path.join(SB_HOME,'rule-sets'))
+        self.rule_set_fetch = None
+        self.rule_set_task = asyncio.create_task(self._rule_set_loop())
+        self.health = HealthWatchdog(self._health_probe, self._health_failover,
+                                     interval=lambda: self.get_setting("health_interval",health.DEFAULT_INTERVAL),
+                                     threshold=lambda: max(1,int(self.get_setting("health_threshold",health.DEFAULT_THRESHOLD))),
+                                     on_event=lambda event: self.notify("health",event))
+        self.health.start()
+        self.resources = ResourceMonitor(lambda: self.supervisor.pid if self.supervisor.running else None,
+                                         interval=lambda: self.get_setting("resource_interval",resources.DEFAULT_INTERVAL),
+                                         limits=self.resource_limits, on_limit=self._resource_limit)
+        self.resources.start()
+        # A sing-box left behind by a previous plugin instance is not ours to supervise
+        await self._kill_stray_singbox()
         enabled = self.get_setting("enable",False)
         if enabled:
             decky.logger.info('Starting Sing-box on startup...')
-            status = await self.info()
-            if status["online"] == False:
-                await self.start_singbox()
+            await self.start_singbox()
         else:
             decky.logger.info('Stop Sing-box on startup...')
-            await self.stop_singbox()
 
 
 
@@ -97,65 +161,523 @@ class Plugin:
         None
         """
         while True:
-            line = await stream.readline()
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # A single line longer than the stream buffer limit; it has been discarded, keep reading
+                continue
             if line:
-                cb(line.decode('utf-8').strip())
+                cb(line.decode('utf-8','replace').strip())
             else:
                 break
     
+    def notify(self, event: str, *args):
+        """
+        Pushes a state-change event to the frontend without waiting for it to be delivered.
+
+        Events: `status` (sing-box state), `config_switched` (new config name), `configs_changed`,
+        `refresh_finished` (refresh summary), `traffic` (metrics ticks, see `set_traffic_events`), `health`
+        (watchdog events) and `resources` (resource limit events).
+        """
+        async def emit():
+            try:
+                await decky.emit(event,*args)
+            except Exception as e:
+                decky.logger.debug(f'Failed to emit {event}: {e}')
+        task = asyncio.create_task(emit())
+        self.emitting.add(task)
+        task.add_done_callback(self.emitting.discard)
+
+    async def get_state(self, etag="") -> dict:
+        """
+        Returns `info` and `configs` together with an `etag` over their content.
+
+        When `etag` matches the current state only `{"etag", "unchanged": True}` is returned, so the frontend can
+        re-sync after every event without re-rendering unchanged payloads.
+        """
+        state = {"info":await self.info(),"configs":await self.list_configs()}
+        stable = {"info":{k:v for k,v in state["info"].items() if k!="uptime"},"configs":state["configs"]}
+        digest = hashlib.sha1(json.dumps(stable,sort_keys=True).encode()).hexdigest()
+        if etag==digest:
+            return {"etag":digest,"unchanged":True}
+        return {"etag":digest,"unchanged":False,**state}
+
+    async def set_traffic_events(self, enabled: bool, interval=None) -> bool:
+        """
+        Starts or stops pushing `traffic` events every `traffic_event_interval` seconds (default 2). The frontend
+        enables them while the panel is open, so nothing ticks while the quick access menu is closed. Each event
+        carries the traffic metrics and, under `resources`, the latest resource sample (see `get_resources`).
+
+        Parameters:
+        enabled (bool): Push events from now on.
+        interval (float): New `traffic_event_interval` in seconds, 0 disables the events; None keeps it.
+        """
+        if interval is not None:
+            try:
+                self.set_setting("traffic_event_interval",max(0.0,float(interval)))
+            except (TypeError, ValueError) as e:
+                decky.logger.error(f"Invalid traffic event interval: {e}")
+                return False
+        if self.traffic_events is not None:
+            self.traffic_events.cancel()
+            self.traffic_events = None
+        interval = self.get_setting("traffic_event_interval",2)
+        if enabled and interval>0:
+            self.traffic_events = asyncio.create_task(self._traffic_ticker(interval))
+        return True
+
+    async def _traffic_ticker(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if self.supervisor.running:
+                try:
+                    await decky.emit("traffic",{**self.metrics.snapshot(),"resources":self.resources.snapshot()})
+                except Exception as e:
+                    decky.logger.debug(f'Failed to emit traffic: {e}')
+
     async def info(self) -> dict:
-        running = False
-        if not os.path.exists(SB_BINARY):
-            version = await self.check_and_extract_singbox()
-        else:
-            version = self.get_setting("version","")
-            for x in os.popen('pgrep sing-box'):
-                if x:
-                    running = True
-                    break
+        version = await self.check_and_extract_singbox()
         use_config = self.get_setting("use_config","")
-        return {"binary_version":version,"online":running,"config":use_config}
+        status = self.supervisor.status()
+        return {"binary_version":version,"online":self.supervisor.running,"config":use_config,**status,
+                "healthy":self.health.healthy,
+                "merged":self._merged_members() if use_config==merge.MERGED_CONFIG else None}
 
     async def list_configs(self) -> list:
         configs = self.get_setting("configs",{})
         use_config = self.get_setting("use_config","")
+        merged = self._merged_members()
         resp = []
         for name,detail in configs.items():
+            key = self._config_cache_key(name)
+            result = self.validator.cached(key) if key else None
+            if result is None and key:
+                self._schedule_validation(name)
             tmp = {
                 "name": name,
                 "url": detail["url"],
+                "format": detail.get("format",convert.FORMAT_SINGBOX),
                 "selected": True if use_config==name else False,
-                "valid": True,
+                "merged": name in merged,
+                "dns": self.dns_options(name),
+                "valid": result["valid"] if result else None,
+                "error": result["error"] if result else None,
+                "last_change": detail.get("last_change"),
             }
             resp.append(tmp)
         return resp
 
+    def _config_cache_key(self, config_name):
+        # Re-hash the subscription only when its stat or the overlay settings changed since the last lookup
+        try:
+            st = os.stat(os.path.join(SB_HOME,f'{config_name}.json'))
+        except OSError:
+            return None
+        urls = self.rule_set_urls.get(config_name,(None,()))[1]
+        signature = (st.st_mtime_ns,st.st_size,json.dumps(self.config_overlay(config_name,runtime=False),sort_keys=True),
+                     self.rule_sets.revision(urls))
+        memo = self.config_keys.get(config_name)
+        if memo is None or memo[0]!=signature:
+            source = self.config_key(config_name,runtime=False)
+            if source is None:
+                return None
+            memo = (signature,source[1])
+            self.config_keys[config_name] = memo
+        return memo[1]
+
+    def _schedule_validation(self, config_name):
+        if config_name in self.validations:
+            return
+        task = asyncio.create_task(self.validate_config(config_name))
+        self.validations[config_name] = task
+        task.add_done_callback(lambda _: self.validations.pop(config_name,None))
+
+    async def validate_config(self, config_name: str) -> dict:
+        """
+        Validates the running config that would be generated from `config_name` with `sing-box check`.
+
+        The verdict is cached per config cache key, so unchanged subscriptions are never checked twice.
+
+        Returns:
+        dict: `valid` (True, False, or None when it could not be checked) and `error`.
+        """
+        key = self._config_cache_key(config_name)
+        if key is None:
+            return {"valid":False,"error":"Config file not found"}
+        result = self.validator.cached(key)
+        if result is not None:
+            return result
+        if not await self.check_and_extract_singbox():
+            return {"valid":None,"error":"sing-box binary not available"}
+        async with self.validation_slots:
+            path = os.path.join(SB_HOME,f'.check-{config_name}.json')
+            try:
+                if self.parse_and_modify_config(config_name,output=path,runtime=False):
+                    result = await self.validator.check(path,key)
+                else:
+                    result = {"valid":False,"error":"Config is not valid JSON"}
+                    self.validator.store(key,result)
+            except OSError as e:
+                return {"valid":None,"error":str(e)}
+            finally:
+                for leftover in (path,f'{path}.key'):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+        decky.logger.info(f'Validated config {config_name}: {result}')
+        self.notify("configs_changed")
+        return result
+
     async def refresh_config(self,config_name: str) -> bool:
         configs = self.get_setting("configs",{})
         cur_in_use_config = self.get_setting("use_config","")
         if configs.get(config_name):
-            result = await self.download_file(configs[config_name]["url"],SB_HOME,"{}.json".format(config_name))
+            result = await self._refresh_one(config_name,configs[config_name])
             decky.logger.info(f'Refreshed config {configs[config_name]["url"]} {result}')
-            if result:
-                if cur_in_use_config==config_name:
-                    # We need to restart sing-box
-                    pass
+            self.notify("refresh_finished",{"results":[result],"elapsed":result["elapsed"]})
+            if result["status"]!="failed":
+                if result["status"]=="changed":
+                    self.set_setting("configs",configs)
+                    if cur_in_use_config==config_name:
+                        await self._apply_refresh(result["diff"])
+                    elif cur_in_use_config==merge.MERGED_CONFIG and config_name in self._merged_members():
+                        await self._refresh_merged()
                 return True
         return False
+
+    async def refresh_all_configs(self, concurrency=None, timeout=None) -> dict:
+        """
+        Refreshes every subscription in the `configs` setting concurrently.
+
+        At most `concurrency` downloads run at once (`refresh_concurrency` setting, default 4), and each one is
+        bounded by `timeout` seconds (`download_timeout` setting), so one slow provider only holds up its own slot.
+
+        Returns:
+        dict: `results`, a list with `name`, `status` ("changed", "unchanged" or "failed"), `elapsed`, `error` and
+              the `diff` summary of a changed config (see `diff.diff_configs`) for each config, and the total
+              `elapsed` time in seconds.
+        """
+        async with self.refresh_lock:
+            start = time.monotonic()
+            configs = self.get_setting("configs",{})
+            cur_in_use_config = self.get_setting("use_config","")
+            semaphore = asyncio.Semaphore(max(1,int(concurrency or self.get_setting("refresh_concurrency",4))))
+
+            async def refresh(name, detail):
+                async with semaphore:
+                    return await self._refresh_one(name,detail,timeout)
+
+            results = await asyncio.gather(*[refresh(name,detail) for name,detail in configs.items()])
+            changed = [result["name"] for result in results if result["status"]=="changed"]
+            if changed:
+                self.set_setting("configs",configs)
+                for result in results:
+                    if result["name"]==cur_in_use_config and result["status"]=="changed":
+                        await self._apply_refresh(result["diff"])
+                if cur_in_use_config==merge.MERGED_CONFIG and set(changed)&set(self._merged_members()):
+                    await self._refresh_merged()
+            elapsed = round(time.monotonic()-start,3)
+            decky.logger.info(f'Refreshed {len(results)} configs in {elapsed}s, changed: {changed}')
+            summary = {"results":results,"elapsed":elapsed}
+            self.notify("refresh_finished",summary)
+            return summary
+
+    async def _refresh_one(self, config_name: str, detail: dict, timeout=None) -> dict:
+        start = time.monotonic()
+        status, error, change = "failed", None, None
+        path = os.path.join(SB_HOME,f'{config_name}.json')
+        try:
+            previous = await asyncio.to_thread(Path(path).read_bytes) if os.path.exists(path) else None
+            result = await self.fetch_config(config_name,detail,timeout=timeout)
+            status = "changed" if result["changed"] else "unchanged"
+            if result["changed"] and previous is not None:
+                change = await asyncio.to_thread(diff.diff_sources,previous,path)
+                if change is not None:
+                    detail["last_change"] = {**change,"time":time.time()}
+        except (download.DownloadError, OSError) as e:
+            error = str(e)
+        return {"name":config_name,"status":status,"elapsed":round(time.monotonic()-start,3),"error":error,
+                "diff":change}
+
+    async def _apply_refresh(self, change) -> str:
+        """
+        Brings the running sing-box up to date with a refreshed in-use subscription along the cheapest path the
+        diff allows (see `diff.apply_path`). Without a diff, a hot reload is used.
+
+        Returns:
+        str: The path taken: "none", "selector", "reload" or "restart".
+        """
+        if not self.get_setting("enable",False):
+            return diff.APPLY_NONE
+        path = change["apply"] if change else diff.APPLY_RELOAD
+        if path==diff.APPLY_SELECTOR and not self.supervisor.running:
+            path = diff.APPLY_RELOAD
+        elif path==diff.APPLY_SELECTOR and not self.get_setting("preferred_outbound",""):
+            # A persisted preferred outbound overrides provider defaults, in which case there is nothing to switch
+            for group,default in change["selectors"].items():
+                try:
+                    await self.clash.request('PUT',f'/proxies/{self.clash.quote(group)}',{"name":default})
+                except ClashAPIError as e:
+                    decky.logger.warning(f'Failed to switch {group} to {default}, reloading instead: {e}')
+                    path = diff.APPLY_RELOAD
+                    break
+        if path==diff.APPLY_RELOAD:
+            await self.apply_config()
+        elif path==diff.APPLY_RESTART:
+            await self._restart_singbox()
+        decky.logger.info(f'Applied refreshed config via {path}')
+        return path
+
+    def _merged_members(self) -> list:
+        configs = self.get_setting("configs",{})
+        return [name for name in self.get_setting("merged_configs",[]) if name in configs]
+
+    async def _build_merged(self):
+        # Regenerates the merged source from its members; returns the merge stats and the diff against the last one
+        path = os.path.join(SB_HOME,f'{merge.MERGED_CONFIG}.json')
+        previous = await asyncio.to_thread(Path(path).read_bytes) if os.path.exists(path) else None
+        members = [(name,os.path.join(SB_HOME,f'{name}.json')) for name in self._merged_members()]
+        stats = await asyncio.to_thread(merge.merge_files,members,path)
+        change = await asyncio.to_thread(diff.diff_sources,previous,path) if previous is not None else None
+        self.set_setting("merged_stats",stats)
+        decky.logger.info(f'Merged configs {stats}')
+        return stats, change
+
+    async def _refresh_merged(self):
+        # Brings the running merged config up to date after its members changed, leaving merged mode once none is left
+        if not self._merged_members():
+            self.set_setting("use_config","")
+            self.notify("config_switched","")
+            await self.stop_singbox()
+            return
+        try:
+            _, change = await self._build_merged()
+        except (merge.MergeError, OSError) as e:
+            decky.logger.error(f'Failed to merge configs: {e}')
+            return
+        await self._apply_refresh(change)
+
+    async def set_merged_mode(self, enabled: bool) -> dict:
+        """
+        Switches between running a single subscription and merged mode, in which every subscription marked with
+        `update_config(name, "merged", True)` is merged into one config (see `merge.merge_configs`). Leaving merged
+        mode switches to the first merged subscription.
+
+        Returns:
+        dict: The merge stats when enabling, with `error` if the merge failed or produced an invalid config.
+        """
+        current = self.get_setting("use_config","")
+        if not enabled:
+            if current==merge.MERGED_CONFIG:
+                members = self._merged_members()
+                name = members[0] if members else ""
+                self.set_setting("use_config",name)
+                self.notify("config_switched",name)
+                if name:
+                    await self.apply_config()
+                else:
+                    await self.stop_singbox()
+            return {}
+        try:
+            stats, _ = await self._build_merged()
+        except (merge.MergeError, OSError) as e:
+            return {"error":str(e)}
+        result = await self.validate_config(merge.MERGED_CONFIG)
+        if result["valid"]==False:
+            decky.logger.error(f'Refusing to switch to invalid merged config: {result["error"]}')
+            return {**stats,"error":result["error"]}
+        if current!=merge.MERGED_CONFIG:
+            self.set_setting("use_config",merge.MERGED_CONFIG)
+            self.notify("config_switched",merge.MERGED_CONFIG)
+        await self.apply_config()
+        return stats
+
+    async def get_merged_stats(self) -> dict:
+        return self.get_setting("merged_stats",{})
+
+    async def _refresh_loop(self):
+        # Sleeps until the next scheduled refresh; `set_refresh_interval` wakes it up to pick up a new interval
+        while True:
+            interval = self.get_setting("refresh_interval",0)
+            self.refresh_wakeup.clear()
+            try:
+                await asyncio.wait_for(self.refresh_wakeup.wait(), interval*60 if interval>0 else None)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            decky.logger.info('Running scheduled config refresh...')
+            try:
+                await self.refresh_all_configs()
+            except Exception as e:
+                decky.logger.error(f'Scheduled config refresh failed: {e}')
+
+    def _schedule_rule_set_fetch(self, rule_sets):
+        # Rule-sets not cached yet stay remote in this generation; once fetched, the config is regenerated with the
+        # local copies and hot reloaded
+        if self.rule_set_fetch is not None and not self.rule_set_fetch.done():
+            return
+        self.rule_set_fetch = asyncio.create_task(self._fetch_rule_sets(rule_sets))
+
+    async def _fetch_rule_sets(self, rule_sets):
+        decky.logger.info(f'Pre-fetching {len(rule_sets)} remote rule-sets')
+        changed = await self.rule_sets.fetch(rule_sets,concurrency=self.get_setting("refresh_concurrency",4),
+                                             timeout=self.get_setting("download_timeout",download.DEFAULT_TIMEOUT))
+        if self._uses_rule_sets(changed):
+            await self.apply_config()
+
+    def _rule_set_urls(self, config_name, raw=None) -> tuple:
+        # The remote rule-set URLs a subscription references, re-parsed only when its contents change
+        if raw is None:
+            try:
+                raw = Path(SB_HOME,f'{config_name}.json').read_bytes()
+            except OSError:
+                return ()
+        digest = hash(raw)
+        memo = self.rule_set_urls.get(config_name)
+        if memo is None or memo[0]!=digest:
+            try:
+                urls = tuple(sorted({rule_set["url"] for rule_set in remote_rule_sets(json.loads(raw))}))
+            except (ValueError, AttributeError):
+                urls = ()
+            memo = (digest,urls)
+            self.rule_set_urls[config_name] = memo
+        return memo[1]
+
+    def _uses_rule_sets(self, urls) -> bool:
+        # Whether the in-use config references any of `urls`, i.e. whether a change to them is worth a reload
+        use_config = self.get_setting("use_config","")
+        return bool(use_config and set(urls)&set(self._rule_set_urls(use_config)))
+
+    async def _rule_set_loop(self):
+        while True:
+            await asyncio.sleep(self.get_setting("rule_set_update_interval",24)*3600)
+            try:
+                changed = await self.rule_sets.refresh(concurrency=self.get_setting("refresh_concurrency",4))
+                # Also retry rule-sets whose first fetch failed and are still remote in the running config
+                with open(RUNNING_CONFIG,"r") as file:
+                    missing = remote_rule_sets(json.load(file))
+                if missing:
+                    changed += await self.rule_sets.fetch(missing)
+                if self._uses_rule_sets(changed):
+                    await self.apply_config()
+            except (OSError, ValueError) as e:
+                decky.logger.error(f'Rule-set refresh failed: {e}')
+
+    def current_profile(self) -> str:
+        # A profile bound to the running game wins over the manually selected one
+        app_profiles = self.get_setting("app_profiles",{})
+        if self.running_app is not None and self.running_app in app_profiles:
+            return app_profiles[self.running_app]
+        return self.get_setting("active_profile","default")
+
+    async def list_route_profiles(self) -> dict:
+        """
+        Returns the built-in and user routing profiles, the manually selected `active` one, the `app_profiles`
+        bindings (app id -> profile), the `running_app` and the profile `current`ly applied.
+        """
+        return {
+            "profiles":{**profiles.BUILTIN_PROFILES,**self.get_setting("route_profiles",{})},
+            "active":self.get_setting("active_profile","default"),
+            "app_profiles":self.get_setting("app_profiles",{}),
+            "running_app":self.running_app,
+            "current":self.current_profile(),
+        }
+
+    async def save_route_profile(self, name: str, profile: dict) -> bool:
+        try:
+            profile = profiles.validate_profile(profile)
+        except ValueError as e:
+            decky.logger.error(f'Invalid routing profile {name}: {e}')
+            return False
+        route_profiles = self.get_setting("route_profiles",{})
+        route_profiles[name] = profile
+        self.set_setting("route_profiles",route_profiles)
+        if self.current_profile()==name:
+            await self.apply_config()
+        return True
+
+    async def delete_route_profile(self, name: str) -> bool:
+        route_profiles = self.get_setting("route_profiles",{})
+        if route_profiles.pop(name,None) is None:
+            return False
+        was_current = self.current_profile()==name
+        with self.settings.transaction() as changes:
+            changes["route_profiles"]=route_profiles
+            if self.get_setting("active_profile","default")==name:
+                changes["active_profile"]="default"
+            changes["app_profiles"]={app:bound for app,bound in self.get_setting("app_profiles",{}).items() if bound!=name}
+        if was_current:
+            await self.apply_config()
+        return True
+
+    async def set_active_profile(self, name: str) -> bool:
+        previous = self.current_profile()
+        self.set_setting("active_profile",name)
+        if self.current_profile()!=previous:
+            await self.apply_config()
+        return True
+
+    async def set_app_profile(self, app_id, name: str) -> bool:
+        """
+        Binds a routing profile to a Steam app id; an empty `name` removes the binding.
+        """
+        previous = self.current_profile()
+        app_profiles = self.get_setting("app_profiles",{})
+        if name:
+            app_profiles[str(app_id)] = name
+        else:
+            app_profiles.pop(str(app_id),None)
+        self.set_setting("app_profiles",app_profiles)
+        if self.current_profile()!=previous:
+            await self.apply_config()
+        return True
+
+    async def app_lifetime(self, app_id, running: bool) -> str:
+        """
+        Called by the frontend when a game starts or exits. Switches to the game's routing profile (or back) through
+        a hot reload when the effective profile changes.
+
+        Returns:
+        str: The profile now in effect.
+        """
+        previous = self.current_profile()
+        if running:
+            self.running_app = str(app_id)
+        elif self.running_app==str(app_id):
+            self.running_app = None
+        current = self.current_profile()
+        if current!=previous:
+            decky.logger.info(f'App {app_id} {"started" if running else "exited"}, switching routing profile {previous} -> {current}')
+            await self.apply_config()
+        return current
+
+    async def set_refresh_interval(self, minutes) -> bool:
+        self.set_setting("refresh_interval",max(0,int(minutes)))
+        self.refresh_wakeup.set()
+        return True
     
     async def delete_config(self,config_name: str) -> bool:
         configs = self.get_setting("configs",{})
         cur_in_use_config = self.get_setting("use_config","")
+        merged = self._merged_members()
         if configs.get(config_name):
             if os.path.exists(Path(SB_HOME) / "{}.json".format(config_name)):
                 os.remove(Path(SB_HOME) / "{}.json".format(config_name))
+                if os.path.exists(Path(SB_HOME) / "{}.source".format(config_name)):
+                    os.remove(Path(SB_HOME) / "{}.source".format(config_name))
                 decky.logger.info(f'Removed config {Path(SB_HOME) / "{}.json".format(config_name)}')
                 configs.pop(config_name,None)
-                self.set_setting("configs",configs)
+                with self.settings.transaction() as changes:
+                    changes["configs"]=configs
+                    if cur_in_use_config==config_name:
+                        changes["use_config"]=""
+                    if config_name in merged:
+                        changes["merged_configs"]=[name for name in merged if name!=config_name]
                 if cur_in_use_config==config_name:
-                    # We need to stop sing-box then delete
-                    self.set_setting("use_config","")
-                    pass
+                    await self.stop_singbox()
+                    self.notify("config_switched","")
+                elif cur_in_use_config==merge.MERGED_CONFIG and config_name in merged:
+                    await self._refresh_merged()
+                self.notify("configs_changed")
                 return True
         return False
 
@@ -166,14 +688,28 @@ class Plugin:
             if config_key=="selected":
                 selected = config_value
                 if selected and cur_in_use_config!=config_name:
+                    result = await self.validate_config(config_name)
+                    if result["valid"]==False:
+                        decky.logger.error(f'Refusing to switch to invalid config {config_name}: {result["error"]}')
+                        return False
                     # We switched select status
                     cur_in_use_config = config_name
                     self.set_setting("use_config",cur_in_use_config)
-                    # We need to restart sing-box to take effect
+                    self.notify("config_switched",cur_in_use_config)
+                    await self.apply_config()
                 elif not selected and cur_in_use_config==config_name:
                     cur_in_use_config=""
                     self.set_setting("use_config",cur_in_use_config)
-                    # We need to stop sing-box to take effect
+                    self.notify("config_switched",cur_in_use_config)
+                    await self.stop_singbox()
+            elif config_key=="merged":
+                members = [name for name in self._merged_members() if name!=config_name]
+                if config_value:
+                    members.append(config_name)
+                self.set_setting("merged_configs",members)
+                if cur_in_use_config==merge.MERGED_CONFIG:
+                    await self._refresh_merged()
+                self.notify("configs_changed")
             decky.logger.info(f'Updated config {config_name} {config_key} -> {config_value}')
             return True
         return False
@@ -183,40 +719,107 @@ class Plugin:
         configs = self.get_setting("configs",{})
         decky.logger.info(f'config settings {configs}')
         cur_in_use_config = self.get_setting("use_config","")
+        if config_name==merge.MERGED_CONFIG:
+            decky.logger.error(f'{config_name} is reserved for the merged config')
+            return False
 
 
-        result = await self.download_file(config_url,SB_HOME,"{}.json".format(config_name))
+        detail = {"url":config_url}
+        try:
+            result = await self.fetch_config(config_name,detail,conditional=False)
+        except download.DownloadError as e:
+            decky.logger.error(f'Download of config {config_name} failed: {e}')
+            result = False
         decky.logger.info(f'Downloaded config {config_url} {result}')
         if result:
-            configs[config_name]={"url":config_url}
-            self.set_setting("configs",configs)
+            configs[config_name]=detail
+            with self.settings.transaction() as changes:
+                changes["configs"]=configs
+                if cur_in_use_config=="":
+                    changes["use_config"]=config_name
             if cur_in_use_config=="":
-                self.set_setting("use_config",config_name)
+                self.notify("config_switched",config_name)
+            self.notify("configs_changed")
             decky.logger.info(f'config settings after update {configs}')
             return True
         return False
     
-    def parse_and_modify_config(self,config_name) -> bool:
+    def dns_options(self, config_name) -> dict:
+        # The merged config takes the DNS options of its primary subscription
+        if config_name==merge.MERGED_CONFIG:
+            members = self._merged_members()
+            config_name = members[0] if members else ""
+        detail = self.get_setting("configs",{}).get(config_name) or {}
+        return dns.resolve(self.get_setting("dns_overlay",{}),detail.get("dns"))
+
+    async def get_dns_options(self, config_name="") -> dict:
+        """
+        Returns the DNS overlay options set for all subscriptions (`global`), those set for `config_name` only
+        (`config`) and the `effective` result.
+        """
+        detail = self.get_setting("configs",{}).get(config_name) or {}
+        return {"global":self.get_setting("dns_overlay",{}),"config":detail.get("dns") or {},
+                "effective":self.dns_options(config_name)}
+
+    async def set_dns_options(self, options: dict, config_name="") -> bool:
+        """
+        Changes the DNS overlay options of every subscription, or of `config_name` only, where they override the
+        global ones key by key. Keys set to None go back to the inherited value. See `dns.validate_options` for the
+        keys. The in-use config is hot reloaded if its options changed.
+        """
+        try:
+            validated = dns.validate_options(options)
+        except ValueError as e:
+            decky.logger.error(f"Invalid DNS options: {e}")
+            return False
+        configs = self.get_setting("configs",{})
+        if config_name and not configs.get(config_name):
+            return False
+        current = dict((configs[config_name].get("dns") if config_name else self.get_setting("dns_overlay",{})) or {})
+        for key,value in options.items():
+            if value is None:
+                current.pop(key,None)
+        current.update(validated)
+        if config_name:
+            configs[config_name]["dns"] = current
+            self.set_setting("configs",configs)
+        else:
+            self.set_setting("dns_overlay",current)
+        self.notify("configs_changed")
+        await self.apply_config()
+        return True
+
+    def config_overlay(self, config_name="", runtime=True) -> dict:
+        """
+        Returns the settings a running config is generated with on top of the subscription.
+
+        Without `runtime`, per-run state is left out: the running game's routing profile (the manually selected one
+        is used), the preferred outbound, a tuning run's TUN options and its loopback target. It changes with every
+        game launch, node pick or tuning step but never makes a subscription valid or invalid, so validation
+        verdicts are keyed on the overlay without it.
+        """
         log_config={
-            "level": "warn",
-            "timestamp": True
+            "level": self.get_setting("log_level","warn"),
+            "timestamp": True,
+            "disable_color": True
         }
         webui_config={
-            "external_controller": "127.0.0.1:9090",
+            "external_controller": CLASH_API,
             "external_ui": os.path.join(SB_HOME,"web"),
             "secret": "",
             "default_mode": "rule"
         }
+        tun_options=self.tun_options(runtime)
         tun_config={
         "type": "tun",
         "tag": "tun-in",
-        "interface_name": "tun0",
+        "interface_name": tun.INTERFACE,
         "address": [
             "172.18.0.1/30",
             "fdfe:dcba:9876::1/126"
         ],
-        "mtu": 9000,
-        "gso": True,
+        "mtu": tun_options["mtu"],
+        "gso": tun_options["gso"],
         "auto_route": True,
         "strict_route": True,
         "route_address": [
@@ -230,7 +833,7 @@ class Plugin:
             "fc00::/7"
         ],
         "sniff":True,
-        "stack": "system",
+        "stack": tun_options["stack"],
         "platform": {
             "http_proxy": {
                 "enabled": False,
@@ -241,114 +844,649 @@ class Plugin:
             }
         }
         }
-
-        if os.path.exists(os.path.join(SB_HOME,f'{config_name}.json')):
-            config_info = {}
-            try:
-                with open(os.path.join(SB_HOME,f'{config_name}.json'),"r") as file:
-                    config_info=json.load(file)
-            except Exception as e:
-                decky.logger.error(f"config file open fail: {os.path.join(SB_HOME,f'{config_name}.json')} {e.msg}")
-                return False
-            config_info["log"]=log_config
-            if not config_info.get("experimental"):
-                config_info["experimental"]={}
-            config_info["experimental"]["clash_api"]=webui_config
-            if not config_info.get("inbounds"):
-                config_info["inbounds"]={}
-            modify_pos = -1
-            for i in range(0,len(config_info["inbounds"])):
-                if config_info["inbounds"][i]["type"]=="tun":
-                    modify_pos = i
-                    break
-            if modify_pos>=0:
-                config_info["inbounds"][modify_pos]=tun_config
-            else:
-                config_info["inbounds"].append(tun_config)
-            with open(os.path.join(SB_HOME,f'running_config.json'),"w") as file:
-                json.dump(config_info,file)
-            decky.logger.info(f"Modified config save to: {os.path.join(SB_HOME,f'running_config.json')}")
+        cache_file_config={
+            "enabled": True,
+            "path": os.path.join(SB_HOME,"cache.db")
+        }
+        return {"log":log_config,"clash_api":webui_config,"tun":tun_config,"cache_file":cache_file_config,
+                "preferred_outbound":self.get_setting("preferred_outbound","") if runtime else "",
+                "profile":profiles.resolve(self.get_setting("route_profiles",{}),
+                                           self.current_profile() if runtime else self.get_setting("active_profile","default")),
+                "tune_target":self.tune_target if runtime else None,
+                "dns":self.dns_options(config_name)}
+
+    def config_key(self,config_name,runtime=True):
+        """
+        Returns the raw subscription and the cache key its running config would be generated with, or None if the
+        subscription file does not exist.
+        """
+        source = os.path.join(SB_HOME,f'{config_name}.json')
+        if not os.path.exists(source):
+            return None
+        with open(source,"rb") as file:
+            raw = file.read()
+        rule_sets = self.rule_sets.revision(self._rule_set_urls(config_name,raw))
+        return raw, config.cache_key(raw,{**self.config_overlay(config_name,runtime),"rule_sets":rule_sets})
+
+    def parse_and_modify_config(self,config_name,output=RUNNING_CONFIG,runtime=True) -> bool:
+        source = self.config_key(config_name,runtime)
+        if source is None:
+            return False
+        raw, key = source
+        if config.stored_key(output)==key:
+            decky.logger.info(f"Config {config_name} unchanged, reusing {output}")
             return True
-        return False
+        overlay = self.config_overlay(config_name,runtime)
+        try:
+            with tracer.span("stage:parse",config=config_name):
+                config_info = json.loads(raw)
+        except ValueError as e:
+            decky.logger.error(f"config file open fail: {os.path.join(SB_HOME,f'{config_name}.json')} {e}")
+            return False
+        config_info["log"]=overlay["log"]
+        if not config_info.get("experimental"):
+            config_info["experimental"]={}
+        config_info["experimental"]["clash_api"]=overlay["clash_api"]
+        config_info["experimental"]["cache_file"]={**(config_info["experimental"].get("cache_file") or {}),**overlay["cache_file"]}
+        missing_rule_sets = self.rule_sets.localize(config_info)
+        # Validation-only generations never fetch; a subscription's rule-sets are fetched once it is put to use
+        if missing_rule_sets and output in (RUNNING_CONFIG,NEXT_CONFIG):
+            self._schedule_rule_set_fetch(missing_rule_sets)
+        if not config_info.get("inbounds"):
+            config_info["inbounds"]=[]
+        inbounds = config_info["inbounds"]
+        modify_pos = next((i for i,inbound in enumerate(inbounds) if inbound.get("type")=="tun"),-1)
+        if modify_pos>=0:
+            inbounds[modify_pos]=overlay["tun"]
+        else:
+            inbounds.append(overlay["tun"])
+        dns.apply_dns(config_info,overlay["dns"],overlay["profile"],overlay["tun"]["tag"])
+        profiles.apply_profile(config_info,overlay["tun"],overlay["profile"])
+        if overlay["tune_target"]:
+            tuning.route_to_loopback(config_info,overlay["tune_target"])
+        if overlay["preferred_outbound"]:
+            for outbound in config_info.get("outbounds") or []:
+                if outbound.get("type")=="selector" and overlay["preferred_outbound"] in outbound.get("outbounds",[]):
+                    outbound["default"]=overlay["preferred_outbound"]
+        if output==RUNNING_CONFIG:
+            self.latency.clear()
+        with tracer.span("stage:write",config=config_name):
+            config.write_config(output,config_info,key)
+        decky.logger.info(f"Modified config save to: {output}")
+        return True
     
     async def check_and_extract_singbox(self) -> str:
-        extracted = False
-        if not os.path.exists(SB_BINARY):
-            files = os.listdir(SB_BINARY_FOLDER)
-            for file_name in files:
-                if re.match(r'^sing-box.*amd64\.tar\.gz$',file_name):
-                    decky.logger.info(f"tar xzvf {os.path.join(SB_BINARY_FOLDER,file_name)} --strip-components=1 -C {SB_BINARY_FOLDER}")
-                    proc = await asyncio.create_subprocess_exec(
-                        "tar", "xzvf", os.path.join(SB_BINARY_FOLDER,file_name),"--strip-components=1", "-C", SB_BINARY_FOLDER,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.STDOUT,
-                        env=env
-                    )
-                    await proc.communicate()
-                    extracted = True
-                    break
-        if os.path.exists(SB_BINARY):
-            if extracted:
-                # Update version in settings
-                output = os.popen(f"{SB_BINARY} version")
-                for line in output:
-                    result = re.search(r"sing-box version (.+)",line)
-                    if result:
-                        version = result[1].strip()
-                        self.set_setting("version",version)
-                        decky.logger.info(f"Sing Box version: {version}")
-                        return version
-
-    async def start_singbox(self) -> bool:
-        if not os.path.exists(SB_BINARY):
-            await self.check_and_extract_singbox()
-        if os.path.exists(SB_BINARY):
-            cur_in_use_config = self.get_setting("use_config","")
+        version = await self.singbox_binary.ensure(self.get_setting("version",""))
+        if version and version!=self.get_setting("version",""):
+            self.set_setting("version",version)
+        return version
+
+    async def start_singbox(self, config_name=None) -> bool:
+        async with self.singbox_lock:
+            return await self._start_singbox(config_name)
+
+    async def _start_singbox(self, config_name=None) -> bool:
+        if await self.check_and_extract_singbox():
+            cur_in_use_config = self.get_setting("use_config","") if config_name is None else config_name
             if cur_in_use_config:
                 result =self.parse_and_modify_config(cur_in_use_config)
                 if result:
-                    proc = await asyncio.create_subprocess_exec(
-                        "nohup", SB_BINARY,"run","-D",SB_HOME,"-c", os.path.join(SB_HOME,f'running_config.json'),"&",
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.STDOUT,
-                        env=env
-                    )
-                    # os.popen(f"nohup {SB_BINARY} run -c {os.path.join(SB_HOME,f'running_config.json')} &")
+                    validation = await self.validator.check(RUNNING_CONFIG,config.stored_key(RUNNING_CONFIG))
+                    if not validation["valid"]:
+                        decky.logger.error(f'Refusing to start invalid config {cur_in_use_config}: {validation["error"]}')
+                        return False
+                if result and await self.supervisor.start():
+                    self.metrics.start()
                     return True
         else:
             decky.logger.info("Couldn't find sing-box binary")
             return False
         return False
+    async def _before_spawn(self):
+        # Every spawn, including the supervisor's restarts after a crash: clear the stale tun0 and auto_route rules
+        # the last process may have left, and judge the new one's health afresh
+        await tun.release(timeout=0)
+        self.health.reset()
+
     async def stop_singbox(self):
-        for pid in os.popen('pgrep sing-box'):
-            if pid:
-                os.popen(f'kill {pid}')
-                return True
-        return False
+        """
+        Stops sing-box and waits until it has exited, killing it after `stop_timeout` seconds, then verifies that
+        tun0 and its routes are gone.
+
+        Returns:
+        bool: True if a running sing-box was stopped.
+        """
+        async with self.singbox_lock:
+            return await self._stop_singbox()
+
+    async def _stop_singbox(self) -> bool:
+        await self.metrics.stop()
+        stopped = await self.supervisor.stop(timeout=self.get_setting("stop_timeout",5.0))
+        if stopped:
+            await tun.release()
+        return stopped
+
+    async def get_trace(self, recent=50, reset=False) -> dict:
+        """
+        Returns backend timings: a histogram summary (`count`, `errors`, `mean`, `max`, `p50`, `p95`, `p99` in ms
+        and the `buckets`) for every span name, the `recent` spans and the trace `file` if one is written.
+
+        Span names are `call:<callable>` for frontend callables, `child:<callable>` for callables run by another
+        one (with the `parent` in the span), `stage:<stage>` for download, convert, parse, write, validate, extract
+        and spawn, and `loop.lag` for how long the event loop was blocked.
+        """
+        snapshot = tracer.snapshot(int(recent))
+        if reset:
+            tracer.reset()
+        return snapshot
+
+    async def set_trace_options(self, file=None, lag_interval=None) -> bool:
+        """
+        Turns writing every span to `trace.jsonl` in the plugin log folder on or off, and sets how often event loop
+        lag is sampled (seconds, 0 disables). Options left as None keep their current value.
+        """
+        if file is not None:
+            self.set_setting("trace_file",bool(file))
+            tracer.path = TRACE_FILE if file else None
+        if lag_interval is not None:
+            self.set_setting("loop_lag_interval",max(0.0,float(lag_interval)))
+        return True
+
+    async def get_logs(self, lines=100, level="") -> list:
+        """
+        Returns the last `lines` lines of sing-box output, optionally only those at `level` or more severe.
+        Each entry has `time`, `level` and `message`.
+        """
+        return self.singbox_log.tail(int(lines),level)
+
+    async def set_log_level(self, level: str) -> bool:
+        """
+        Changes the sing-box log level (trace, debug, info, warn, error, fatal or panic) and hot reloads it.
+        """
+        if level not in LOG_LEVELS:
+            return False
+        self.set_setting("log_level",level)
+        await self.apply_config()
+        return True
+
+    async def get_metrics(self, history=0) -> dict:
+        """
+        Returns live traffic metrics collected from the Clash API: current up/down rates in bytes per second,
+        totals, active connections, per-outbound usage and the last `history` per-second samples.
+        """
+        return self.metrics.snapshot(int(history))
+
+    def resource_limits(self) -> dict:
+        return {"nice":self.get_setting("resource_nice",None),"affinity":self.get_setting("resource_affinity",[]),
+                "rss_limit":self.get_setting("rss_limit",0),"rss_action":self.get_setting("rss_action",resources.ACTION_WARN)}
+
+    async def _resource_limit(self, event):
+        self.notify("resources",event)
+        if event["action"]==resources.ACTION_RESTART and not self.tuning_lock.locked():
+            decky.logger.warning('Restarting sing-box to release memory')
+            await self._restart_singbox()
+
+    async def get_resources(self, history=0) -> dict:
+        """
+        Returns the resource usage of sing-box sampled from /proc every `resource_interval` seconds (default 5).
+
+        Returns:
+        dict: The `current` sample (or None while sing-box is not running) with `cpu` in percent of one core, `rss`
+              and `rss_peak` in bytes, `threads` and `fds`, the configured `limits`, limit `events` and the last
+              `history` samples.
+        """
+        return self.resources.snapshot(int(history))
+
+    async def set_resource_limits(self, interval=None, nice=None, affinity=None, rss_limit=None, rss_action=None) -> bool:
+        """
+        Configures resource sampling and limits for sing-box. Options left as None keep their current value. Limits
+        are applied to the running process right away; clearing one takes effect at the next start.
+
+        Parameters:
+        interval (int): Seconds between samples, 0 disables sampling and limits.
+        nice (int): Nice level, e.g. 10 to let games win any contention for CPU.
+        affinity (list[int]): CPUs sing-box may run on, to keep it off the cores games use; empty for any CPU.
+        rss_limit (int): RSS ceiling in MiB, 0 for none.
+        rss_action (str): "warn" to only report exceeding the ceiling, "restart" to also restart sing-box.
+        """
+        if rss_action not in (None,resources.ACTION_WARN,resources.ACTION_RESTART):
+            return False
+        try:
+            changes = {"resource_interval":None if interval is None else max(0,int(interval)),
+                       "resource_nice":None if nice is None else min(19,max(-20,int(nice))),
+                       "resource_affinity":None if affinity is None else sorted({int(cpu) for cpu in affinity}),
+                       "rss_limit":None if rss_limit is None else max(0,int(rss_limit)),
+                       "rss_action":rss_action}
+        except (TypeError, ValueError) as e:
+            decky.logger.error(f"Invalid resource limits: {e}")
+            return False
+        self.settings.update({key:value for key,value in changes.items() if value is not None})
+        self.resources.wake()
+        return True
+
+    def tun_options(self, runtime=True) -> dict:
+        # A tuning run temporarily overrides the stored options while it benchmarks a candidate
+        stored = {"stack":self.get_setting("tun_stack",tuning.DEFAULT_STACK),
+                  "mtu":self.get_setting("tun_mtu",tuning.DEFAULT_MTU),
+                  "gso":self.get_setting("tun_gso",tuning.DEFAULT_GSO)}
+        return {**stored,**(self.tun_override or {})} if runtime else stored
+
+    async def get_tun_options(self) -> dict:
+        """
+        Returns the TUN `stack`, `mtu` and `gso` in use and the result of the last tuning run (or None).
+        """
+        return {**self.tun_options(),"stacks":list(tuning.STACKS),"last_tune":self.get_setting("tun_tune",None)}
+
+    async def set_tun_options(self, stack=None, mtu=None, gso=None) -> bool:
+        """
+        Changes the TUN stack (system, gvisor or mixed), MTU and generic segmentation offload, and hot reloads them.
+        Options left as None keep their current value.
+        """
+        current = self.tun_options()
+        try:
+            options = tuning.tun_options(stack if stack is not None else current["stack"],
+                                         mtu if mtu is not None else current["mtu"],
+                                         gso if gso is not None else current["gso"])
+        except (TypeError, ValueError) as e:
+            decky.logger.error(f"Invalid TUN options: {e}")
+            return False
+        self.settings.update({"tun_stack":options["stack"],"tun_mtu":options["mtu"],"tun_gso":options["gso"]})
+        await self.apply_config()
+        return True
+
+    async def tune_tun(self, stacks=None, mtus=None) -> dict:
+        """
+        Benchmarks every combination of TUN stack and MTU and keeps the best one for this device.
+
+        Each candidate is hot reloaded into the running sing-box, then latency and throughput are measured to a
+        loopback target whose traffic is routed through tun0, so the result reflects the kernel, stack and MTU
+        without any upstream noise. The winner is stored as the TUN options and the run is recorded as `tun_tune`.
+
+        Parameters:
+        stacks (list[str]): Stacks to try, all of them by default.
+        mtus (list[int]): MTUs to try, `tuning.TUNE_MTUS` by default.
+
+        Returns:
+        dict: `best` (options or None), `results` ranked best first, each with `stack`, `mtu`, `latency` (ms),
+              `throughput` (bytes per second) and `error`, or just `error` when tuning could not run.
+        """
+        if not self.supervisor.running:
+            return {"error":"sing-box is not running"}
+        if self.tuning_lock.locked():
+            return {"error":"tuning already in progress"}
+        async with self.tuning_lock:
+            target = tuning.LoopbackTarget()
+            self.tune_target = await target.start()
+            results = []
+            try:
+                for stack in stacks or tuning.STACKS:
+                    for mtu in mtus or tuning.TUNE_MTUS:
+                        try:
+                            options = tuning.tun_options(stack,mtu)
+                        except (TypeError, ValueError) as e:
+                            results.append({"stack":stack,"mtu":mtu,"latency":None,"throughput":None,"error":str(e)})
+                            continue
+                        self.tun_override = {"stack":options["stack"],"mtu":options["mtu"]}
+                        if await self.reload_singbox():
+                            result = await tuning.benchmark(self.tune_target)
+                        else:
+                            result = {"latency":None,"throughput":None,"error":"sing-box rejected the options"}
+                        decky.logger.info(f'TUN tuning {stack}/{mtu}: {result}')
+                        results.append({**self.tun_override,**result})
+            finally:
+                self.tun_override = None
+                self.tune_target = None
+                await target.stop()
+            results = tuning.rank(results)
+            best = results[0] if results and results[0]["error"] is None else None
+            with self.settings.transaction() as changes:
+                if best:
+                    changes["tun_stack"]=best["stack"]
+                    changes["tun_mtu"]=best["mtu"]
+                changes["tun_tune"]={"time":time.time(),"results":results}
+            await self.reload_singbox()
+            decky.logger.info(f'TUN tuning finished, best: {best}')
+            return {"best":{"stack":best["stack"],"mtu":best["mtu"]} if best else None,"results":results}
+
+    def _singbox_command(self) -> list:
+        return [SB_BINARY,"run","-D",SB_HOME,"-c",RUNNING_CONFIG]
+
+    async def _kill_stray_singbox(self):
+        proc = await asyncio.create_subprocess_exec(
+            "pgrep", "-f", SB_BINARY,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await proc.communicate()
+        pids = [int(pid) for pid in stdout.decode('utf-8').split() if pid.isdigit()]
+        for pid in pids:
+            decky.logger.info(f'Stopping stray sing-box process {pid}')
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic()+self.get_setting("stop_timeout",5.0)
+        alive = pids
+        while alive and time.monotonic()<deadline:
+            await asyncio.sleep(0.05)
+            alive = [pid for pid in alive if os.path.exists(f'/proc/{pid}')]
+        for pid in alive:
+            decky.logger.warning(f'Killing stray sing-box process {pid}')
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        if pids:
+            await tun.release(timeout=0.5)
     
+    async def reload_singbox(self, config_name=None) -> bool:
+        """
+        Applies the in-use config, or `config_name` if given, to the running sing-box without tearing the process
+        down.
+
+        The new running config is generated next to the current one and checked with `sing-box check`; a broken
+        config is rejected and the tunnel keeps running the old one. A valid config is moved into place and sing-box
+        is sent SIGHUP, which makes it reload in-process. A full restart is only used as a fallback when the process
+        is not running or does not survive the reload.
+
+        Returns:
+        bool: True if sing-box is running the new config.
+        """
+        async with self.singbox_lock:
+            return await self._reload_singbox(config_name)
+
+    async def _reload_singbox(self, config_name=None) -> bool:
+        if not self.supervisor.running:
+            return await self._start_singbox(config_name)
+        cur_in_use_config = self.get_setting("use_config","") if config_name is None else config_name
+        source = self.config_key(cur_in_use_config) if cur_in_use_config else None
+        if source is None:
+            return False
+        if config.stored_key(RUNNING_CONFIG)==source[1]:
+            decky.logger.info(f'Config {cur_in_use_config} unchanged, nothing to reload')
+            return True
+        if not self.parse_and_modify_config(cur_in_use_config,output=NEXT_CONFIG):
+            return False
+        result = await self.validator.check(NEXT_CONFIG,source[1])
+        if not result["valid"]:
+            decky.logger.error(f'Refusing to reload invalid config {cur_in_use_config}: {result["error"]}')
+            os.remove(NEXT_CONFIG)
+            return False
+        config.promote(NEXT_CONFIG,RUNNING_CONFIG)
+        self.latency.clear()
+        if self.supervisor.reload():
+            await asyncio.sleep(RELOAD_GRACE)
+            if self.supervisor.running:
+                decky.logger.info(f'Reloaded sing-box with config {cur_in_use_config}')
+                return True
+        decky.logger.warning('Hot reload failed, restarting sing-box')
+        await self._stop_singbox()
+        if not self.get_setting("enable",False):
+            decky.logger.info('sing-box was switched off meanwhile, not restarting it')
+            return False
+        return await self._start_singbox(config_name)
+
+    async def _restart_singbox(self) -> bool:
+        # In one go under the lock, so a stop requested in between is not undone by the start
+        async with self.singbox_lock:
+            await self._stop_singbox()
+            if not self.get_setting("enable",False):
+                return False
+            return await self._start_singbox()
+
+    async def apply_config(self) -> bool:
+        # Only touch sing-box if the user has it switched on, checked again once the lock is ours
+        async with self.singbox_lock:
+            if self.get_setting("enable",False):
+                return await self._reload_singbox()
+            return False
+
+    def _load_running_config(self) -> dict:
+        # Prefer what sing-box is actually running, fall back to the selected subscription
+        path = RUNNING_CONFIG
+        if not os.path.exists(path):
+            path = os.path.join(SB_HOME,f'{self.get_setting("use_config","")}.json')
+        try:
+            with open(path,"r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _load_outbounds(self) -> list:
+        return self._load_running_config().get("outbounds") or []
+
+    def _proxy_group(self) -> tuple:
+        # The group most traffic leaves through: the route's final outbound if it is a group, else the first selector.
+        # Returned with its member outbounds by tag, and kept per running config so probes don't parse it each time
+        key = config.stored_key(RUNNING_CONFIG)
+        if key is not None and self.running_group is not None and self.running_group[0]==key:
+            return self.running_group[1]
+        running = self._load_running_config()
+        outbounds = {outbound["tag"]:outbound for outbound in running.get("outbounds") or [] if outbound.get("tag")}
+        groups = {tag:outbound for tag,outbound in outbounds.items() if outbound.get("type") in ("selector","urltest")}
+        final = (running.get("route") or {}).get("final")
+        if final in groups:
+            group = groups[final]
+        else:
+            group = next((group for group in groups.values() if group["type"]=="selector"),next(iter(groups.values()),None))
+        members = {tag:outbounds[tag] for tag in (group or {}).get("outbounds") or [] if tag in outbounds}
+        if key is not None:
+            self.running_group = (key,(group,members))
+        return group, members
+
+    async def test_latency(self, force=False) -> list:
+        """
+        Benchmarks every proxy outbound of the running config concurrently, through the Clash API delay test while
+        sing-box is running and by timing a TCP handshake otherwise. Results are cached for `latency_ttl` seconds
+        unless `force` is set.
+
+        Returns:
+        list[dict]: The outbounds ranked by delay, see `LatencyTester.test`.
+        """
+        return await self.latency.test(proxy_outbounds({"outbounds":self._load_outbounds()}),
+                                       url=self.get_setting("latency_test_url",LATENCY_TEST_URL),
+                                       timeout_ms=self.get_setting("latency_timeout",5000),
+                                       use_clash=self.supervisor.running, force=force)
+
+    async def select_best_outbound(self, persist=True) -> dict:
+        """
+        Switches every selector group containing the fastest outbound over to it.
+
+        The switch is applied live through the Clash API when sing-box is running. With `persist`, the outbound is
+        also stored as `preferred_outbound` and becomes the selectors' `default` in generated configs.
+
+        Returns:
+        dict: `selected` (tag or None), `delay`, the `groups` switched and the ranked `results`.
+        """
+        results = await self.test_latency()
+        best = self.latency.best()
+        if best is None:
+            return {"selected":None,"delay":None,"groups":[],"results":results}
+        groups = [outbound["tag"] for outbound in self._load_outbounds()
+                  if outbound.get("type")=="selector" and best["tag"] in outbound.get("outbounds",[])]
+        if self.supervisor.running:
+            for group in groups:
+                try:
+                    await self.clash.request('PUT',f'/proxies/{self.clash.quote(group)}',{"name":best["tag"]})
+                except ClashAPIError as e:
+                    decky.logger.error(f'Failed to switch {group} to {best["tag"]}: {e}')
+        if persist:
+            self.set_setting("preferred_outbound",best["tag"])
+        decky.logger.info(f'Selected outbound {best["tag"]} ({best["delay"]} ms) for {groups}')
+        return {"selected":best["tag"],"delay":best["delay"],"groups":groups,"results":results}
+
+    async def _health_probe(self):
+        # Nothing to probe while sing-box is down, or while a tuning run is reloading it on purpose
+        if not self.supervisor.running or self.tuning_lock.locked():
+            return None
+        url = self.get_setting("health_url",LATENCY_TEST_URL)
+        timeout_ms = self.get_setting("health_timeout",5000)
+        group, _ = self._proxy_group()
+        if self.get_setting("health_method","clash")=="http" or group is None:
+            return await health.probe_http(url,timeout_ms/1000)
+        result = await self.latency.probe(group["tag"],url,timeout_ms)
+        return {"ok":result["delay"] is not None,**result}
+
+    async def _health_failover(self):
+        mode = self.get_setting("health_failover","all")
+        if mode in ("outbound","all"):
+            switched = await self._failover_outbound()
+            if switched:
+                return switched
+        if mode in ("config","all"):
+            return await self._failover_config()
+        return None
+
+    async def _failover_outbound(self):
+        # Only selectors can be switched; a urltest group already moves off dead nodes by itself
+        group, members = self._proxy_group()
+        if group is None or group["type"]!="selector":
+            return None
+        try:
+            status, data = await self.clash.request('GET',f'/proxies/{self.clash.quote(group["tag"])}')
+        except ClashAPIError as e:
+            decky.logger.error(f'Cannot read the selection of {group["tag"]}: {e}')
+            return None
+        current = data.get("now") if status==200 and isinstance(data,dict) else None
+        candidates = [outbound for tag,outbound in members.items() if tag!=current]
+        results = await self.latency.test(candidates,url=self.get_setting("health_url",LATENCY_TEST_URL),
+                                          timeout_ms=self.get_setting("health_timeout",5000),force=True)
+        best = next((result for result in results if result["delay"] is not None),None)
+        if best is None:
+            return None
+        try:
+            await self.clash.request('PUT',f'/proxies/{self.clash.quote(group["tag"])}',{"name":best["tag"]})
+        except ClashAPIError as e:
+            decky.logger.error(f'Failed to switch {group["tag"]} to {best["tag"]}: {e}')
+            return None
+        return {"group":group["tag"],"outbound":best["tag"],"from":current}
+
+    async def _failover_config(self):
+        names = list(self.get_setting("configs",{}))
+        current = self.get_setting("use_config","")
+        if current in names:
+            position = names.index(current)
+            names = names[position+1:]+names[:position]
+        for name in names:
+            if (await self.validate_config(name))["valid"]==False:
+                continue
+            # use_config only moves once the candidate is actually running
+            if await self.reload_singbox(name):
+                self.set_setting("use_config",name)
+                self.notify("config_switched",name)
+                return {"config":name,"from":current}
+        # A candidate that failed after the fallback restart leaves sing-box down; bring the original back
+        if current and not self.supervisor.running:
+            await self.start_singbox()
+        return None
+
+    async def get_health(self) -> dict:
+        """
+        Returns the tunnel health: `healthy` (None until probed), the current streak of `failures`, the
+        `last_probe` result and the recent `events` (probe_failed, recovered, failover, failover_failed).
+        """
+        return self.health.snapshot()
+
+    async def check_health(self) -> dict:
+        """
+        Probes the tunnel right away, failing over if that completes a failure streak.
+        """
+        return await self.health.check()
+
+    async def set_health_options(self, interval=None, threshold=None, url=None, method=None, failover=None) -> bool:
+        """
+        Configures the health watchdog. Options left as None keep their current value.
+
+        Parameters:
+        interval (int): Seconds between probes, 0 disables probing.
+        threshold (int): Consecutive failures before failing over.
+        url (str): URL probed through the tunnel.
+        method (str): "clash" for a Clash API delay test through the main proxy group, "http" to fetch `url` from the
+                      plugin itself through tun0.
+        failover (str): "outbound" to switch the main selector to the fastest other node, "config" to switch to the
+                        next subscription, "all" to try both in that order, or "none".
+        """
+        if method not in (None,"clash","http") or failover not in (None,"outbound","config","all","none"):
+            return False
+        try:
+            changes = {"health_interval":None if interval is None else max(0,int(interval)),
+                       "health_threshold":None if threshold is None else max(1,int(threshold)),
+                       "health_url":None if url is None else str(url),
+                       "health_method":method,"health_failover":failover}
+        except (TypeError, ValueError) as e:
+            decky.logger.error(f"Invalid health options: {e}")
+            return False
+        self.settings.update({key:value for key,value in changes.items() if value is not None})
+        self.health.wake()
+        return True
+
     async def toggle_singbox(self,status):
+        # Recorded first, so a reload that is already under way does not bring sing-box back after a stop
+        self.set_setting("enable",status)
         if status == True:
-            await self.stop_singbox()
-            await self.start_singbox()
+            if self.supervisor.running:
+                await self.reload_singbox()
+            else:
+                await self.start_singbox()
         elif status == False:
             await self.stop_singbox()
-        self.set_setting("enable",status)
     
     async def download_file(self, url='', output_dir='', file_name=''):
         decky.logger.debug({url, output_dir, file_name})
+        if not access(output_dir, W_OK):
+            return False
         try:
-            if access(dirname(output_dir), W_OK):
-                req = Request(url, headers={'User-Agent': 'sing-box'})
-                res = urlopen(req, context=get_ssl_context())
-                if res.status == 200:
-                    with open(Path(output_dir) / file_name, mode='wb') as f:
-                        f.write(res.read())
-                    return str(Path(output_dir) / file_name)
-                return False
-        except:
+            result = await download.fetch(url, str(Path(output_dir) / file_name),
+                                          timeout=self.get_setting("download_timeout",download.DEFAULT_TIMEOUT),
+                                          max_size=self.get_setting("download_max_size",download.DEFAULT_MAX_SIZE))
+        except download.DownloadError as e:
+            decky.logger.error(f'Download failed: {e}')
             return False
+        return result["path"]
 
-        return False
+    async def fetch_config(self, config_name: str, detail: dict, conditional=True, timeout=None) -> dict:
+        """
+        Downloads a subscription into `SB_HOME/{config_name}.source` and converts it into `SB_HOME/{config_name}.json`.
+
+        The `etag` and `last_modified` validators of the response are stored into `detail` (the config's entry in
+        the `configs` setting), so the next refresh can be answered with a 304 and skip the transfer entirely. For
+        providers that send neither, the `sha256` of the download is stored too, and a download identical to the
+        last one is reported as unchanged.
+        Clash YAML and share link subscriptions are converted to sing-box configs locally, see
+        `SubscriptionConverter`; the detected `format` is stored into `detail` too.
+
+        Returns:
+        dict: The `download.fetch` result.
+
+        Raises:
+        DownloadError: If the download failed or the subscription could not be converted.
+        """
+        source = os.path.join(SB_HOME,f'{config_name}.source')
+        with tracer.span("stage:download",config=config_name):
+            result = await download.fetch(detail["url"], source,
+                                          etag=detail.get("etag") if conditional else None,
+                                          last_modified=detail.get("last_modified") if conditional else None,
+                                          timeout=timeout or self.get_setting("download_timeout",download.DEFAULT_TIMEOUT),
+                                          max_size=self.get_setting("download_max_size",download.DEFAULT_MAX_SIZE))
+        exists = os.path.exists(os.path.join(SB_HOME,f'{config_name}.json'))
+        digest = None
+        if result["changed"]:
+            digest = await asyncio.to_thread(config.file_sha256,source)
+            if exists and digest==detail.get("sha256"):
+                result["changed"] = False
+        if result["changed"] or not exists:
+            try:
+                with tracer.span("stage:convert",config=config_name):
+                    conversion = await self.converter.convert(source,os.path.join(SB_HOME,f'{config_name}.json'))
+            except (convert.ConversionError, OSError) as e:
+                raise download.DownloadError(f'Cannot convert {detail["url"]}: {e}') from e
+            detail["format"] = conversion["format"]
+            result["changed"] = True
+        if result["changed"]:
+            detail["etag"] = result["etag"]
+            detail["last_modified"] = result["last_modified"]
+            detail["sha256"] = digest or await asyncio.to_thread(config.file_sha256,source)
+        return result
 
     # async def info(self) -> dict:
     #     """
@@ -584,22 +1722,34 @@ class Plugin:
     # completely removed
     async def _unload(self) -> None:
         decky.logger.info('Stopping SingBox...')
+        await self.health.stop()
+        await self.resources.stop()
+        tasks = [self.refresh_task,self.rule_set_task,self.rule_set_fetch,self.traffic_events,
+                 *self.validations.values()]
+        for task in tasks:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*[task for task in tasks if task is not None],return_exceptions=True)
+        await self.stop_singbox()
+        await self.singbox_log.close()
+        await self.settings.flush()
+        await tracer.stop()
 
 
     # Function called after `_unload` during uninstall, utilize this to clean up processes and other remnants of your
     # plugin that may remain on the system
     async def _uninstall(self) -> None:
-        self._unload()
+        await self._unload()
         decky.logger.info('Uninstalling decky-sbox...')
         # TODO: Clean up your plugin's resources here
         pass
 
     # Migrations that should be performed before entering `_main()`.
     def set_setting(self, key, value):
-        self.settings.setSetting(key, value)
+        self.settings.set(key, value)
 
     def get_setting(self, key, fallback):
-        return self.settings.getSetting(key, fallback)
+        return self.settings.get(key, fallback)
 
     async def _migration(self):
         decky.migrate_settings(str(Path(decky.DECKY_HOME) / "settings" / "deckysbox.json"))
\ No newline at end of file
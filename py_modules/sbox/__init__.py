@@ -0,0 +1,5 @@
+"""
+Backend helpers for decky-sbox.
+
+The decky loader puts `py_modules` on `sys.path`, so these modules are imported by `main.py` as `sbox.<module>`.
+"""
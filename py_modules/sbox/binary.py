@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+import decky
+
+from sbox.config import file_sha256, write_atomic
+from sbox.trace import tracer
+
+TARBALL_PATTERN = re.compile(r'^sing-box-?(.*)-linux-amd64\.tar\.gz$')
+
+
+class SingBoxBinary:
+    """
+    Keeps the extracted sing-box binary and a manifest describing it in sync.
+
+    The manifest records the version, size, mtime and checksum of the extracted binary along with the tarball it came
+    from. As long as a single `stat` of the binary matches the manifest, nothing else is touched: no directory
+    listing, no extraction and no `sing-box version` subprocess. Extraction, when needed, is done in-process with
+    `tarfile` in a worker thread.
+
+    Parameters:
+    binary (str): Path of the sing-box binary.
+    folder (str): Folder holding the bundled `sing-box-*-linux-amd64.tar.gz`.
+    manifest_path (str): Where to persist the manifest.
+    """
+
+    def __init__(self, binary, folder, manifest_path):
+        self.binary = binary
+        self.folder = folder
+        self.manifest_path = manifest_path
+        self._manifest = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def manifest(self) -> dict:
+        if self._manifest is None:
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    self._manifest = json.load(f)
+            except (OSError, ValueError):
+                self._manifest = {}
+        return self._manifest
+
+    @property
+    def version(self) -> str:
+        return self.manifest.get("version", "")
+
+    def current(self) -> bool:
+        """
+        Returns True if the binary on disk is the one described by the manifest. Costs a single `stat`.
+        """
+        manifest = self.manifest
+        if not manifest:
+            return False
+        try:
+            st = os.stat(self.binary)
+        except FileNotFoundError:
+            return False
+        return st.st_size == manifest.get("size") and st.st_mtime_ns == manifest.get("mtime_ns")
+
+    def _find_tarball(self):
+        for file_name in os.listdir(self.folder):
+            if TARBALL_PATTERN.match(file_name):
+                return file_name
+        return None
+
+    def _extract(self, tarball) -> str:
+        with tarfile.open(os.path.join(self.folder, tarball), 'r:gz') as archive:
+            member = next((m for m in archive.getmembers() if m.isfile() and os.path.basename(m.name) == 'sing-box'), None)
+            if member is None:
+                raise FileNotFoundError(f"No sing-box binary in {tarball}")
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.sing-box.')
+            try:
+                with os.fdopen(fd, 'wb') as f, archive.extractfile(member) as src:
+                    shutil.copyfileobj(src, f)
+                os.chmod(tmp_path, 0o755)
+                os.replace(tmp_path, self.binary)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return TARBALL_PATTERN.match(tarball)[1]
+
+    def _probe_version(self) -> str:
+        output = subprocess.run([self.binary, "version"], capture_output=True, text=True).stdout
+        result = re.search(r"sing-box version (.+)", output)
+        return result[1].strip() if result else ""
+
+    def _record(self, version, tarball) -> dict:
+        st = os.stat(self.binary)
+        manifest = {
+            "version": version,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": file_sha256(self.binary),
+            "tarball": tarball,
+        }
+        write_atomic(self.manifest_path, json.dumps(manifest).encode())
+        return manifest
+
+    def _refresh_blocking(self, fallback_version):
+        manifest = self.manifest
+        if os.path.exists(self.binary):
+            # Same content with a new mtime (e.g. copied back in place) only needs the manifest updated
+            if manifest and file_sha256(self.binary) == manifest.get("sha256"):
+                return self._record(manifest["version"], manifest.get("tarball"))
+            if not manifest and fallback_version:
+                return self._record(fallback_version, None)
+        tarball = self._find_tarball()
+        if tarball is None:
+            if os.path.exists(self.binary):
+                return self._record(self._probe_version(), None)
+            return None
+        decky.logger.info(f"Extracting sing-box from {tarball}")
+        version = self._extract(tarball)
+        return self._record(version, tarball)
+
+    async def ensure(self, fallback_version="") -> str:
+        """
+        Makes sure an extracted binary matching the manifest exists, extracting it from the bundled tarball if the
+        manifest is stale.
+
+        Parameters:
+        fallback_version (str): Version to record for a binary that predates the manifest.
+
+        Returns:
+        str: The sing-box version, or an empty string if no binary is available.
+        """
+        if self.current():
+            return self.version
+        async with self._lock:
+            if self.current():
+                return self.version
+            try:
+                with tracer.span("stage:extract"):
+                    manifest = await asyncio.to_thread(self._refresh_blocking, fallback_version)
+            except (OSError, tarfile.TarError) as e:
+                decky.logger.error(f"Failed to extract sing-box: {e}")
+                return ""
+            if manifest is None:
+                decky.logger.info("Couldn't find sing-box binary or tarball")
+                return ""
+            self._manifest = manifest
+            decky.logger.info(f"Sing Box version: {manifest['version']}")
+            return manifest["version"]
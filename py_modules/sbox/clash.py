@@ -0,0 +1,193 @@
+import asyncio
+import json
+from urllib.parse import quote
+
+
+class ClashAPIError(Exception):
+    pass
+
+
+async def _read_headers(reader) -> tuple:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ClashAPIError("Connection closed by sing-box")
+    parts = status_line.decode('latin-1').split(' ', 2)
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise ClashAPIError(f"Malformed status line: {status_line!r}")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    return int(parts[1]), headers
+
+
+async def _iter_body(reader, status, headers):
+    if status in (204, 304) or status < 200:
+        return
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                return
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                await reader.readline()
+                return
+            chunk = await reader.readexactly(size)
+            await reader.readexactly(2)
+            yield chunk
+    elif 'content-length' in headers:
+        length = int(headers['content-length'])
+        if length:
+            yield await reader.readexactly(length)
+    else:
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _decode(body: bytes):
+    if not body.strip():
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode('utf-8', 'replace')
+
+
+class ClashAPI:
+    """
+    A minimal asyncio client for the Clash-compatible API sing-box exposes through `experimental.clash_api`.
+
+    Only what the plugin needs is implemented: plain HTTP/1.1 requests over a loopback TCP connection, keep-alive
+    sessions for periodic polling, and line-delimited JSON streams such as `/traffic`.
+
+    Parameters:
+    controller (str): `host:port` of the external controller.
+    secret (str): The API secret, sent as a bearer token when set.
+    """
+
+    def __init__(self, controller="127.0.0.1:9090", secret=""):
+        host, _, port = controller.rpartition(':')
+        self.host = host or '127.0.0.1'
+        self.port = int(port)
+        self.secret = secret
+
+    @staticmethod
+    def quote(name: str) -> str:
+        return quote(name, safe='')
+
+    def _request_bytes(self, method, path, body=None, keep_alive=False) -> bytes:
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                 f'Connection: {"keep-alive" if keep_alive else "close"}']
+        if self.secret:
+            lines.append(f'Authorization: Bearer {self.secret}')
+        payload = b''
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            lines.append('Content-Type: application/json')
+        lines.append(f'Content-Length: {len(payload)}')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload
+
+    async def _open(self, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ClashAPIError(f"Cannot reach Clash API at {self.host}:{self.port}: {e}") from e
+
+    async def request(self, method, path, body=None, timeout=5.0) -> tuple:
+        """
+        Sends a single request and returns `(status, data)`, where `data` is the decoded JSON body (or text).
+
+        Raises:
+        ClashAPIError: If the API cannot be reached or the response is malformed or too slow.
+        """
+        reader, writer = await self._open(timeout)
+        try:
+            writer.write(self._request_bytes(method, path, body))
+            await writer.drain()
+
+            async def read():
+                status, headers = await _read_headers(reader)
+                return status, _decode(b''.join([chunk async for chunk in _iter_body(reader, status, headers)]))
+
+            return await asyncio.wait_for(read(), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            raise ClashAPIError(f"{method} {path} failed: {e!r}") from e
+        finally:
+            writer.close()
+
+    async def stream(self, path, timeout=5.0):
+        """
+        Yields each JSON object of a line-delimited stream such as `/traffic` or `/logs` until the connection closes.
+
+        Raises:
+        ClashAPIError: If the API cannot be reached or answers with an error.
+        """
+        reader, writer = await self._open(timeout)
+        try:
+            writer.write(self._request_bytes('GET', path))
+            await writer.drain()
+            status, headers = await asyncio.wait_for(_read_headers(reader), timeout)
+            if status != 200:
+                raise ClashAPIError(f"GET {path} returned HTTP {status}")
+            buffer = b''
+            async for chunk in _iter_body(reader, status, headers):
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    if line.strip():
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            raise ClashAPIError(f"GET {path} stream failed: {e!r}") from e
+        finally:
+            writer.close()
+
+    def session(self):
+        return ClashSession(self)
+
+
+class ClashSession:
+    """
+    A keep-alive connection for repeated requests, reconnecting transparently when sing-box closes it.
+    """
+
+    def __init__(self, api: ClashAPI):
+        self.api = api
+        self._reader = None
+        self._writer = None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def get(self, path, timeout=5.0):
+        for attempt in range(2):
+            if self._writer is None:
+                self._reader, self._writer = await self.api._open(timeout)
+            try:
+                self._writer.write(self.api._request_bytes('GET', path, keep_alive=True))
+                await self._writer.drain()
+
+                async def read():
+                    status, headers = await _read_headers(self._reader)
+                    body = b''.join([chunk async for chunk in _iter_body(self._reader, status, headers)])
+                    if headers.get('connection', '').lower() == 'close':
+                        self.close()
+                    return status, _decode(body)
+
+                return await asyncio.wait_for(read(), timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ClashAPIError, ValueError) as e:
+                self.close()
+                # A reused connection may have been dropped by the server; retry once on a fresh one
+                if attempt:
+                    raise ClashAPIError(f"GET {path} failed: {e!r}") from e
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# Bump when the way overlays are applied changes, so configs generated by older code are rebuilt
+CONFIG_FORMAT = 1
+
+
+def cache_key(source: bytes, overlay: dict) -> str:
+    """
+    Returns the cache key of a generated config: a hash of the subscription's raw bytes and the overlay settings.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(CONFIG_FORMAT).encode())
+    digest.update(source)
+    digest.update(json.dumps(overlay, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _key_path(path) -> str:
+    return f'{path}.key'
+
+
+def stored_key(path):
+    """
+    Returns the cache key `path` was generated from, or None if it is missing or was not written by `write_config`.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(_key_path(path), 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_config(path, config: dict, key: str):
+    """
+    Atomically writes a generated config and records the cache key it was generated from.
+
+    The old key is dropped first, so a crash between the two writes leaves a config without a key (rebuilt on the
+    next start) rather than a stale key pointing at a different config.
+    """
+    try:
+        os.remove(_key_path(path))
+    except FileNotFoundError:
+        pass
+    write_atomic(path, json.dumps(config).encode('utf-8'))
+    write_atomic(_key_path(path), key.encode())
+
+
+def promote(src, dst):
+    """
+    Moves a generated config and its cache key over `dst`.
+    """
+    try:
+        os.remove(_key_path(dst))
+    except FileNotFoundError:
+        pass
+    os.replace(src, dst)
+    if os.path.exists(_key_path(src)):
+        os.replace(_key_path(src), _key_path(dst))
@@ -0,0 +1,587 @@
+import asyncio
+import base64
+import binascii
+import json
+import os
+import re
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import decky
+
+from sbox.config import file_sha256, write_atomic
+
+FORMAT_SINGBOX = "sing-box"
+FORMAT_CLASH = "clash"
+FORMAT_LINKS = "links"
+
+PROXY_GROUP = "Proxy"
+AUTO_GROUP = "Auto"
+CHUNK_SIZE = 64 * 1024
+# How much of a subscription is looked at to tell its format
+SNIFF_SIZE = 4096
+
+_BASE64 = re.compile(rb'^[A-Za-z0-9+/=_\-\s]+$')
+
+
+class ConversionError(Exception):
+    pass
+
+
+def detect(head: bytes) -> str:
+    """
+    Tells a sing-box JSON config, a base64 or plain list of share links and a Clash YAML config apart from the first
+    bytes of a subscription.
+    """
+    head = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if head.startswith(b'{'):
+        return FORMAT_SINGBOX
+    if _BASE64.match(head[:SNIFF_SIZE]) or re.search(rb'^[a-z0-9]+://', head, re.MULTILINE):
+        return FORMAT_LINKS
+    return FORMAT_CLASH
+
+
+# --- Share links ---------------------------------------------------------------------------------------------------
+
+def _b64decode(text: str) -> bytes:
+    text = text.strip().replace('-', '+').replace('_', '/')
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _iter_link_lines(f):
+    """
+    Yields the lines of a share link list, decoding it incrementally if the whole list is base64 encoded.
+    """
+    head = f.read(SNIFF_SIZE)
+    encoded = not re.search(rb'^[a-z0-9]+://', head, re.MULTILINE)
+    carry, pending = b'', b''
+    chunk = head
+    while chunk:
+        if encoded:
+            pending += re.sub(rb'\s+', b'', chunk).replace(b'-', b'+').replace(b'_', b'/')
+            usable = len(pending) - len(pending) % 4
+            try:
+                data = base64.b64decode(pending[:usable])
+            except binascii.Error as e:
+                raise ConversionError(f"invalid base64 subscription: {e}") from e
+            pending = pending[usable:]
+        else:
+            data = chunk
+        lines = (carry + data).split(b'\n')
+        carry = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8', 'replace').strip()
+        chunk = f.read(CHUNK_SIZE)
+    if pending:
+        carry += _b64decode(pending.decode())
+    if carry:
+        yield carry.decode('utf-8', 'replace').strip()
+
+
+def _query(url) -> dict:
+    return {key: values[0] for key, values in parse_qs(url.query).items()}
+
+
+def _flag(value) -> bool:
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+def _tls(server_name=None, insecure=False, alpn=None, fingerprint=None, public_key=None, short_id=None) -> dict:
+    tls = {"enabled": True}
+    if server_name:
+        tls["server_name"] = server_name
+    if insecure:
+        tls["insecure"] = True
+    if alpn:
+        tls["alpn"] = alpn if isinstance(alpn, list) else str(alpn).split(',')
+    if fingerprint:
+        tls["utls"] = {"enabled": True, "fingerprint": fingerprint}
+    if public_key:
+        tls["reality"] = {"enabled": True, "public_key": public_key, "short_id": short_id or ""}
+        tls.setdefault("utls", {"enabled": True, "fingerprint": "chrome"})
+    return tls
+
+
+def _transport(network, path=None, host=None, service_name=None):
+    if network == "ws":
+        transport = {"type": "ws", "path": path or "/"}
+        if host:
+            transport["headers"] = {"Host": host}
+        return transport
+    if network == "grpc":
+        return {"type": "grpc", "service_name": service_name or path or ""}
+    if network in ("h2", "http"):
+        transport = {"type": "http", "path": path or "/"}
+        if host:
+            transport["host"] = host if isinstance(host, list) else [host]
+        return transport
+    return None
+
+
+def _with_transport(outbound, transport):
+    if transport:
+        outbound["transport"] = transport
+    return outbound
+
+
+def _parse_vmess(body):
+    data = json.loads(_b64decode(body))
+    outbound = {"type": "vmess", "tag": data.get("ps") or data.get("add"), "server": data["add"],
+                "server_port": int(data["port"]), "uuid": data["id"], "alter_id": int(data.get("aid") or 0),
+                "security": data.get("scy") or "auto"}
+    if data.get("tls") == "tls":
+        outbound["tls"] = _tls(data.get("sni") or data.get("host"), alpn=data.get("alpn"), fingerprint=data.get("fp"))
+    return _with_transport(outbound, _transport(data.get("net"), data.get("path"), data.get("host"), data.get("path")))
+
+
+def _parse_trojan(url):
+    query = _query(url)
+    outbound = {"type": "trojan", "tag": unquote(url.fragment) or url.hostname, "server": url.hostname,
+                "server_port": url.port or 443, "password": unquote(url.username or ""),
+                "tls": _tls(query.get("sni") or query.get("peer"), _flag(query.get("allowInsecure")),
+                            query.get("alpn"), query.get("fp"))}
+    return _with_transport(outbound, _transport(query.get("type"), query.get("path"), query.get("host"),
+                                                query.get("serviceName")))
+
+
+def _parse_vless(url):
+    query = _query(url)
+    outbound = {"type": "vless", "tag": unquote(url.fragment) or url.hostname, "server": url.hostname,
+                "server_port": url.port or 443, "uuid": unquote(url.username or "")}
+    if query.get("flow"):
+        outbound["flow"] = query["flow"]
+    if query.get("security") in ("tls", "reality"):
+        outbound["tls"] = _tls(query.get("sni"), _flag(query.get("allowInsecure")), query.get("alpn"),
+                               query.get("fp"), query.get("pbk"), query.get("sid"))
+    return _with_transport(outbound, _transport(query.get("type"), query.get("path"), query.get("host"),
+                                                query.get("serviceName")))
+
+
+def _parse_shadowsocks(url, body):
+    if url.hostname is None or url.username is None:
+        # Legacy form: the whole `method:password@host:port` is base64 encoded
+        decoded = _b64decode(body.split('#')[0].split('?')[0]).decode()
+        url = urlsplit(f"ss://{decoded}#{url.fragment}")
+        userinfo = f"{url.username}:{url.password}"
+    elif url.password is not None:
+        userinfo = f"{unquote(url.username)}:{unquote(url.password)}"
+    else:
+        userinfo = _b64decode(unquote(url.username)).decode()
+    method, _, password = userinfo.partition(':')
+    outbound = {"type": "shadowsocks", "tag": unquote(url.fragment) or url.hostname, "server": url.hostname,
+                "server_port": url.port, "method": method, "password": password}
+    plugin = _query(url).get("plugin")
+    if plugin:
+        name, _, options = plugin.partition(';')
+        outbound.update({"plugin": "obfs-local" if name in ("obfs-local", "simple-obfs") else name,
+                         "plugin_opts": options})
+    return outbound
+
+
+def _parse_hysteria2(url):
+    query = _query(url)
+    password = unquote(url.username or "")
+    if url.password is not None:
+        password += ':' + unquote(url.password)
+    outbound = {"type": "hysteria2", "tag": unquote(url.fragment) or url.hostname, "server": url.hostname,
+                "server_port": url.port or 443, "password": password,
+                "tls": _tls(query.get("sni") or query.get("peer") or url.hostname, _flag(query.get("insecure")),
+                            query.get("alpn") or "h3")}
+    if query.get("obfs"):
+        outbound["obfs"] = {"type": query["obfs"], "password": query.get("obfs-password", "")}
+    return outbound
+
+
+def parse_link(link: str):
+    """
+    Converts one share link into a sing-box outbound.
+
+    Returns:
+    dict: The outbound, or None if the scheme is not supported.
+
+    Raises:
+    ValueError: If the link is malformed.
+    """
+    scheme, _, body = link.partition('://')
+    scheme = scheme.lower()
+    if scheme == "vmess":
+        return _parse_vmess(body)
+    url = urlsplit(link)
+    if scheme == "trojan":
+        return _parse_trojan(url)
+    if scheme == "vless":
+        return _parse_vless(url)
+    if scheme == "ss":
+        return _parse_shadowsocks(url, body)
+    if scheme in ("hy2", "hysteria2"):
+        return _parse_hysteria2(url)
+    return None
+
+
+def _iter_links(f):
+    for line in _iter_link_lines(f):
+        if not line or '://' not in line:
+            continue
+        try:
+            outbound = parse_link(line)
+        except (ValueError, KeyError, TypeError, UnicodeDecodeError, binascii.Error) as e:
+            decky.logger.debug(f"Skipping malformed share link: {e}")
+            yield None
+            continue
+        yield outbound
+
+
+# --- Clash YAML ----------------------------------------------------------------------------------------------------
+
+def _strip_comment(text: str) -> str:
+    quote = None
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == '#' and (i == 0 or text[i - 1] in ' \t'):
+            return text[:i].rstrip()
+    return text.rstrip()
+
+
+def _scalar(text: str):
+    # Plain scalars stay strings: a password like 012345 or a short-id like 0123 must keep its exact text. The few
+    # numeric and boolean fields are converted where they are read
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return json.loads(text)
+    if len(text) >= 2 and text[0] == text[-1] == "'":
+        return text[1:-1].replace("''", "'")
+    if text.lower() in ("", "~", "null"):
+        return None
+    return text
+
+
+def _flow(text: str, pos=0):
+    """
+    Parses a YAML flow collection (`{a: 1, b: [x, y]}`) or scalar starting at `pos`, returning it and the end.
+    """
+    while pos < len(text) and text[pos] == ' ':
+        pos += 1
+    if pos < len(text) and text[pos] in '{[':
+        closing = '}' if text[pos] == '{' else ']'
+        result = {} if closing == '}' else []
+        pos += 1
+        while True:
+            while pos < len(text) and text[pos] in ' ,':
+                pos += 1
+            if pos >= len(text):
+                raise ValueError("unterminated flow collection")
+            if text[pos] == closing:
+                return result, pos + 1
+            if closing == ']':
+                value, pos = _flow(text, pos)
+                result.append(value)
+                continue
+            key, pos = _flow_scalar(text, pos, key=True)
+            if pos < len(text) and text[pos] == ':':
+                pos += 1
+            value, pos = _flow(text, pos)
+            result[str(key)] = value
+    return _flow_scalar(text, pos)
+
+
+def _flow_scalar(text: str, pos: int, key=False):
+    while pos < len(text) and text[pos] == ' ':
+        pos += 1
+    if pos < len(text) and text[pos] in '"\'':
+        quote, end = text[pos], pos + 1
+        while end < len(text):
+            if text[end] == '\\' and quote == '"':
+                end += 2
+                continue
+            if text[end] == quote:
+                if quote == "'" and text[end + 1:end + 2] == "'":
+                    end += 2
+                    continue
+                break
+            end += 1
+        return _scalar(text[pos:end + 1]), end + 1
+    end = pos
+    while end < len(text) and text[end] not in ',]}':
+        # In a flow mapping a key ends at `: `; plain values may contain colons (URLs, IPv6)
+        if key and text[end] == ':' and (end + 1 == len(text) or text[end + 1] in ' ,}'):
+            break
+        end += 1
+    return _scalar(text[pos:end]), end
+
+
+def _split_key(text: str):
+    """
+    Splits a block mapping line into its key and the rest, or returns None if it is not a `key: value` line.
+    """
+    if text[:1] in '"\'':
+        key, pos = _flow_scalar(text, 0)
+        rest = text[pos:].lstrip()
+        return (str(key), rest[1:].strip()) if rest.startswith(':') else None
+    match = re.match(r'^([^:]+?):(?:\s+(.*))?$', text)
+    if match is None:
+        return None
+    return match.group(1).strip(), (match.group(2) or "").strip()
+
+
+def _value(text: str):
+    return _flow(text)[0] if text[:1] in '{[' else _scalar(text)
+
+
+def _block(lines: list, i: int, indent: int):
+    """
+    Parses the block mapping or sequence whose lines start at `i` with indentation `indent`.
+    """
+    if lines[i][1].startswith('-'):
+        result = []
+        while i < len(lines) and lines[i][0] == indent and lines[i][1].startswith('-'):
+            item = lines[i][1][1:]
+            stripped = item.lstrip()
+            if stripped and not stripped.startswith(('{', '[')) and _split_key(stripped):
+                # `- key: value` opens a mapping whose keys line up with `key`
+                lines[i] = (indent + 1 + len(item) - len(stripped), stripped)
+                value, i = _block(lines, i, lines[i][0])
+            elif not stripped and i + 1 < len(lines) and lines[i + 1][0] > indent:
+                value, i = _block(lines, i + 1, lines[i + 1][0])
+            else:
+                value, i = _value(stripped), i + 1
+            result.append(value)
+        return result, i
+    result = {}
+    while i < len(lines) and lines[i][0] == indent and not lines[i][1].startswith('-'):
+        split = _split_key(lines[i][1])
+        if split is None:
+            raise ValueError(f"cannot parse line: {lines[i][1]}")
+        key, rest = split
+        i += 1
+        if rest:
+            result[key] = _value(rest)
+        elif i < len(lines) and (lines[i][0] > indent or (lines[i][0] == indent and lines[i][1].startswith('-'))):
+            result[key], i = _block(lines, i, lines[i][0])
+        else:
+            result[key] = None
+    return result, i
+
+
+def _iter_clash_proxies(f):
+    """
+    Yields the entries of the top-level `proxies` list of a Clash config one at a time, without reading the rest.
+    """
+    in_proxies = False
+    item = []
+    for raw in f:
+        line = _strip_comment(raw.decode('utf-8', 'replace').rstrip('\r\n'))
+        if not line.strip():
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        text = line.strip()
+        if not in_proxies:
+            if indent == 0 and re.match(r'^proxies:\s*(\[\s*\])?$', text):
+                in_proxies = not text.endswith(']')
+            continue
+        if indent == 0 and not text.startswith('-'):
+            break
+        if text.startswith('-') and (not item or indent == item[0][0]):
+            if item:
+                yield item
+            item = []
+        item.append((indent, text))
+    if item:
+        yield item
+
+
+def _clash_tls(proxy: dict, server_name=None) -> dict:
+    reality = proxy.get("reality-opts") or {}
+    return _tls(proxy.get("servername") or proxy.get("sni") or server_name, _flag(proxy.get("skip-cert-verify")),
+                proxy.get("alpn"), proxy.get("client-fingerprint"), reality.get("public-key"), reality.get("short-id"))
+
+
+def _clash_transport(proxy: dict):
+    network = proxy.get("network")
+    if network == "ws":
+        options = proxy.get("ws-opts") or {}
+        return _transport("ws", options.get("path"), (options.get("headers") or {}).get("Host"))
+    if network == "grpc":
+        return _transport("grpc", service_name=(proxy.get("grpc-opts") or {}).get("grpc-service-name"))
+    if network in ("h2", "http"):
+        options = proxy.get("h2-opts") or proxy.get("http-opts") or {}
+        path = options.get("path")
+        return _transport("http", path[0] if isinstance(path, list) else path, options.get("host"))
+    return None
+
+
+def convert_clash_proxy(proxy: dict):
+    """
+    Converts one entry of a Clash `proxies` list into a sing-box outbound.
+
+    Returns:
+    dict: The outbound, or None if the proxy type is not supported.
+    """
+    kind = proxy.get("type")
+    outbound = {"tag": str(proxy["name"]), "server": str(proxy["server"]), "server_port": int(proxy["port"])}
+    if kind == "ss":
+        outbound.update({"type": "shadowsocks", "method": proxy["cipher"], "password": str(proxy["password"])})
+        if proxy.get("plugin"):
+            options = proxy.get("plugin-opts") or {}
+            outbound["plugin"] = "obfs-local" if proxy["plugin"] == "obfs" else proxy["plugin"]
+            outbound["plugin_opts"] = ';'.join(f"obfs={value}" if key == "mode" and proxy["plugin"] == "obfs"
+                                               else f"obfs-host={value}" if key == "host" and proxy["plugin"] == "obfs"
+                                               else f"{key}={value}" for key, value in options.items())
+        return outbound
+    if kind == "vmess":
+        outbound.update({"type": "vmess", "uuid": proxy["uuid"], "alter_id": int(proxy.get("alterId") or 0),
+                         "security": proxy.get("cipher") or "auto"})
+        if _flag(proxy.get("tls")):
+            outbound["tls"] = _clash_tls(proxy)
+        return _with_transport(outbound, _clash_transport(proxy))
+    if kind == "vless":
+        outbound.update({"type": "vless", "uuid": proxy["uuid"]})
+        if proxy.get("flow"):
+            outbound["flow"] = proxy["flow"]
+        if _flag(proxy.get("tls")):
+            outbound["tls"] = _clash_tls(proxy)
+        return _with_transport(outbound, _clash_transport(proxy))
+    if kind == "trojan":
+        outbound.update({"type": "trojan", "password": str(proxy["password"]), "tls": _clash_tls(proxy)})
+        return _with_transport(outbound, _clash_transport(proxy))
+    if kind in ("hysteria2", "hy2"):
+        outbound.update({"type": "hysteria2", "password": str(proxy.get("password") or proxy.get("auth") or ""),
+                         "tls": _clash_tls(proxy, outbound["server"])})
+        if proxy.get("obfs"):
+            outbound["obfs"] = {"type": proxy["obfs"], "password": str(proxy.get("obfs-password") or "")}
+        return outbound
+    if kind in ("socks5", "http"):
+        outbound["type"] = "socks" if kind == "socks5" else "http"
+        for key in ("username", "password"):
+            if proxy.get(key) is not None:
+                outbound[key] = str(proxy[key])
+        if kind == "http" and _flag(proxy.get("tls")):
+            outbound["tls"] = _clash_tls(proxy)
+        return outbound
+    return None
+
+
+def _iter_clash(f):
+    for item in _iter_clash_proxies(f):
+        try:
+            proxy, _ = _block(item, 0, item[0][0])
+            yield convert_clash_proxy(proxy[0] if isinstance(proxy, list) and proxy else proxy)
+        except (ValueError, KeyError, TypeError, AttributeError, IndexError) as e:
+            decky.logger.debug(f"Skipping malformed Clash proxy: {e}")
+            yield None
+
+
+# --- Output --------------------------------------------------------------------------------------------------------
+
+def build_config(outbounds: list) -> dict:
+    """
+    Wraps converted proxy outbounds into a sing-box config: a `Proxy` selector defaulting to an `Auto` urltest group
+    over every node, plus direct and DNS outbounds.
+    """
+    tags = [outbound["tag"] for outbound in outbounds]
+    return {
+        "outbounds": [{"type": "selector", "tag": PROXY_GROUP, "outbounds": [AUTO_GROUP] + tags, "default": AUTO_GROUP},
+                      {"type": "urltest", "tag": AUTO_GROUP, "outbounds": tags}]
+                     + outbounds
+                     + [{"type": "direct", "tag": "direct"}, {"type": "dns", "tag": "dns-out"}],
+        "route": {"rules": [{"protocol": "dns", "outbound": "dns-out"}], "final": PROXY_GROUP,
+                  "auto_detect_interface": True},
+    }
+
+
+def convert_file(path):
+    """
+    Converts the subscription at `path`, reading it incrementally.
+
+    Returns:
+    tuple: The detected format, the sing-box config (None for sing-box input, which needs no conversion) and the
+           number of entries skipped as unsupported or malformed.
+
+    Raises:
+    ConversionError: If the input contains no supported proxy.
+    """
+    with open(path, 'rb') as f:
+        source_format = detect(f.read(SNIFF_SIZE))
+        if source_format == FORMAT_SINGBOX:
+            return source_format, None, 0
+        f.seek(0)
+        outbounds, skipped, seen = [], 0, set()
+        for outbound in (_iter_links(f) if source_format == FORMAT_LINKS else _iter_clash(f)):
+            if outbound is None or not outbound.get("server") or not outbound.get("server_port"):
+                skipped += 1
+                continue
+            tag, count = str(outbound.get("tag") or outbound["server"]), 1
+            while tag in seen or tag in (PROXY_GROUP, AUTO_GROUP, "direct", "dns-out"):
+                count += 1
+                tag = f"{outbound.get('tag') or outbound['server']} ({count})"
+            seen.add(tag)
+            outbound["tag"] = tag
+            outbounds.append(outbound)
+    if not outbounds:
+        raise ConversionError(f"no supported proxies found in {source_format} subscription")
+    return source_format, build_config(outbounds), skipped
+
+
+class SubscriptionConverter:
+    """
+    Turns downloaded subscriptions into sing-box configs, caching converted output by source hash.
+
+    sing-box JSON is copied through untouched. Clash YAML and share link lists (vmess, vless, trojan, ss, hy2, plain
+    or base64 encoded) are converted; the result is stored as `<sha256 of the source>.json` under `folder`, so
+    downloading the same content again costs a hash instead of a conversion. The least recently used results beyond
+    `max_entries` are removed.
+
+    Parameters:
+    folder (str): The cache folder.
+    max_entries (int): Number of converted results kept.
+    """
+
+    def __init__(self, folder, max_entries=16):
+        self.folder = folder
+        self.max_entries = max_entries
+
+    def _collect_garbage(self):
+        entries = sorted((entry for entry in os.scandir(self.folder) if entry.name.endswith('.json')),
+                         key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[self.max_entries:]:
+            os.remove(entry.path)
+
+    def _convert_blocking(self, source, dest) -> dict:
+        digest = file_sha256(source)
+        cached_path = os.path.join(self.folder, digest + '.json')
+        if os.path.exists(cached_path):
+            os.utime(cached_path)
+            with open(cached_path, 'rb') as f:
+                write_atomic(dest, f.read())
+            with open(source, 'rb') as f:
+                source_format = detect(f.read(SNIFF_SIZE))
+            return {"format": source_format, "converted": True, "cached": True, "skipped": 0}
+        source_format, converted, skipped = convert_file(source)
+        if converted is None:
+            with open(source, 'rb') as f:
+                write_atomic(dest, f.read())
+            return {"format": source_format, "converted": False, "cached": False, "skipped": 0}
+        data = json.dumps(converted, ensure_ascii=False).encode()
+        os.makedirs(self.folder, exist_ok=True)
+        write_atomic(cached_path, data)
+        write_atomic(dest, data)
+        self._collect_garbage()
+        decky.logger.info(f"Converted {source_format} subscription with "
+                          f"{len(converted['outbounds'][1]['outbounds'])} proxies, skipped {skipped}")
+        return {"format": source_format, "converted": True, "cached": False, "skipped": skipped}
+
+    async def convert(self, source, dest) -> dict:
+        """
+        Writes the sing-box config for the subscription downloaded to `source` to `dest`, without blocking the
+        event loop.
+
+        Returns:
+        dict: The detected `format`, whether it was `converted`, whether the result came from the cache (`cached`)
+              and how many entries were `skipped`.
+
+        Raises:
+        ConversionError: If the subscription contains no supported proxy.
+        """
+        return await asyncio.to_thread(self._convert_blocking, source, dest)
@@ -0,0 +1,119 @@
+import json
+
+GROUP_TYPES = {"selector", "urltest"}
+# Top-level sections the generated config always overrides, so provider changes to them never matter
+OVERRIDDEN_SECTIONS = {"log"}
+# How many tags of each kind are listed in a summary; the counts are always complete
+SAMPLE_SIZE = 20
+
+KIND_NOOP = "noop"
+KIND_OUTBOUNDS = "outbounds"
+KIND_STRUCTURAL = "structural"
+
+APPLY_NONE = "none"
+APPLY_SELECTOR = "selector"
+APPLY_RELOAD = "reload"
+APPLY_RESTART = "restart"
+
+
+def _by_tag(outbounds) -> dict:
+    return {outbound.get("tag"): outbound for outbound in outbounds or [] if isinstance(outbound, dict)}
+
+
+def _without_default(outbound: dict) -> dict:
+    return {key: value for key, value in outbound.items() if key != "default"}
+
+
+def _section(config: dict, key):
+    value = config.get(key)
+    if key == "inbounds" and isinstance(value, list):
+        # The TUN inbound is replaced by the plugin's own
+        return [inbound for inbound in value if not isinstance(inbound, dict) or inbound.get("type") != "tun"]
+    return value
+
+
+def diff_configs(old: dict, new: dict) -> dict:
+    """
+    Compares two sing-box configs structurally and classifies the change.
+
+    Outbounds are matched by tag. Proxy nodes whose settings changed (a rotated address, a new password) make an
+    `outbounds` change, as do selectors whose only difference is their `default`. Added or removed tags, changed
+    group membership or any other section (route rules, DNS, inbounds...) make a `structural` change. Everything
+    compared equal is a `noop`, even if the files differ byte for byte.
+
+    Returns:
+    dict: `kind` ("noop", "outbounds" or "structural"), `apply` (see `apply_path`), `outbounds` with `added`,
+          `removed` and `changed` counts, `groups` whose members changed, `selectors` mapping selectors to their new
+          default, the other top-level `sections` that changed and a `sample` of the affected tags.
+    """
+    old_outbounds, new_outbounds = _by_tag(old.get("outbounds")), _by_tag(new.get("outbounds"))
+    added = sorted(tag for tag in new_outbounds if tag not in old_outbounds)
+    removed = sorted(tag for tag in old_outbounds if tag not in new_outbounds)
+    changed, groups, selectors = [], [], {}
+    for tag, outbound in new_outbounds.items():
+        previous = old_outbounds.get(tag)
+        if previous is None or previous == outbound:
+            continue
+        types = {previous.get("type"), outbound.get("type")}
+        if types == {"selector"} and _without_default(previous) == _without_default(outbound):
+            selectors[tag] = outbound.get("default")
+        elif types & GROUP_TYPES:
+            groups.append(tag)
+        else:
+            changed.append(tag)
+    sections = sorted(key for key in old.keys() | new.keys() if key != "outbounds"
+                      and key not in OVERRIDDEN_SECTIONS and _section(old, key) != _section(new, key))
+
+    if added or removed or groups or sections:
+        kind = KIND_STRUCTURAL
+    elif changed or selectors:
+        kind = KIND_OUTBOUNDS
+    else:
+        kind = KIND_NOOP
+    summary = {
+        "kind": kind,
+        "outbounds": {"added": len(added), "removed": len(removed), "changed": len(changed)},
+        "groups": sorted(groups),
+        "selectors": selectors,
+        "sections": sections,
+        "sample": {"added": added[:SAMPLE_SIZE], "removed": removed[:SAMPLE_SIZE],
+                   "changed": sorted(changed)[:SAMPLE_SIZE]},
+    }
+    summary["apply"] = apply_path(summary)
+    return summary
+
+
+def apply_path(summary: dict) -> str:
+    """
+    Picks the cheapest way to bring a running sing-box up to date with a change:
+
+    - "none" when nothing that matters changed,
+    - "selector" when only selector defaults moved, which the Clash API can switch live,
+    - "reload" for changed nodes, rules or DNS, which a SIGHUP reload picks up in-process,
+    - "restart" when the provider's own inbounds changed and their listeners have to be rebound.
+    """
+    if summary["kind"] == KIND_NOOP:
+        return APPLY_NONE
+    if summary["kind"] == KIND_OUTBOUNDS and not summary["outbounds"]["changed"]:
+        return APPLY_SELECTOR
+    if "inbounds" in summary["sections"]:
+        return APPLY_RESTART
+    return APPLY_RELOAD
+
+
+def diff_sources(old_raw: bytes, new_path) -> dict:
+    """
+    Diffs a subscription's previous contents against the file now at `new_path`.
+
+    Returns:
+    dict: The `diff_configs` summary, or None if either side is not a JSON object.
+    """
+    try:
+        old = json.loads(old_raw)
+        with open(new_path, 'rb') as f:
+            new = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return None
+    return diff_configs(old, new)
@@ -0,0 +1,120 @@
+from sbox.profiles import STEAM_CDN_DOMAINS, is_dns_rule, proxy_tag
+
+LOCAL_SERVER = "dns-local"
+REMOTE_SERVER = "dns-remote"
+FAKEIP_SERVER = "dns-fakeip"
+DNS_OUTBOUND = "dns-out"
+LAN_DOMAIN_SUFFIXES = ["local", "lan", "home.arpa", "in-addr.arpa", "ip6.arpa"]
+# The IPv4 and IPv6 benchmarking ranges: never routed on the internet and, unlike fc00::/7, not excluded from tun0
+FAKEIP_INET4_RANGE = "198.18.0.0/15"
+FAKEIP_INET6_RANGE = "2001:2::/48"
+
+DEFAULTS = {
+    "enabled": False,
+    "local": "local",
+    "remote": "https://1.1.1.1/dns-query",
+    "local_domain_suffix": [],
+    "fakeip": False,
+    "independent_cache": True,
+    "persist": True,
+}
+
+
+def validate_options(options: dict) -> dict:
+    """
+    Normalizes DNS overlay options, dropping unknown keys and keys left at None.
+
+    Option keys:
+    enabled (bool): Apply the overlay at all.
+    local (str): Resolver for LAN, Steam CDN and direct-routed domains and for proxy server names; "local" is the
+                 system resolver, anything else a sing-box DNS server address that needs no resolving itself.
+    remote (str): Resolver used through the proxy, only added when the subscription ships no DNS server of its own.
+    local_domain_suffix (list[str]): Extra domains resolved by the local resolver.
+    fakeip (bool): Answer A/AAAA queries from tun0 with fake addresses, so connections start without waiting for
+                   a real lookup and the proxy resolves the name at its end.
+    independent_cache (bool): Keep a separate cache per DNS server.
+    persist (bool): Keep rejected lookups and fake address mappings in the cache file across restarts.
+    """
+    result = {}
+    for key in ("enabled", "fakeip", "independent_cache", "persist"):
+        if options.get(key) is not None:
+            result[key] = bool(options[key])
+    for key in ("local", "remote"):
+        if options.get(key) is not None:
+            if not isinstance(options[key], str) or not options[key]:
+                raise ValueError(f"{key} must be a DNS server address")
+            result[key] = options[key]
+    suffixes = options.get("local_domain_suffix")
+    if suffixes is not None:
+        if not isinstance(suffixes, list) or not all(isinstance(suffix, str) for suffix in suffixes):
+            raise ValueError("local_domain_suffix must be a list of strings")
+        result["local_domain_suffix"] = suffixes
+    return result
+
+
+def resolve(*layers) -> dict:
+    """
+    Stacks option layers (e.g. global, then per subscription) over the defaults, later layers winning.
+    """
+    options = dict(DEFAULTS)
+    for layer in layers:
+        options.update(layer or {})
+    return options
+
+
+def _dns_outbound(config: dict) -> str:
+    outbounds = config.setdefault("outbounds", [])
+    for outbound in outbounds:
+        if outbound.get("type") == "dns":
+            return outbound["tag"]
+    outbounds.append({"type": "dns", "tag": DNS_OUTBOUND})
+    return DNS_OUTBOUND
+
+
+def apply_dns(config: dict, options: dict, profile: dict, tun_tag: str):
+    """
+    Merges the DNS overlay into the `dns` section of `config`, in place.
+
+    The provider's servers, rules and final server are kept. A local resolver is added for proxy server names, LAN
+    and Steam CDN domains and the domains `profile` routes direct, in rules ahead of the provider's. With `fakeip`,
+    a rule after the provider's answers every other A/AAAA query from the TUN inbound `tun_tag` with a fake address.
+    A DNS hijack route rule is added if the provider has none, since none of this applies unless sing-box answers
+    the queries.
+    """
+    if not options.get("enabled"):
+        return
+    if not isinstance(config.get("dns"), dict):
+        config["dns"] = {}
+    dns = config["dns"]
+    servers = dns.setdefault("servers", [])
+    rules = dns.setdefault("rules", [])
+    route = config.setdefault("route", {})
+    if not servers:
+        proxy = proxy_tag(config, route)
+        servers.append({"tag": REMOTE_SERVER, "address": options["remote"], "address_resolver": LOCAL_SERVER,
+                        **({"detour": proxy} if proxy else {})})
+    if not dns.get("final"):
+        dns["final"] = servers[0].get("tag")
+    # No detour: sing-box dials a server without one directly
+    servers.append({"tag": LOCAL_SERVER, "address": options["local"]})
+
+    suffixes = LAN_DOMAIN_SUFFIXES + STEAM_CDN_DOMAINS + options["local_domain_suffix"] \
+        + (profile.get("direct_domain_suffix") or [])
+    local = {"domain_suffix": list(dict.fromkeys(suffixes))}
+    if profile.get("direct_domain"):
+        local["domain"] = profile["direct_domain"]
+    rules[0:0] = [{"outbound": "any", "server": LOCAL_SERVER}, {**local, "server": LOCAL_SERVER}]
+    if options["fakeip"]:
+        servers.append({"tag": FAKEIP_SERVER, "address": "fakeip"})
+        rules.append({"inbound": [tun_tag], "query_type": ["A", "AAAA"], "server": FAKEIP_SERVER})
+        dns["fakeip"] = {"enabled": True, "inet4_range": FAKEIP_INET4_RANGE, "inet6_range": FAKEIP_INET6_RANGE}
+    dns["independent_cache"] = options["independent_cache"]
+    if options["persist"]:
+        cache_file = config.setdefault("experimental", {}).setdefault("cache_file", {})
+        cache_file["store_rdrc"] = True
+        if options["fakeip"]:
+            cache_file["store_fakeip"] = True
+
+    route_rules = route.setdefault("rules", [])
+    if not any(is_dns_rule(rule) for rule in route_rules if isinstance(rule, dict)):
+        route_rules.insert(0, {"protocol": "dns", "outbound": _dns_outbound(config)})
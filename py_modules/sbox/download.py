@@ -0,0 +1,104 @@
+import asyncio
+import os
+import tempfile
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from helpers import get_ssl_context # type: ignore
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _fetch_blocking(url, dest, etag, last_modified, timeout, max_size, user_agent, reference) -> dict:
+    headers = {'User-Agent': user_agent}
+    reference = reference or dest
+    # Only ask for a conditional response when there is a local copy to fall back on
+    if os.path.exists(reference):
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    deadline = time.monotonic() + timeout
+    try:
+        res = urlopen(Request(url, headers=headers), timeout=timeout, context=get_ssl_context())
+    except HTTPError as e:
+        if e.code == 304:
+            return {"changed": False, "path": reference, "etag": etag, "last_modified": last_modified, "size": os.path.getsize(reference)}
+        raise DownloadError(f"HTTP {e.code} from {url}") from e
+    except OSError as e:
+        raise DownloadError(f"{url}: {e}") from e
+
+    with res:
+        if res.status != 200:
+            raise DownloadError(f"HTTP {res.status} from {url}")
+        length = res.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_size:
+            raise DownloadError(f"{url} is {length} bytes, larger than the {max_size} byte limit")
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.', suffix='.part')
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = res.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_size:
+                        raise DownloadError(f"{url} exceeded the {max_size} byte limit")
+                    if time.monotonic() > deadline:
+                        raise DownloadError(f"{url} took longer than {timeout}s")
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, dest)
+        except OSError as e:
+            os.unlink(tmp_path)
+            raise DownloadError(f"{url}: {e}") from e
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        return {
+            "changed": True,
+            "path": dest,
+            "etag": res.headers.get('ETag'),
+            "last_modified": res.headers.get('Last-Modified'),
+            "size": size,
+        }
+
+
+async def fetch(url, dest, etag=None, last_modified=None, timeout=DEFAULT_TIMEOUT, max_size=DEFAULT_MAX_SIZE,
+                user_agent='sing-box', reference=None) -> dict:
+    """
+    Downloads `url` to `dest` without blocking the event loop.
+
+    The body is streamed in chunks to a temporary file next to `dest` and atomically renamed over it once complete,
+    so a failed or interrupted transfer never leaves a truncated file behind. When `etag`/`last_modified` from a
+    previous download are given and `dest` exists, the request is conditional and a 304 leaves the file untouched.
+
+    Parameters:
+    url (str): The URL to download.
+    dest (str): The destination file path.
+    etag (str): The `ETag` of the current copy, if known.
+    last_modified (str): The `Last-Modified` of the current copy, if known.
+    timeout (float): Maximum time in seconds for the whole transfer.
+    max_size (int): Maximum accepted body size in bytes.
+    reference (str): The local copy `etag`/`last_modified` belong to, when it is not `dest` itself.
+
+    Returns:
+    dict: `changed` (bool), `path`, `etag`, `last_modified` and `size` of the file on disk.
+
+    Raises:
+    DownloadError: If the request fails, times out or exceeds `max_size`.
+    """
+    return await asyncio.to_thread(_fetch_blocking, url, dest, etag, last_modified, timeout, max_size, user_agent,
+                                   reference)
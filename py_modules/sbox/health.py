@@ -0,0 +1,169 @@
+import asyncio
+import time
+from collections import deque
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import decky
+from helpers import get_ssl_context # type: ignore
+
+DEFAULT_INTERVAL = 30
+DEFAULT_THRESHOLD = 3
+# Once a probe fails, the next ones come quicker so a dead tunnel is confirmed in seconds
+FAILURE_INTERVAL = 5
+
+EVENT_FAILED = "probe_failed"
+EVENT_RECOVERED = "recovered"
+EVENT_FAILOVER = "failover"
+EVENT_FAILOVER_FAILED = "failover_failed"
+
+
+def _probe_http_blocking(url, timeout) -> dict:
+    start = time.monotonic()
+    try:
+        with urlopen(Request(url, headers={'User-Agent': 'sing-box'}), timeout=timeout, context=get_ssl_context()):
+            pass
+    except HTTPError as e:
+        if e.code >= 400:
+            return {"ok": False, "delay": None, "error": f"HTTP {e.code}"}
+    except OSError as e:
+        return {"ok": False, "delay": None, "error": str(e) or "timeout"}
+    return {"ok": True, "delay": max(round((time.monotonic() - start) * 1000), 1), "error": None}
+
+
+async def probe_http(url, timeout=5.0) -> dict:
+    """
+    Fetches `url` from the plugin process itself. With the tunnel up its traffic is routed through tun0, so this
+    exercises the whole path a game's traffic takes.
+
+    Returns:
+    dict: `ok`, `delay` in ms and `error`.
+    """
+    return await asyncio.to_thread(_probe_http_blocking, url, timeout)
+
+
+class HealthWatchdog:
+    """
+    Periodically probes the tunnel and fails over when it stops passing traffic.
+
+    `probe` is awaited every `interval` seconds and returns `{"ok", "delay", "error"}`, or None when there is
+    nothing to probe (sing-box not running). After a failure the probe is repeated every `FAILURE_INTERVAL`
+    seconds, and after `threshold` consecutive failures `failover` is awaited. It returns a dict describing what it
+    switched to, or None if there was nothing left to switch to. Failures, recoveries and failovers are kept as
+    events for the UI and passed to `on_event`.
+
+    Parameters:
+    probe (callable): Returns a coroutine running one probe.
+    failover (callable): Returns a coroutine performing a failover.
+    interval (callable): Returns the probe interval in seconds; 0 pauses probing.
+    threshold (callable): Returns the number of consecutive failures that triggers a failover.
+    on_event (callable): Called with every recorded event.
+    history (int): Number of events kept.
+    """
+
+    def __init__(self, probe, failover, interval, threshold, on_event=None, history=50):
+        self.probe = probe
+        self.failover = failover
+        self.interval = interval
+        self.threshold = threshold
+        self.on_event = on_event
+        self.events = deque(maxlen=history)
+        self.failures = 0
+        self.healthy = None
+        self.last_probe = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        """
+        Makes the watchdog pick up a changed interval right away.
+        """
+        self._wakeup.set()
+
+    def reset(self):
+        """
+        Forgets the current failure streak, e.g. after sing-box was restarted on purpose.
+        """
+        self.failures = 0
+        self.healthy = None
+
+    def _record(self, kind, **detail):
+        event = {"time": time.time(), "type": kind, **detail}
+        self.events.append(event)
+        if self.on_event is not None:
+            self.on_event(event)
+
+    async def _run(self):
+        while True:
+            interval = self.interval()
+            if self.failures:
+                interval = min(interval, FAILURE_INTERVAL) if interval > 0 else 0
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval if interval > 0 else None)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.check()
+            except Exception as e:
+                decky.logger.error(f"Health check failed to run: {e}")
+
+    async def check(self) -> dict:
+        """
+        Runs one probe now, and a failover if it completes a streak of `threshold` failures.
+
+        Returns:
+        dict: The probe result, or None if there was nothing to probe.
+        """
+        async with self._lock:
+            return await self._check()
+
+    async def _check(self):
+        result = await self.probe()
+        if result is None:
+            self.reset()
+            return None
+        self.last_probe = {**result, "time": time.time()}
+        if result["ok"]:
+            if self.failures:
+                self._record(EVENT_RECOVERED, after=self.failures)
+            self.failures = 0
+            self.healthy = True
+            return result
+        self.failures += 1
+        self.healthy = False
+        self._record(EVENT_FAILED, error=result["error"], count=self.failures)
+        decky.logger.warning(f"Health probe failed ({self.failures}/{self.threshold()}): {result['error']}")
+        if self.failures >= self.threshold():
+            switched = await self.failover()
+            if switched:
+                self._record(EVENT_FAILOVER, **switched)
+                decky.logger.warning(f"Failed over to {switched}")
+                self.failures = 0
+            else:
+                self._record(EVENT_FAILOVER_FAILED)
+                decky.logger.error("Tunnel is down and there is nothing left to fail over to")
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "last_probe": self.last_probe,
+            "events": list(self.events),
+        }
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import decky
+
+from sbox.clash import ClashAPI, ClashAPIError
+
+# Outbound types that are not proxy nodes and make no sense to benchmark
+NON_PROXY_TYPES = {"direct", "block", "dns", "selector", "urltest"}
+
+
+def proxy_outbounds(config: dict) -> list:
+    return [outbound for outbound in config.get("outbounds") or []
+            if outbound.get("tag") and outbound.get("type") not in NON_PROXY_TYPES]
+
+
+class LatencyTester:
+    """
+    Measures outbound latency concurrently and caches the results for `ttl` seconds.
+
+    When sing-box is running, each outbound is tested end to end through the Clash API delay endpoint
+    (`/proxies/{tag}/delay`), which times an HTTP request to `url` through that outbound. Otherwise the TCP handshake
+    to the outbound's server is timed directly, which is a cheaper but rougher estimate.
+
+    Parameters:
+    api (ClashAPI): The Clash API client.
+    concurrency (int): Maximum number of tests in flight.
+    ttl (float): Seconds a result stays valid.
+    """
+
+    def __init__(self, api: ClashAPI, concurrency=8, ttl=300.0):
+        self.api = api
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self._cache = {}
+
+    def _cached(self, tag):
+        entry = self._cache.get(tag)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    async def _test_clash(self, tag, url, timeout_ms) -> dict:
+        path = f'/proxies/{self.api.quote(tag)}/delay?timeout={timeout_ms}&url={self.api.quote(url)}'
+        try:
+            status, data = await self.api.request('GET', path, timeout=timeout_ms / 1000 + 2)
+        except ClashAPIError as e:
+            return {"delay": None, "error": str(e)}
+        if status == 200 and isinstance(data, dict) and data.get("delay"):
+            return {"delay": data["delay"], "error": None}
+        message = data.get("message") if isinstance(data, dict) else data
+        return {"delay": None, "error": message or f"HTTP {status}"}
+
+    @staticmethod
+    async def _test_tcp(outbound, timeout_ms) -> dict:
+        server, port = outbound.get("server"), outbound.get("server_port")
+        if not server or not port:
+            return {"delay": None, "error": "no server address"}
+        start = time.monotonic()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(server, port), timeout_ms / 1000)
+        except (OSError, asyncio.TimeoutError) as e:
+            return {"delay": None, "error": str(e) or "timeout"}
+        delay = round((time.monotonic() - start) * 1000)
+        writer.close()
+        return {"delay": max(delay, 1), "error": None}
+
+    async def test(self, outbounds: list, url, timeout_ms=5000, use_clash=True, force=False) -> list:
+        """
+        Tests every outbound in `outbounds` (sing-box outbound dicts) not already cached, with bounded parallelism.
+
+        Returns:
+        list[dict]: The results ranked by delay, failures last. Each has `tag`, `type`, `delay` (ms or None),
+                    `error`, `method` ("clash" or "tcp") and `age` in seconds.
+        """
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def run(outbound):
+            tag = outbound["tag"]
+            if not force and self._cached(tag) is not None:
+                return
+            async with semaphore:
+                if use_clash:
+                    result = await self._test_clash(tag, url, timeout_ms)
+                else:
+                    result = await self._test_tcp(outbound, timeout_ms)
+            result.update({"tag": tag, "type": outbound.get("type"), "method": "clash" if use_clash else "tcp"})
+            self._cache[tag] = (result, time.monotonic())
+
+        start = time.monotonic()
+        await asyncio.gather(*[run(outbound) for outbound in outbounds])
+        decky.logger.info(f"Latency test of {len(outbounds)} outbounds took {time.monotonic() - start:.2f}s")
+        return self.ranked([outbound["tag"] for outbound in outbounds])
+
+    async def probe(self, tag, url, timeout_ms=5000) -> dict:
+        """
+        Tests one outbound or group end to end through the Clash API, bypassing the cache.
+
+        Returns:
+        dict: `delay` (ms or None) and `error`.
+        """
+        return await self._test_clash(tag, url, timeout_ms)
+
+    def clear(self):
+        self._cache.clear()
+
+    def ranked(self, tags=None) -> list:
+        now = time.monotonic()
+        tags = set(tags) if tags is not None else None
+        results = []
+        for tag, (result, tested_at) in self._cache.items():
+            if (tags is None or tag in tags) and now - tested_at < self.ttl:
+                results.append({**result, "age": round(now - tested_at)})
+        return sorted(results, key=lambda r: (r["delay"] is None, r["delay"] or 0, r["tag"]))
+
+    def best(self, tags=None):
+        ranked = self.ranked(tags)
+        if ranked and ranked[0]["delay"] is not None:
+            return ranked[0]
+        return None
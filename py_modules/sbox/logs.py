@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+LEVELS = ["trace", "debug", "info", "warn", "error", "fatal", "panic"]
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+LEVEL_PATTERN = re.compile(r'\b(TRACE|DEBUG|INFO|WARN|ERROR|FATAL|PANIC)\b')
+# Lines are written to the log file in batches, at most this many seconds after they were read
+FLUSH_INTERVAL = 0.5
+
+
+def parse_level(line: str) -> str:
+    result = LEVEL_PATTERN.search(line)
+    return result[1].lower() if result else "info"
+
+
+class LogBuffer:
+    """
+    Keeps the most recent sing-box output lines in memory and mirrors them to a rotating log file. File writes
+    are batched and done off the event loop, so a chatty sing-box costs the loop no disk I/O.
+
+    Parameters:
+    capacity (int): Number of lines kept in memory.
+    path (str): Log file path, or None to keep lines in memory only.
+    max_bytes (int): Size at which the log file is rotated.
+    backups (int): Number of rotated files kept.
+    """
+
+    def __init__(self, capacity=1000, path=None, max_bytes=1024 * 1024, backups=3):
+        self.lines = deque(maxlen=capacity)
+        self._file = None
+        self._pending = []
+        self._flush_task = None
+        # Keeps batches in order when a flush is still writing as the next one starts
+        self._write_lock = threading.Lock()
+        if path:
+            self._file = logging.getLogger('decky-sbox.sing-box')
+            self._file.propagate = False
+            self._file.setLevel(logging.INFO)
+            if not self._file.handlers:
+                handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                self._file.addHandler(handler)
+
+    def append(self, line: str):
+        line = ANSI_ESCAPE.sub('', line)
+        if not line:
+            return
+        level = parse_level(line)
+        self.lines.append({"time": round(time.time(), 3), "level": level, "message": line})
+        if self._file is not None:
+            self._pending.append(line)
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(FLUSH_INTERVAL)
+        finally:
+            self._flush_task = None
+        await asyncio.to_thread(self._write)
+
+    def _write(self):
+        with self._write_lock:
+            pending, self._pending = self._pending, []
+            if self._file is not None:
+                for line in pending:
+                    self._file.info(line)
+
+    def tail(self, lines=100, level="") -> list:
+        """
+        Returns the last `lines` entries, optionally only those at `level` or more severe.
+        """
+        entries = self.lines
+        if level in LEVELS:
+            minimum = LEVELS.index(level)
+            entries = [entry for entry in entries if LEVELS.index(entry["level"]) >= minimum]
+        return list(entries)[-lines:] if lines else list(entries)
+
+    async def close(self):
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.to_thread(self._write)
+        if self._file is not None:
+            for handler in list(self._file.handlers):
+                handler.close()
+                self._file.removeHandler(handler)
+            self._file = None
@@ -0,0 +1,154 @@
+import copy
+import json
+
+from sbox import config
+from sbox.latency import proxy_outbounds
+
+# `use_config` value selecting the merged config; its source is written to `{MERGED_CONFIG}.json` like a subscription
+MERGED_CONFIG = "__merged__"
+MERGED_GROUP = "Merged"
+MERGED_AUTO_GROUP = "Merged Auto"
+# Outbound fields that tell two nodes on the same endpoint apart
+CREDENTIAL_FIELDS = ("uuid", "password", "method", "username", "flow", "alter_id", "private_key")
+
+
+class MergeError(Exception):
+    pass
+
+
+def node_key(outbound: dict) -> tuple:
+    """
+    Identifies a proxy node by protocol, server, port and credentials, so the same node published by two providers
+    (or twice by one) is only kept once.
+    """
+    credentials = tuple(str(outbound.get(field, "")) for field in CREDENTIAL_FIELDS)
+    return outbound.get("type"), str(outbound.get("server", "")).lower(), outbound.get("server_port"), credentials
+
+
+def _unique_tag(tag: str, source: str, taken: set) -> str:
+    if tag not in taken:
+        return tag
+    candidate, count = f"{tag} [{source}]", 1
+    while candidate in taken:
+        count += 1
+        candidate = f"{tag} [{source}] ({count})"
+    return candidate
+
+
+def _retag_members(outbound: dict, renames: dict):
+    members = []
+    for tag in outbound.get("outbounds") or []:
+        tag = renames.get(tag, tag)
+        if tag not in members:
+            members.append(tag)
+    outbound["outbounds"] = members
+    if outbound.get("default") in renames:
+        outbound["default"] = renames[outbound["default"]]
+
+
+def _retag_references(config_info: dict, renames: dict):
+    # Route rules and DNS servers of the primary subscription may point at one of its nodes dropped as a duplicate
+    for rule in (config_info.get("route") or {}).get("rules") or []:
+        if isinstance(rule, dict) and rule.get("outbound") in renames:
+            rule["outbound"] = renames[rule["outbound"]]
+    for server in (config_info.get("dns") or {}).get("servers") or []:
+        if isinstance(server, dict) and server.get("detour") in renames:
+            server["detour"] = renames[server["detour"]]
+
+
+def merge_configs(sources: list) -> tuple:
+    """
+    Unions the proxy nodes of several sing-box configs into one.
+
+    The first source is the primary one: its route, DNS and other sections, its groups and its non-proxy outbounds
+    are kept as they are. Nodes of the other sources are appended, the groups they came in are dropped. Nodes are
+    deduplicated by `node_key`, the first occurrence winning, and references to a dropped duplicate are pointed at
+    the node that was kept. A node whose tag is already taken is suffixed with its source name.
+
+    A `Merged Auto` urltest group over every unique node and a `Merged` selector defaulting to it are added, and
+    become the route's final outbound, so traffic not matched by a rule can use the best node of any provider.
+
+    Parameters:
+    sources (list): `(name, config)` pairs.
+
+    Returns:
+    tuple: The merged config and stats: the `sources` merged, the number of `nodes` seen, the `unique` nodes kept,
+           the `duplicates` dropped and the nodes `renamed`.
+    """
+    primary = copy.deepcopy(sources[0][1])
+    proxies = {id(outbound) for outbound in proxy_outbounds(primary)}
+    others = [outbound for outbound in primary.get("outbounds") or [] if id(outbound) not in proxies]
+    taken = {outbound.get("tag") for outbound in others} | {MERGED_GROUP, MERGED_AUTO_GROUP}
+    index, nodes, renames = {}, [], {}
+    stats = {"sources": [name for name, _ in sources], "nodes": 0, "unique": 0, "duplicates": 0, "renamed": 0}
+
+    for name, source in sources:
+        renames[name] = {}
+        for outbound in proxy_outbounds(source):
+            stats["nodes"] += 1
+            key = node_key(outbound)
+            if key in index:
+                renames[name][outbound["tag"]] = index[key]
+                stats["duplicates"] += 1
+                continue
+            tag = _unique_tag(outbound["tag"], name, taken)
+            if tag != outbound["tag"]:
+                renames[name][outbound["tag"]] = tag
+                stats["renamed"] += 1
+            taken.add(tag)
+            index[key] = tag
+            nodes.append((name, {**copy.deepcopy(outbound), "tag": tag}))
+
+    for name, node in nodes:
+        if node.get("detour") in renames[name]:
+            node["detour"] = renames[name][node["detour"]]
+        if node.get("detour") and node["detour"] not in taken:
+            # The detour was one of the dropped groups of a secondary source
+            node.pop("detour")
+    primary_renames = renames[sources[0][0]]
+    for outbound in others:
+        if outbound.get("type") in ("selector", "urltest"):
+            _retag_members(outbound, primary_renames)
+    _retag_references(primary, primary_renames)
+
+    tags = [node["tag"] for _, node in nodes]
+    primary["outbounds"] = [
+        {"type": "selector", "tag": MERGED_GROUP, "outbounds": [MERGED_AUTO_GROUP] + tags, "default": MERGED_AUTO_GROUP},
+        {"type": "urltest", "tag": MERGED_AUTO_GROUP, "outbounds": tags},
+    ] + others + [node for _, node in nodes]
+    primary.setdefault("route", {})["final"] = MERGED_GROUP
+    stats["unique"] = len(nodes)
+    return primary, stats
+
+
+def merge_files(sources: list, dest) -> dict:
+    """
+    Merges the configs at the given paths and atomically writes the result to `dest`. Sources that are missing or
+    not valid JSON are skipped.
+
+    Parameters:
+    sources (list): `(name, path)` pairs, the primary config first.
+    dest (str): Path of the merged config.
+
+    Returns:
+    dict: The `merge_configs` stats, plus the names `skipped`.
+
+    Raises:
+    MergeError: If none of the sources could be read.
+    """
+    loaded, skipped = [], []
+    for name, path in sources:
+        try:
+            with open(path, 'rb') as f:
+                source = json.load(f)
+        except (OSError, ValueError):
+            source = None
+        if isinstance(source, dict):
+            loaded.append((name, source))
+        else:
+            skipped.append(name)
+    if not loaded:
+        raise MergeError("none of the merged configs could be read")
+    merged, stats = merge_configs(loaded)
+    config.write_atomic(dest, json.dumps(merged).encode('utf-8'))
+    return {**stats, "skipped": skipped}
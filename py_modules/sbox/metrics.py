@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import deque
+
+import decky
+
+from sbox.clash import ClashAPI, ClashAPIError
+
+
+class TrafficMonitor:
+    """
+    Aggregates live traffic and connection metrics from the Clash API into an in-memory ring buffer.
+
+    One long-lived connection follows the `/traffic` stream (one up/down rate sample per second) and one keep-alive
+    connection polls the `/connections` snapshot every `connections_interval` seconds. The frontend reads the
+    aggregated result through `snapshot()` instead of talking to the API itself.
+
+    Parameters:
+    api (ClashAPI): The Clash API client.
+    history (int): Number of per-second samples to keep.
+    connections_interval (float): Seconds between `/connections` polls.
+    """
+
+    def __init__(self, api: ClashAPI, history=300, connections_interval=2.0):
+        self.api = api
+        self.connections_interval = connections_interval
+        self.samples = deque(maxlen=history)
+        self.up = 0
+        self.down = 0
+        self.upload_total = 0
+        self.download_total = 0
+        self.connections = 0
+        self.outbounds = {}
+        self.updated_at = None
+        self._tasks = []
+
+    @property
+    def active(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._follow_traffic()),
+            asyncio.create_task(self._poll_connections()),
+        ]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.up = self.down = self.connections = 0
+
+    async def _follow_traffic(self):
+        delay = 1.0
+        while True:
+            try:
+                async for sample in self.api.stream('/traffic'):
+                    delay = 1.0
+                    self.up = sample.get("up", 0)
+                    self.down = sample.get("down", 0)
+                    self.updated_at = time.time()
+                    self.samples.append({
+                        "time": round(self.updated_at, 1),
+                        "up": self.up,
+                        "down": self.down,
+                        "connections": self.connections,
+                    })
+            except ClashAPIError as e:
+                decky.logger.debug(f"Traffic stream unavailable: {e}")
+            # sing-box is starting, reloading or gone; back off before reconnecting
+            self.up = self.down = 0
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def _poll_connections(self):
+        session = self.api.session()
+        try:
+            while True:
+                try:
+                    status, data = await session.get('/connections')
+                    if status == 200 and isinstance(data, dict):
+                        self._aggregate_connections(data)
+                except ClashAPIError as e:
+                    decky.logger.debug(f"Connections poll failed: {e}")
+                await asyncio.sleep(self.connections_interval)
+        finally:
+            session.close()
+
+    def _aggregate_connections(self, data: dict):
+        connections = data.get("connections") or []
+        outbounds = {}
+        for conn in connections:
+            chains = conn.get("chains") or ["unknown"]
+            # chains[0] is the outbound that actually carried the connection, the rest are the groups leading to it
+            usage = outbounds.setdefault(chains[0], {"outbound": chains[0], "connections": 0, "upload": 0, "download": 0})
+            usage["connections"] += 1
+            usage["upload"] += conn.get("upload", 0)
+            usage["download"] += conn.get("download", 0)
+        self.connections = len(connections)
+        self.upload_total = data.get("uploadTotal", 0)
+        self.download_total = data.get("downloadTotal", 0)
+        self.outbounds = outbounds
+
+    def snapshot(self, history=0) -> dict:
+        """
+        Returns the current rates, totals, active connection count and per-outbound usage of live connections,
+        plus the last `history` per-second samples.
+        """
+        return {
+            "active": self.active,
+            "up": self.up,
+            "down": self.down,
+            "upload_total": self.upload_total,
+            "download_total": self.download_total,
+            "connections": self.connections,
+            "outbounds": sorted(self.outbounds.values(), key=lambda usage: usage["download"] + usage["upload"], reverse=True),
+            "updated_at": self.updated_at,
+            "history": list(self.samples)[-history:] if history else [],
+        }
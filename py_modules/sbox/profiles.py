@@ -0,0 +1,128 @@
+import copy
+
+# Domains Steam serves game content and store assets from; the bulk of a game download goes through these
+STEAM_CDN_DOMAINS = [
+    "steamcontent.com",
+    "steampipe.akamaized.net",
+    "steamcdn-a.akamaihd.net",
+    "steamstatic.com",
+    "steamserver.net",
+]
+PRIVATE_ADDRESSES = ["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "fc00::/7"]
+
+BUILTIN_PROFILES = {
+    "default": {},
+    "steam-direct": {
+        "description": "Steam CDN and LAN go direct, everything else through the proxy",
+        "direct_domain_suffix": STEAM_CDN_DOMAINS,
+        "direct_private": True,
+        "exclude_address": PRIVATE_ADDRESSES,
+    },
+}
+
+PROFILE_LIST_KEYS = ["direct_domain", "direct_domain_suffix", "direct_ip_cidr",
+                     "proxy_domain", "proxy_domain_suffix", "proxy_ip_cidr", "exclude_address"]
+
+
+def validate_profile(profile: dict) -> dict:
+    """
+    Normalizes a routing profile, dropping unknown keys.
+
+    Profile keys:
+    direct_domain / direct_domain_suffix / direct_ip_cidr (list[str]): Destinations that bypass the proxy.
+    direct_private (bool): Send private and LAN addresses direct.
+    proxy_only (bool): Traffic not matched by any rule goes direct instead of through the provider's final outbound.
+    proxy_domain / proxy_domain_suffix / proxy_ip_cidr (list[str]): Destinations still proxied in `proxy_only` mode.
+    exclude_address (list[str]): CIDRs added to the TUN `route_exclude_address`, so they never enter the tunnel.
+    """
+    result = {}
+    for key in PROFILE_LIST_KEYS:
+        values = profile.get(key) or []
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{key} must be a list of strings")
+        if values:
+            result[key] = values
+    for key in ("direct_private", "proxy_only"):
+        if profile.get(key):
+            result[key] = True
+    if profile.get("description"):
+        result["description"] = str(profile["description"])
+    return result
+
+
+def _rule(prefix: str, profile: dict, outbound: str):
+    rule = {}
+    for match in ("domain", "domain_suffix", "ip_cidr"):
+        if profile.get(f"{prefix}_{match}"):
+            rule[match] = profile[f"{prefix}_{match}"]
+    if not rule:
+        return None
+    rule["outbound"] = outbound
+    return rule
+
+
+def direct_tag(config: dict) -> str:
+    outbounds = config.setdefault("outbounds", [])
+    for outbound in outbounds:
+        if outbound.get("type") == "direct":
+            return outbound["tag"]
+    outbounds.append({"type": "direct", "tag": "direct"})
+    return "direct"
+
+
+def proxy_tag(config: dict, route: dict):
+    if route.get("final"):
+        return route["final"]
+    for outbound in config.get("outbounds") or []:
+        if outbound.get("type") in ("selector", "urltest"):
+            return outbound["tag"]
+    for outbound in config.get("outbounds") or []:
+        if outbound.get("type") not in ("direct", "block", "dns"):
+            return outbound.get("tag")
+    return None
+
+
+def is_dns_rule(rule: dict) -> bool:
+    protocol = rule.get("protocol")
+    return protocol == "dns" or (isinstance(protocol, list) and "dns" in protocol) or rule.get("action") == "hijack-dns"
+
+
+def apply_profile(config: dict, tun: dict, profile: dict):
+    """
+    Compiles a routing profile into route rules of `config` and the TUN inbound `tun`, in place.
+
+    The profile's rules go in front of the provider's rules, but after any leading DNS hijack rules so DNS keeps
+    being answered by sing-box.
+    """
+    if not profile:
+        return
+    route = config.setdefault("route", {})
+    rules = route.setdefault("rules", [])
+    direct = direct_tag(config)
+    compiled = []
+    if profile.get("direct_private"):
+        compiled.append({"ip_is_private": True, "outbound": direct})
+    direct_rule = _rule("direct", profile, direct)
+    if direct_rule:
+        compiled.append(direct_rule)
+    if profile.get("proxy_only"):
+        proxy = proxy_tag(config, route)
+        proxy_rule = _rule("proxy", profile, proxy) if proxy else None
+        if proxy_rule:
+            compiled.append(proxy_rule)
+        route["final"] = direct
+    position = 0
+    while position < len(rules) and is_dns_rule(rules[position]):
+        position += 1
+    rules[position:position] = compiled
+    if profile.get("exclude_address"):
+        excluded = tun.setdefault("route_exclude_address", [])
+        excluded.extend(address for address in profile["exclude_address"] if address not in excluded)
+
+
+def resolve(profiles: dict, name: str) -> dict:
+    """
+    Returns a copy of the profile called `name` from `profiles` or the built-ins, or an empty profile.
+    """
+    profile = profiles.get(name) if name in profiles else BUILTIN_PROFILES.get(name, {})
+    return copy.deepcopy(profile)
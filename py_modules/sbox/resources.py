@@ -0,0 +1,212 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import decky
+
+DEFAULT_INTERVAL = 5
+ACTION_WARN = "warn"
+ACTION_RESTART = "restart"
+
+EVENT_RSS_LIMIT = "rss_limit"
+EVENT_LIMIT_FAILED = "limit_failed"
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def read_stat(pid) -> dict:
+    """
+    Reads CPU time and thread count from `/proc/<pid>/stat`.
+
+    Returns:
+    dict: `cpu_time` (user + system, in seconds) and `threads`.
+
+    Raises:
+    OSError: If the process is gone.
+    """
+    with open(f"/proc/{pid}/stat", 'r') as f:
+        stat = f.read()
+    # The command name is in parentheses and may itself contain spaces or parentheses
+    fields = stat[stat.rindex(')') + 2:].split()
+    return {"cpu_time": (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS, "threads": int(fields[17])}
+
+
+def read_status(pid) -> dict:
+    """
+    Reads memory usage from `/proc/<pid>/status`.
+
+    Returns:
+    dict: `rss` and `rss_peak` in bytes.
+    """
+    memory = {"rss": 0, "rss_peak": 0}
+    with open(f"/proc/{pid}/status", 'r') as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                memory["rss"] = int(line.split()[1]) * 1024
+            elif line.startswith("VmHWM:"):
+                memory["rss_peak"] = int(line.split()[1]) * 1024
+    return memory
+
+
+def count_fds(pid) -> int:
+    return len(os.listdir(f"/proc/{pid}/fd"))
+
+
+def _threads(pid) -> list:
+    try:
+        return [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        return []
+
+
+class ResourceMonitor:
+    """
+    Samples the CPU, memory and file descriptor usage of a process from /proc into an in-memory ring buffer, and
+    optionally keeps it within limits.
+
+    Every `interval` seconds one sample is taken: the CPU share since the previous sample (100 is one full core),
+    RSS and its peak, threads and open fds. The configured limits are re-applied on each sample to threads that
+    have not been seen yet, since Linux keeps nice levels and CPU affinity per thread and Go starts threads lazily.
+    When RSS exceeds the ceiling, a `rss_limit` event is recorded and passed to `on_limit` once per process.
+
+    Parameters:
+    pid (callable): Returns the pid to sample, or None when there is no process.
+    interval (callable): Returns the sampling interval in seconds; 0 pauses sampling.
+    limits (callable): Returns the limits: `nice` (None to leave it), `affinity` (list of CPU ids, empty to leave
+                       it), `rss_limit` (MiB, 0 for none) and `rss_action` ("warn" or "restart").
+    on_limit (callable): Returns a coroutine handling a limit event.
+    history (int): Number of samples kept.
+    """
+
+    def __init__(self, pid, interval, limits, on_limit=None, history=360):
+        self.pid = pid
+        self.interval = interval
+        self.limits = limits
+        self.on_limit = on_limit
+        self.samples = deque(maxlen=history)
+        self.events = deque(maxlen=50)
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._last = None
+        self._applied = None
+        self._reported = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        """
+        Makes the monitor pick up a changed interval or changed limits right away.
+        """
+        self._applied = None
+        self._reported = None
+        self._wakeup.set()
+
+    def _record(self, kind, **detail):
+        event = {"time": time.time(), "type": kind, **detail}
+        self.events.append(event)
+        return event
+
+    async def _run(self):
+        while True:
+            interval = self.interval()
+            self._wakeup.clear()
+            try:
+                # A wake-up samples right away, so changed limits are applied without waiting a whole interval
+                await asyncio.wait_for(self._wakeup.wait(), interval if interval > 0 else None)
+            except asyncio.TimeoutError:
+                pass
+            if self.interval() <= 0:
+                continue
+            pid = self.pid()
+            if pid is None:
+                self._last = None
+                continue
+            try:
+                sample = self.sample(pid)
+            except OSError:
+                # The process exited between the pid lookup and the read
+                continue
+            try:
+                await self._enforce(pid, sample)
+            except Exception as e:
+                decky.logger.error(f"Failed to enforce resource limits: {e}")
+
+    def sample(self, pid) -> dict:
+        """
+        Takes one sample of `pid` now and appends it to the history.
+
+        Raises:
+        OSError: If the process is gone.
+        """
+        now = time.monotonic()
+        stat = read_stat(pid)
+        sample = {"time": round(time.time(), 1), "pid": pid, "cpu": None, **read_status(pid),
+                  "threads": stat["threads"], "fds": count_fds(pid)}
+        if self._last is not None and self._last[0] == pid and now > self._last[1]:
+            sample["cpu"] = round((stat["cpu_time"] - self._last[2]) / (now - self._last[1]) * 100, 1)
+        self._last = (pid, now, stat["cpu_time"])
+        self.samples.append(sample)
+        return sample
+
+    def _apply_limits(self, pid, limits):
+        if self._applied is None or self._applied[0] != pid:
+            self._applied = (pid, set())
+        applied = self._applied[1]
+        if applied is None:
+            return
+        for tid in _threads(pid):
+            if tid in applied:
+                continue
+            applied.add(tid)
+            try:
+                if limits.get("nice") is not None:
+                    os.setpriority(os.PRIO_PROCESS, tid, int(limits["nice"]))
+                if limits.get("affinity"):
+                    os.sched_setaffinity(tid, limits["affinity"])
+            except ProcessLookupError:
+                pass
+            except OSError as e:
+                # Typically a negative nice level without CAP_SYS_NICE, or CPUs that do not exist
+                self._record(EVENT_LIMIT_FAILED, pid=pid, error=str(e))
+                decky.logger.error(f"Failed to apply resource limits to sing-box (pid {pid}): {e}")
+                # Not retried for this process; changing the limits tries again
+                self._applied = (pid, None)
+                return
+
+    async def _enforce(self, pid, sample):
+        limits = self.limits()
+        if limits.get("nice") is not None or limits.get("affinity"):
+            self._apply_limits(pid, limits)
+        ceiling = (limits.get("rss_limit") or 0) * 1024 * 1024
+        if not ceiling or sample["rss"] <= ceiling:
+            return
+        if self._reported == pid:
+            return
+        self._reported = pid
+        event = self._record(EVENT_RSS_LIMIT, pid=pid, rss=sample["rss"], limit=ceiling,
+                             action=limits.get("rss_action") or ACTION_WARN)
+        decky.logger.warning(f"sing-box (pid {pid}) uses {sample['rss'] // 1048576} MiB, above the "
+                             f"{limits['rss_limit']} MiB limit")
+        if self.on_limit is not None:
+            await self.on_limit(event)
+
+    def snapshot(self, history=0) -> dict:
+        current = self.samples[-1] if self.samples and self.samples[-1]["pid"] == self.pid() else None
+        return {
+            "current": current,
+            "limits": self.limits(),
+            "events": list(self.events),
+            "history": list(self.samples)[-history:] if history > 0 else [],
+        }
@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import decky
+
+from sbox import download
+from sbox.config import file_sha256, write_atomic
+
+
+def _format(rule_set: dict) -> str:
+    if rule_set.get("format"):
+        return rule_set["format"]
+    return "binary" if rule_set.get("url", "").split('?')[0].endswith('.srs') else "source"
+
+
+def remote_rule_sets(config: dict) -> list:
+    route = config.get("route") or {}
+    return [rule_set for rule_set in route.get("rule_set") or [] if rule_set.get("type") == "remote" and rule_set.get("url")]
+
+
+class RuleSetCache:
+    """
+    A content-addressed local cache of remote rule-sets.
+
+    Each downloaded rule-set is stored as `<sha256>.srs` (or `.json` for source rule-sets) under `folder`, and an
+    index maps every URL to its current blob and HTTP validators. Generated configs reference the blobs as local
+    rule-sets, so sing-box never has to download them while the tunnel is coming up. Blobs are immutable: an
+    updated rule-set gets a new file and the old one is removed once nothing in the index points at it.
+
+    Parameters:
+    folder (str): The cache folder.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index_path = os.path.join(folder, 'index.json')
+        self._index = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            try:
+                with open(self.index_path, 'r') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def revision(self, urls) -> str:
+        """
+        A digest of which blob each of `urls` points at, so a generated config is rebuilt when one of the rule-sets
+        it references changes, and only then.
+        """
+        entries = [(url, (self.index.get(url) or {}).get("sha256")) for url in sorted(urls)]
+        return hashlib.sha256(json.dumps(entries).encode()).hexdigest()
+
+    def _blob_path(self, entry) -> str:
+        return os.path.join(self.folder, entry["sha256"] + ('.srs' if entry["format"] == "binary" else '.json'))
+
+    def localize(self, config: dict) -> list:
+        """
+        Rewrites every cached remote rule-set of `config` into a local one, in place.
+
+        Returns:
+        list[dict]: The remote rule-sets that are not cached yet and were left untouched.
+        """
+        missing = []
+        for rule_set in remote_rule_sets(config):
+            entry = self.index.get(rule_set["url"])
+            path = self._blob_path(entry) if entry else None
+            if path is None or not os.path.exists(path):
+                missing.append(dict(rule_set))
+                continue
+            for key in ("url", "download_detour", "update_interval"):
+                rule_set.pop(key, None)
+            rule_set.update({"type": "local", "format": entry["format"], "path": path})
+        return missing
+
+    async def _fetch(self, url, rule_format, timeout) -> bool:
+        os.makedirs(self.folder, exist_ok=True)
+        entry = self.index.get(url)
+        reference = self._blob_path(entry) if entry else None
+        tmp_path = os.path.join(self.folder, '.' + hashlib.sha1(url.encode()).hexdigest() + '.download')
+        result = await download.fetch(url, tmp_path,
+                                      etag=entry.get("etag") if entry else None,
+                                      last_modified=entry.get("last_modified") if entry else None,
+                                      timeout=timeout, reference=reference)
+        if not result["changed"]:
+            entry["checked_at"] = time.time()
+            return False
+        sha256 = await asyncio.to_thread(file_sha256, tmp_path)
+        new_entry = {
+            "sha256": sha256,
+            "format": rule_format,
+            "etag": result["etag"],
+            "last_modified": result["last_modified"],
+            "checked_at": time.time(),
+        }
+        os.replace(tmp_path, self._blob_path(new_entry))
+        self.index[url] = new_entry
+        return entry is None or entry["sha256"] != sha256
+
+    def _collect_garbage(self):
+        referenced = {os.path.basename(self._blob_path(entry)) for entry in self.index.values()}
+        for file_name in os.listdir(self.folder):
+            if file_name.endswith(('.srs', '.json')) and file_name != 'index.json' and file_name not in referenced:
+                os.remove(os.path.join(self.folder, file_name))
+
+    async def fetch(self, rule_sets: list, concurrency=4, timeout=download.DEFAULT_TIMEOUT) -> list:
+        """
+        Downloads or revalidates the given remote rule-sets concurrently, using conditional requests for cached ones.
+
+        Returns:
+        list[str]: The URLs whose content changed.
+        """
+        async with self._lock:
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+            urls = {rule_set["url"]: _format(rule_set) for rule_set in rule_sets}
+
+            async def fetch_one(url, rule_format):
+                async with semaphore:
+                    try:
+                        return await self._fetch(url, rule_format, timeout)
+                    except (download.DownloadError, OSError) as e:
+                        decky.logger.warning(f"Failed to fetch rule-set {url}: {e}")
+                        return False
+
+            changed = await asyncio.gather(*[fetch_one(url, rule_format) for url, rule_format in urls.items()])
+            try:
+                write_atomic(self.index_path, json.dumps(self.index).encode())
+                if any(changed):
+                    self._collect_garbage()
+            except OSError as e:
+                decky.logger.warning(f"Failed to update rule-set cache index: {e}")
+            return [url for url, url_changed in zip(urls, changed) if url_changed]
+
+    async def refresh(self, concurrency=4, timeout=download.DEFAULT_TIMEOUT) -> list:
+        """
+        Revalidates every cached rule-set.
+        """
+        rule_sets = [{"url": url, "format": entry["format"]} for url, entry in self.index.items()]
+        if not rule_sets:
+            return []
+        return await self.fetch(rule_sets, concurrency, timeout)
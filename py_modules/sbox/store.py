@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+from contextlib import contextmanager
+
+import decky
+
+from sbox.config import write_atomic
+
+DEFAULT_DELAY = 0.25
+
+
+class SettingsStore:
+    """
+    The plugin settings, held in memory and written back to a JSON file in the background.
+
+    The in-memory dict is authoritative: reads never touch the disk, and writes only mark the store dirty. Writes
+    made within `delay` seconds of each other are coalesced into a single flush, which serializes a snapshot on the
+    event loop and writes it to a temporary file that is fsynced and renamed over the settings file in a worker
+    thread, so a crash leaves either the old or the new settings, never a mix. Outside a running event loop, writes
+    are flushed immediately.
+
+    The file format is the one Decky's `SettingsManager` uses, so existing settings are picked up as they are.
+
+    Parameters:
+    path (str): The settings file.
+    delay (float): How long to wait for further writes before flushing.
+    """
+
+    def __init__(self, path, delay=DEFAULT_DELAY):
+        self.path = path
+        self.delay = delay
+        self.settings = {}
+        self._dirty = False
+        self._timer = None
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+        try:
+            with open(path, 'r') as f:
+                self.settings = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            decky.logger.error(f"Failed to read settings {path}, starting empty: {e}")
+
+    def get(self, key, fallback=None):
+        return self.settings.get(key, fallback)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values: dict):
+        """
+        Sets several keys at once; they are always flushed together.
+        """
+        self.settings.update(values)
+        self._schedule()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Stages writes in a dict and applies them together when the block exits cleanly, or not at all.
+
+            with store.transaction() as changes:
+                changes["configs"] = configs
+                changes["use_config"] = name
+        """
+        changes = {}
+        yield changes
+        if changes:
+            self.update(changes)
+
+    def _schedule(self):
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._snapshot())
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.delay, self._start_flush)
+
+    def _start_flush(self):
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    def _snapshot(self) -> bytes:
+        self._dirty = False
+        return json.dumps(self.settings, indent=4).encode()
+
+    def _write(self, data):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, data)
+        except OSError as e:
+            self._dirty = True
+            decky.logger.error(f"Failed to write settings {self.path}: {e}")
+
+    async def flush(self):
+        """
+        Writes pending changes now instead of waiting for the coalescing window.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            if not self._dirty:
+                return
+            await asyncio.to_thread(self._write, self._snapshot())
@@ -0,0 +1,229 @@
+import asyncio
+import os
+import signal
+import time
+
+import decky
+
+from sbox.trace import tracer
+
+STATE_STOPPED = "stopped"
+STATE_STARTING = "starting"
+STATE_RUNNING = "running"
+STATE_BACKOFF = "backoff"
+STATE_FAILED = "failed"
+
+
+class SingBoxSupervisor:
+    """
+    Owns the sing-box child process and keeps its state in memory.
+
+    The supervisor spawns sing-box with `asyncio.create_subprocess_exec` in a process group of its own, keeps the
+    process handle, and waits on it from a watcher task. Stopping signals that group only, so nothing but the
+    sing-box we started (and anything it forked) is ever touched. When the process exits without `stop()` being called it is restarted with exponential
+    backoff, up to `max_restarts` consecutive failures. A process that stayed up for `stable_after` seconds resets
+    the backoff.
+
+    Parameters:
+    command (callable): Returns the argv list used to spawn sing-box. Called on every (re)start so that paths and
+                        settings are re-read.
+    env (dict): Environment for the child process.
+    output (callable): Called with the process' combined stdout/stderr stream after every spawn; must return a
+                       coroutine that drains it, so a chatty sing-box never blocks on a full pipe.
+    on_state (callable): Called with the new state whenever it changes.
+    before_start (callable): Returns a coroutine awaited before every spawn, restarts included, e.g. to clean up
+                             what a crashed process left behind.
+    """
+
+    def __init__(self, command, env, output=None, on_state=None, before_start=None, max_restarts=5, backoff_base=1.0,
+                 backoff_max=30.0, stable_after=30.0):
+        self.command = command
+        self.env = env
+        self.output = output
+        self.on_state = on_state
+        self.before_start = before_start
+        self.max_restarts = max_restarts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+
+        self.process = None
+        self.state = STATE_STOPPED
+        self.pid = None
+        self.exit_code = None
+        self.restart_count = 0
+        self.started_at = None
+
+        self._failures = 0
+        self._stopping = False
+        self._watcher = None
+        self._reader = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "pid": self.pid if self.running else None,
+            "exit_code": self.exit_code,
+            "restart_count": self.restart_count,
+            "uptime": round(time.monotonic() - self.started_at, 1) if self.running and self.started_at else 0,
+        }
+
+    def _set_state(self, state):
+        changed = state != self.state
+        self.state = state
+        if changed and self.on_state is not None:
+            self.on_state(state)
+
+    async def _spawn(self) -> bool:
+        self._set_state(STATE_STARTING)
+        if self.before_start is not None:
+            try:
+                await self.before_start()
+            except Exception as e:
+                decky.logger.error(f"Failed to prepare sing-box start: {e}")
+        cmd = self.command()
+        try:
+            with tracer.span("stage:spawn"):
+                self.process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    env=self.env,
+                    start_new_session=True
+                )
+        except OSError as e:
+            decky.logger.error(f"Failed to spawn sing-box: {e}")
+            self.process = None
+            self.pid = None
+            self._set_state(STATE_FAILED)
+            return False
+        self.pid = self.process.pid
+        if self.output is not None:
+            self._reader = asyncio.create_task(self.output(self.process.stdout))
+        self.exit_code = None
+        self.started_at = time.monotonic()
+        self._set_state(STATE_RUNNING)
+        decky.logger.info(f"sing-box started with pid {self.pid}")
+        return True
+
+    async def start(self) -> bool:
+        async with self._lock:
+            if self.running:
+                return True
+            # A watcher sleeping in backoff would respawn on its own; this start replaces it
+            watcher, self._watcher = self._watcher, None
+            if watcher is not None and not watcher.done():
+                watcher.cancel()
+                try:
+                    await watcher
+                except asyncio.CancelledError:
+                    pass
+            self._stopping = False
+            self._failures = 0
+            if not await self._spawn():
+                return False
+            self._watcher = asyncio.create_task(self._watch())
+            return True
+
+    async def _watch(self):
+        while True:
+            proc = self.process
+            code = await proc.wait()
+            self.exit_code = code
+            if self._stopping:
+                self._set_state(STATE_STOPPED)
+                return
+            decky.logger.warning(f"sing-box (pid {self.pid}) exited with code {code}")
+            if self.started_at and time.monotonic() - self.started_at >= self.stable_after:
+                self._failures = 0
+            self._failures += 1
+            if self._failures > self.max_restarts:
+                decky.logger.error(f"sing-box exited {self._failures} times in a row, giving up")
+                self._set_state(STATE_FAILED)
+                return
+            delay = min(self.backoff_base * (2 ** (self._failures - 1)), self.backoff_max)
+            self._set_state(STATE_BACKOFF)
+            decky.logger.info(f"Restarting sing-box in {delay}s")
+            await asyncio.sleep(delay)
+            if self._stopping:
+                self._set_state(STATE_STOPPED)
+                return
+            if self.process is not proc:
+                # Someone else started a new process meanwhile
+                return
+            if not await self._spawn():
+                return
+            self.restart_count += 1
+
+    def _signal_group(self, proc, sig):
+        # The child leads its own session, so its pid is also the process group id
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            proc.send_signal(sig)
+
+    async def stop(self, timeout=5.0) -> bool:
+        """
+        Stops sing-box: SIGTERM to its process group, then SIGKILL if it has not exited within `timeout` seconds.
+        Returns once the process is gone.
+
+        Returns:
+        bool: True if a running process was stopped.
+        """
+        async with self._lock:
+            self._stopping = True
+            watcher, self._watcher = self._watcher, None
+            proc = self.process
+            stopped = False
+            if proc is not None and proc.returncode is None:
+                self._signal_group(proc, signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(proc.wait(), timeout)
+                except asyncio.TimeoutError:
+                    decky.logger.warning(f"sing-box (pid {proc.pid}) did not exit within {timeout}s, killing it")
+                    self._signal_group(proc, signal.SIGKILL)
+                    await proc.wait()
+                self.exit_code = proc.returncode
+                stopped = True
+            if proc is not None:
+                # Sweep up anything sing-box forked that outlived it
+                self._signal_group(proc, signal.SIGKILL)
+            if watcher is not None and not watcher.done():
+                watcher.cancel()
+                try:
+                    await watcher
+                except asyncio.CancelledError:
+                    pass
+            if self._reader is not None:
+                # The pipe is at EOF once the process is gone; give the reader a moment to flush the last lines
+                try:
+                    await asyncio.wait_for(self._reader, 1.0)
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    pass
+                self._reader = None
+            self.process = None
+            self._set_state(STATE_STOPPED)
+            return stopped
+
+    def reload(self) -> bool:
+        """
+        Asks sing-box to reload its config in-process by sending SIGHUP.
+
+        Returns:
+        bool: False if there is no running process to signal.
+        """
+        if not self.running:
+            return False
+        try:
+            self.process.send_signal(signal.SIGHUP)
+        except ProcessLookupError:
+            return False
+        decky.logger.info(f"Sent SIGHUP to sing-box (pid {self.pid})")
+        return True
@@ -0,0 +1,211 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import time
+from collections import deque
+
+import decky
+
+# Upper bounds of the histogram buckets in milliseconds; a last bucket takes everything slower
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+LOOP_LAG = "loop.lag"
+DEFAULT_LAG_INTERVAL = 0.5
+# Loop lag below this is normal scheduling jitter and only counted, not listed as a span
+LAG_REPORT_MS = 50
+FLUSH_INTERVAL = 1.0
+TRACE_MAX_SIZE = 4 * 1024 * 1024
+
+# Name of the instrumented callable the current task is running in, if any
+_caller = contextvars.ContextVar("sbox_trace_caller", default=None)
+
+
+class Histogram:
+    """
+    Counts durations into the fixed `BUCKETS`, so percentiles can be estimated without keeping every sample.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, ms, error=False):
+        self.count += 1
+        self.errors += bool(error)
+        self.total += ms
+        self.max = max(self.max, ms)
+        index = 0
+        while index < len(BUCKETS) and ms > BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+
+    def percentile(self, q) -> float:
+        # The upper bound of the bucket holding the q-th sample, which never overstates the slowest one
+        target, seen = q * self.count, 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean": round(self.total / self.count, 3) if self.count else 0,
+            "max": round(self.max, 3),
+            "p50": round(self.percentile(0.5), 3),
+            "p95": round(self.percentile(0.95), 3),
+            "p99": round(self.percentile(0.99), 3),
+            "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["inf"], self.buckets)),
+        }
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "attrs", "start")
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.name, (time.perf_counter() - self.start) * 1000,
+                           error=exc_type.__name__ if exc_type else None, **self.attrs)
+        return False
+
+
+class Tracer:
+    """
+    Times backend work into per-name histograms and keeps the most recent spans.
+
+    Spans are taken with `span()` around a stage, or for every call of a coroutine wrapped by `instrument()`. An
+    instrumented coroutine called from another one (e.g. `info` from `get_state`) is recorded as a `child:` span
+    with its `parent`, so `call:` spans only time calls made from outside and are not counted twice.
+    While started, a monitor task also measures event loop lag: how late a sleep of `lag_interval` seconds wakes
+    up, which is how long something blocked the loop. With `path` set, every span is also appended to that file as
+    one JSON object per line, written off the event loop once a second.
+
+    Parameters:
+    history (int): Number of recent spans kept.
+    """
+
+    def __init__(self, history=200):
+        self.histograms = {}
+        self.recent = deque(maxlen=history)
+        self.path = None
+        self.lag_interval = lambda: DEFAULT_LAG_INTERVAL
+        self._pending = []
+        self._task = None
+
+    def span(self, name, **attrs) -> _Span:
+        """
+        Returns a context manager timing its body as a span called `name`. Works around awaits too.
+        """
+        return _Span(self, name, attrs)
+
+    def record(self, name, ms, error=None, listed=True, **attrs):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(ms, error)
+        if not listed:
+            return
+        entry = {"time": round(time.time(), 3), "name": name, "ms": round(ms, 3), **attrs}
+        if error:
+            entry["error"] = error
+        self.recent.append(entry)
+        if self.path:
+            self._pending.append(entry)
+
+    def instrument(self, func, name=None):
+        name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            parent = _caller.get()
+            token = _caller.set(name)
+            try:
+                with self.span(f"call:{name}") if parent is None else self.span(f"child:{name}", parent=parent):
+                    return await func(*args, **kwargs)
+            finally:
+                _caller.reset(token)
+        return wrapper
+
+    def instrument_class(self, cls):
+        """
+        Wraps every public coroutine method of `cls` with `instrument()`; usable as a class decorator.
+        """
+        for name, attr in list(vars(cls).items()):
+            if not name.startswith("_") and asyncio.iscoroutinefunction(attr):
+                setattr(cls, name, self.instrument(attr, name))
+        return cls
+
+    def start(self, lag_interval=None, path=None):
+        if lag_interval is not None:
+            self.lag_interval = lag_interval
+        self.path = path
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._monitor())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.to_thread(self._flush)
+
+    async def _monitor(self):
+        loop = asyncio.get_running_loop()
+        last_flush = loop.time()
+        while True:
+            interval = self.lag_interval()
+            if interval > 0:
+                expected = loop.time() + interval
+                await asyncio.sleep(interval)
+                lag = max(loop.time() - expected, 0) * 1000
+                self.record(LOOP_LAG, lag, listed=lag >= LAG_REPORT_MS)
+            else:
+                await asyncio.sleep(FLUSH_INTERVAL)
+            if self._pending and loop.time() - last_flush >= FLUSH_INTERVAL:
+                last_flush = loop.time()
+                await asyncio.to_thread(self._flush)
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        path = self.path
+        if not pending or not path:
+            return
+        try:
+            if os.path.exists(path) and os.path.getsize(path) > TRACE_MAX_SIZE:
+                os.replace(path, f"{path}.1")
+            with open(path, 'a') as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in pending)
+        except OSError as e:
+            decky.logger.error(f"Failed to write trace file {path}: {e}")
+
+    def snapshot(self, recent=0) -> dict:
+        return {
+            "spans": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            "recent": list(self.recent)[-recent:] if recent > 0 else [],
+            "file": self.path,
+        }
+
+    def reset(self):
+        self.histograms.clear()
+        self.recent.clear()
+
+
+# Shared by every module, the way `decky.logger` is
+tracer = Tracer()
@@ -0,0 +1,112 @@
+import asyncio
+import os
+
+import decky
+
+INTERFACE = "tun0"
+# sing-box's defaults for `iproute2_table_index` and `iproute2_rule_index` with auto_route on Linux
+ROUTE_TABLE = 2022
+RULE_INDEX = 9000
+# auto_route installs its rules at priorities RULE_INDEX through RULE_INDEX + RULE_RANGE
+RULE_RANGE = 10
+# Stop deleting at one priority after this many rules in case `ip` misbehaves
+MAX_RULES = 32
+
+
+def interface_exists(name=INTERFACE) -> bool:
+    return os.path.exists(f"/sys/class/net/{name}")
+
+
+async def _ip(*args) -> bool:
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ip", *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    except OSError:
+        return False
+    return await proc.wait() == 0
+
+
+def _in_range(line: str) -> bool:
+    priority, _, rule = line.partition(":")
+    priority = priority.strip()
+    if priority.isdigit() and RULE_INDEX <= int(priority) <= RULE_INDEX + RULE_RANGE:
+        return True
+    tokens = rule.split()
+    return any(tokens[i] == "lookup" and tokens[i + 1] == str(ROUTE_TABLE) for i in range(len(tokens) - 1))
+
+
+async def _leftover_rules() -> list:
+    """
+    Lists the policy routing rules of both families that auto_route could have installed: those in its priority
+    range and those pointing at its table.
+
+    Returns:
+    list[str]: The `ip rule list` lines, prefixed with the family. Empty if `ip` is not available.
+    """
+    leftover = []
+    for family in ("-4", "-6"):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "ip", family, "rule", "list",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout, _ = await proc.communicate()
+        except OSError:
+            continue
+        leftover += [f"{family} {line.strip()}" for line in stdout.decode(errors="replace").splitlines()
+                     if _in_range(line)]
+    return leftover
+
+
+async def _remove_routes() -> list:
+    removed = []
+    for family in ("-4", "-6"):
+        for priority in range(RULE_INDEX, RULE_INDEX + RULE_RANGE + 1):
+            for _ in range(MAX_RULES):
+                if not await _ip(family, "rule", "del", "pref", str(priority)):
+                    break
+                removed.append(f"{family} rule {priority}")
+        # Rules pointing at sing-box's table from outside its priority range
+        for _ in range(MAX_RULES):
+            if not await _ip(family, "rule", "del", "table", str(ROUTE_TABLE)):
+                break
+            removed.append(f"{family} rule")
+        if await _ip(family, "route", "flush", "table", str(ROUTE_TABLE)):
+            removed.append(f"{family} table {ROUTE_TABLE}")
+    return removed
+
+
+async def release(name=INTERFACE, timeout=2.0) -> dict:
+    """
+    Makes sure the TUN device and its policy routing are gone once sing-box has exited.
+
+    sing-box removes them itself on a clean shutdown, so this first waits up to `timeout` seconds for the interface
+    to disappear. A device still present after that, or rules left in `ip rule list` by a killed or crashed process,
+    are deleted together with the rest of the routing rules and table auto_route installed, since a stale tun0 makes
+    the next start fail and stale rules blackhole traffic.
+
+    Returns:
+    dict: `clean` (True if the interface is gone and `ip rule list` shows none of auto_route's rules) and
+          `removed`, what had to be cleaned up by hand.
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+    while interface_exists(name) and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.05)
+    # A killed process takes its tun0 with it, but leaves the routing rules behind
+    leftover = await _leftover_rules()
+    if not interface_exists(name) and not leftover:
+        return {"clean": True, "removed": []}
+    decky.logger.warning(f"{name} or its routing rules are still present after sing-box exited, removing them")
+    removed = []
+    if interface_exists(name) and await _ip("link", "delete", name):
+        removed.append(name)
+    removed += await _remove_routes()
+    leftover = await _leftover_rules()
+    clean = not interface_exists(name) and not leftover
+    if not clean:
+        decky.logger.error(f"Failed to remove stale {name} or its routing rules: {leftover}")
+    return {"clean": clean, "removed": removed}
@@ -0,0 +1,139 @@
+import asyncio
+import statistics
+import time
+
+STACKS = ("system", "gvisor", "mixed")
+DEFAULT_STACK = "system"
+DEFAULT_MTU = 9000
+DEFAULT_GSO = True
+MIN_MTU = 1280
+MAX_MTU = 65535
+# Candidates tried by the tuner: jumbo, Ethernet, and two sizes that leave room for tunnel and PPPoE overhead
+TUNE_MTUS = (9000, 1500, 1400, 1280)
+
+# A TEST-NET-1 address (RFC 5737): routed into the TUN device but never used on a real network
+TUNE_ADDRESS = "192.0.2.1"
+TUNE_OUTBOUND = "tune-loopback"
+
+ROUNDS = 20
+PAYLOAD_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def tun_options(stack=DEFAULT_STACK, mtu=DEFAULT_MTU, gso=DEFAULT_GSO) -> dict:
+    """
+    Normalizes TUN performance options.
+
+    Raises:
+    ValueError: If the stack is unknown or the MTU is out of range.
+    """
+    if stack not in STACKS:
+        raise ValueError(f"stack must be one of {', '.join(STACKS)}")
+    mtu = int(mtu)
+    if not MIN_MTU <= mtu <= MAX_MTU:
+        raise ValueError(f"mtu must be between {MIN_MTU} and {MAX_MTU}")
+    return {"stack": stack, "mtu": mtu, "gso": bool(gso)}
+
+
+def route_to_loopback(config: dict, port: int):
+    """
+    Makes connections to `TUNE_ADDRESS` leave the TUN device towards the local benchmark target on `port`, in place.
+
+    The traffic crosses tun0 and the configured stack like any proxied connection, but is then handed to a direct
+    outbound that dials 127.0.0.1 instead of going upstream, so only the local path is measured.
+    """
+    config.setdefault("outbounds", []).append({"type": "direct", "tag": TUNE_OUTBOUND, "override_address": "127.0.0.1",
+                                               "override_port": port})
+    rules = config.setdefault("route", {}).setdefault("rules", [])
+    rules.insert(0, {"ip_cidr": [f"{TUNE_ADDRESS}/32"], "outbound": TUNE_OUTBOUND})
+
+
+class LoopbackTarget:
+    """
+    A minimal TCP server on 127.0.0.1 for the tuner to measure against.
+
+    Each request is one line: `ping` is answered with `pong`, `bulk <n>` with `n` bytes of payload.
+    """
+
+    def __init__(self):
+        self._server = None
+        self.port = None
+
+    async def _handle(self, reader, writer):
+        payload = bytes(CHUNK_SIZE)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.split()
+                if command[:1] == [b"ping"]:
+                    writer.write(b"pong\n")
+                elif command[:1] == [b"bulk"] and len(command) == 2 and command[1].isdigit():
+                    remaining = int(command[1])
+                    while remaining > 0:
+                        writer.write(payload[:min(remaining, CHUNK_SIZE)])
+                        remaining -= CHUNK_SIZE
+                        await writer.drain()
+                else:
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+async def _measure(address, port, rounds, payload_size) -> dict:
+    reader, writer = await asyncio.open_connection(address, port)
+    try:
+        delays = []
+        for _ in range(rounds):
+            start = time.monotonic()
+            writer.write(b"ping\n")
+            await writer.drain()
+            if await reader.readline() != b"pong\n":
+                raise ConnectionError("unexpected reply from benchmark target")
+            delays.append((time.monotonic() - start) * 1000)
+        start = time.monotonic()
+        writer.write(f"bulk {payload_size}\n".encode())
+        await writer.drain()
+        await reader.readexactly(payload_size)
+        elapsed = time.monotonic() - start
+    finally:
+        writer.close()
+    return {"latency": round(statistics.median(delays), 3), "throughput": round(payload_size / max(elapsed, 1e-6))}
+
+
+async def benchmark(port, address=TUNE_ADDRESS, rounds=ROUNDS, payload_size=PAYLOAD_SIZE, timeout=15.0) -> dict:
+    """
+    Measures round-trip latency and download throughput to the benchmark target through the tunnel.
+
+    Returns:
+    dict: `latency` (median ms over `rounds` pings), `throughput` (bytes per second) and `error`, with the
+          measurements None when the run failed.
+    """
+    try:
+        result = await asyncio.wait_for(_measure(address, port, rounds, payload_size), timeout)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        return {"latency": None, "throughput": None, "error": str(e) or "timeout"}
+    return {**result, "error": None}
+
+
+def rank(results: list) -> list:
+    """
+    Orders benchmark results best first: highest throughput, then lowest latency, failures last.
+    """
+    return sorted(results, key=lambda result: (result["throughput"] is None, -(result["throughput"] or 0),
+                                               result["latency"] or 0))
@@ -0,0 +1,92 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+import decky
+
+from sbox.config import write_atomic
+from sbox.trace import tracer
+
+
+class ConfigValidator:
+    """
+    Runs `sing-box check` on generated configs and remembers the verdict per config cache key.
+
+    A config is only checked once per content hash: results are kept in memory, persisted to `cache_path` so they
+    survive plugin restarts, and concurrent requests for the same key share one `sing-box check` run.
+
+    Parameters:
+    binary (str): Path of the sing-box binary.
+    home (str): Working directory passed to sing-box with `-D`.
+    env (dict): Environment for the check subprocess.
+    cache_path (str): Where to persist results.
+    max_entries (int): Number of results kept.
+    """
+
+    def __init__(self, binary, home, env, cache_path, max_entries=64):
+        self.binary = binary
+        self.home = home
+        self.env = env
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self._results = None
+        self._pending = {}
+
+    @property
+    def results(self) -> OrderedDict:
+        if self._results is None:
+            try:
+                with open(self.cache_path, 'r') as f:
+                    self._results = OrderedDict(json.load(f))
+            except (OSError, ValueError):
+                self._results = OrderedDict()
+        return self._results
+
+    def cached(self, key):
+        """
+        Returns the stored `{"valid", "error"}` result for `key`, or None if it has not been checked.
+        """
+        return self.results.get(key)
+
+    def store(self, key, result):
+        results = self.results
+        results[key] = result
+        results.move_to_end(key)
+        while len(results) > self.max_entries:
+            results.popitem(last=False)
+        try:
+            write_atomic(self.cache_path, json.dumps(results).encode())
+        except OSError as e:
+            decky.logger.warning(f"Failed to persist validation cache: {e}")
+
+    async def _run_check(self, path) -> dict:
+        proc = await asyncio.create_subprocess_exec(
+            self.binary, "check", "-D", self.home, "-c", path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=self.env
+        )
+        stdout, _ = await proc.communicate()
+        output = stdout.decode('utf-8', 'replace').strip()
+        return {"valid": proc.returncode == 0, "error": None if proc.returncode == 0 else output}
+
+    async def check(self, path, key) -> dict:
+        """
+        Validates the generated config at `path`, whose cache key is `key`.
+
+        Returns:
+        dict: `valid` (bool) and `error` (sing-box's output when invalid).
+        """
+        result = self.cached(key)
+        if result is not None:
+            return result
+        if key not in self._pending:
+            self._pending[key] = asyncio.ensure_future(self._run_check(path))
+        try:
+            with tracer.span("stage:validate"):
+                result = await asyncio.shield(self._pending[key])
+        finally:
+            if self._pending.get(key) is not None and self._pending[key].done():
+                self._pending.pop(key, None)
+        self.store(key, result)
+        return result
@@ -1,6 +1,6 @@
 import { callable } from "@decky/api";
 import { ConfirmModal, DialogSubHeader, Field, ToggleField } from "@decky/ui";
-import { ConfigStatus } from "../model";
+import { ConfigStatus, DnsOptions } from "../model";
 import { useState } from "react";
 
 export interface ConfigDetailModalProps {
@@ -19,6 +19,7 @@ const ConfigDetailModal: React.FC<ConfigDetailModalProps> = ({ config, closeModa
   const refreshConfig = callable<[configName: string], boolean>("refresh_config");
   const deleteConfig = callable<[configName: string], boolean>("delete_config");
   const updateConfig = callable<[configName: string, configKey:string, configValue: boolean], boolean>("update_config");
+  const setDnsOptions = callable<[options: Partial<DnsOptions>, configName: string], boolean>("set_dns_options");
 
   const [configs, setConfigs] = useState<ConfigStatus>(config);
 
@@ -33,6 +34,11 @@ const ConfigDetailModal: React.FC<ConfigDetailModalProps> = ({ config, closeModa
     updateConfig(configs.name,option,value);
   }
 
+  const handleDnsChange = (option: keyof DnsOptions, value: boolean) => {
+    setConfigs(prevState => ({ ...prevState, dns: { ...prevState.dns!, [option]: value } }));
+    setDnsOptions({ [option]: value }, configs.name);
+  }
+
   if (configs.selected === false) {
     return (
       <ConfirmModal
@@ -51,7 +57,8 @@ const ConfigDetailModal: React.FC<ConfigDetailModalProps> = ({ config, closeModa
         }}
         onCancel={closeModal}
       >
-      <ToggleField label="Use" disabled={configs.valid !==true} checked={configs.selected} onChange={(val) => handleOnChange("selected", val)} />
+      <ToggleField label="Use" disabled={configs.valid === false} checked={configs.selected} onChange={(val) => handleOnChange("selected", val)} />
+      <ToggleField label="Merge" checked={!!configs.merged} onChange={(val) => handleOnChange("merged", val)} />
       </ConfirmModal>
     )
   } else {
@@ -68,9 +75,19 @@ const ConfigDetailModal: React.FC<ConfigDetailModalProps> = ({ config, closeModa
       >
         <DialogSubHeader style={{ textTransform: "none" }}>
           {"URL: " + configs.url}<br />
-          {"Valid: " + configs.valid}<br />
+          {configs.format && configs.format !== "sing-box" && <>{"Format: " + configs.format + " (converted)"}<br /></>}
+          {"Valid: " + (configs.valid ?? "checking")}<br />
+          {configs.error && <>{configs.error}<br /></>}
+          {configs.last_change && <>{"Last update: " + configs.last_change.kind + " (+" + configs.last_change.outbounds.added
+            + " -" + configs.last_change.outbounds.removed + " ~" + configs.last_change.outbounds.changed + " outbounds"
+            + (configs.last_change.sections.length ? ", " + configs.last_change.sections.join(", ") : "") + ")"}<br /></>}
         </DialogSubHeader>
-        <ToggleField label="Use" disabled={configs.valid !==true} checked={configs.selected} onChange={(val) => handleOnChange("selected", val)} />
+        <ToggleField label="Use" disabled={configs.valid === false} checked={configs.selected} onChange={(val) => handleOnChange("selected", val)} />
+        <ToggleField label="Merge" checked={!!configs.merged} onChange={(val) => handleOnChange("merged", val)} />
+        {configs.dns && <ToggleField label="Managed DNS" description="Resolve LAN and Steam CDN domains locally and cache lookups"
+          checked={configs.dns.enabled} onChange={(val) => handleDnsChange("enabled", val)} />}
+        {configs.dns && <ToggleField label="Fake IP" disabled={!configs.dns.enabled}
+          checked={configs.dns.fakeip} onChange={(val) => handleDnsChange("fakeip", val)} />}
         {/* <ToggleField label="Allow DNS Configuration" disabled={net.status !== "OK"} checked={net.allowDNS} onChange={(val) => handleOnChange("allowDNS", val)} />
         <ToggleField label="Allow Default Router Override" disabled={net.status !== "OK"} checked={net.allowDefault} onChange={(val) => handleOnChange("allowDefault", val)} />
         <ToggleField label="Allow Assignment of Global IPs" disabled={net.status !== "OK"} checked={net.allowGlobal} onChange={(val) => handleOnChange("allowGlobal", val)} /> */}
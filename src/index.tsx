@@ -8,18 +8,32 @@ import {
   Navigation
 } from "@decky/ui";
 
-import { callable, definePlugin } from '@decky/api';
+import { addEventListener, callable, definePlugin, removeEventListener, toaster } from '@decky/api';
 
 import { useEffect, useState } from "react";
 
-import { ConfigStatus, RunStatus } from "./model";
+import { ConfigStatus, HealthEvent, MergeStats, OutboundSelection, PluginState, RefreshSummary, ResourceEvent, ResourceStatus, RunStatus, TrafficMetrics, TrafficTick, TunTuning } from "./model";
 import AddConfigModal from "./components/AddConfigModal";
 import ConfigButton from "./components/ConfigButton";
 import ConfigDetailModal from "./components/ConfigDetailModal";
 
-const info = callable<[], RunStatus>("info");
+const getState = callable<[etag: string], PluginState>("get_state");
 const listConfigs = callable<[], ConfigStatus[]>("list_configs");
 const setSingboxStatus = callable<[boolean]>("toggle_singbox");
+const refreshAllConfigs = callable<[], RefreshSummary>("refresh_all_configs");
+const getMetrics = callable<[], TrafficMetrics>("get_metrics");
+const getResources = callable<[], ResourceStatus>("get_resources");
+const setTrafficEvents = callable<[enabled: boolean], boolean>("set_traffic_events");
+const appLifetime = callable<[appId: number, running: boolean], string>("app_lifetime");
+const selectBestOutbound = callable<[], OutboundSelection>("select_best_outbound");
+const tuneTun = callable<[], TunTuning>("tune_tun");
+const setMergedMode = callable<[enabled: boolean], MergeStats>("set_merged_mode");
+
+const formatRate = (bytes: number) => {
+  if (bytes >= 1024 * 1024) return (bytes / 1024 / 1024).toFixed(1) + " MB/s";
+  if (bytes >= 1024) return (bytes / 1024).toFixed(1) + " KB/s";
+  return bytes + " B/s";
+};
 
 /**
  * The main component of the plugin, responsible for displaying the service status and managing the network operations.
@@ -35,27 +49,59 @@ function Content() {
   // State variables for storing node status, network list, and modal result
   const [runState, setRunState] = useState<RunStatus>({ binary_version: "", online: false, config: '' });
   const [configs, setConfigs] = useState<ConfigStatus[]>([]);
+  const [metrics, setMetrics] = useState<TrafficMetrics | null>(null);
+  const [resources, setResources] = useState<ResourceStatus | null>(null);
   const [modalResult, setModalResult] = useState<ShowModalResult | null>(null);
 
-  // Fetch node status and network list from the ZeroTier API every 5 seconds
+  // Fetch the service status and config list once, then re-sync whenever the backend pushes a state change
   useEffect(() => {
-    const fetchData = async () => {
-      info().then(response => {
-        setRunState(response);
+    let etag = "";
+    const syncState = () => {
+      getState(etag).then(state => {
+        etag = state.etag;
+        if (state.unchanged) return;
+        setRunState(state.info);
+        setConfigs(state.configs);
+        if (state.info.online) {
+          getMetrics().then(setMetrics);
+          getResources().then(setResources);
+        } else {
+          setMetrics(null);
+          setResources(null);
+        }
       });
-
-      listConfigs().then(response =>{
-        setConfigs(response.map(configs => configs as ConfigStatus));
-      })
-
-      // toaster.toast({title: "Connected to ZeroTier", body: "Version: " + nodeState.version})
     };
 
-    fetchData();
-    const interval = setInterval(fetchData, 5000);
-
-    // clean up the interval when the plugin is unmounted
-    return () => clearInterval(interval);
+    syncState();
+    const stateEvents = ["status", "config_switched", "configs_changed", "refresh_finished", "health"];
+    const listeners = stateEvents.map(event => addEventListener(event, syncState));
+    const healthListener = addEventListener<[HealthEvent]>("health", event => {
+      if (event.type === "failover") {
+        toaster.toast({ title: "Tunnel was down", body: "Switched to " + (event.outbound ?? event.config) });
+      } else if (event.type === "failover_failed") {
+        toaster.toast({ title: "Tunnel is down", body: "No working node or profile left to switch to" });
+      }
+    });
+    const resourceListener = addEventListener<[ResourceEvent]>("resources", event => {
+      if (event.type === "rss_limit") {
+        toaster.toast({ title: "sing-box uses " + Math.round(event.rss! / 1048576) + " MB",
+          body: event.action === "restart" ? "Restarting it to release memory" : "Above the configured limit" });
+      }
+    });
+    const trafficListener = addEventListener<[TrafficTick]>("traffic", ({ resources, ...metrics }) => {
+      setMetrics(metrics);
+      setResources(resources);
+    });
+    setTrafficEvents(true);
+
+    // stop listening and ticking when the plugin is unmounted
+    return () => {
+      stateEvents.forEach((event, i) => removeEventListener(event, listeners[i]));
+      removeEventListener("traffic", trafficListener);
+      removeEventListener("health", healthListener);
+      removeEventListener("resources", resourceListener);
+      setTrafficEvents(false);
+    };
   }, []);
 
   // Open the join network modal and update the modal result state
@@ -76,6 +122,43 @@ function Content() {
   };
 
 
+  const handleRefreshAll = () => {
+    refreshAllConfigs().then(summary => {
+      const count = (status: string) => summary.results.filter(result => result.status === status).length;
+      toaster.toast({
+        title: "Profiles refreshed in " + summary.elapsed + "s",
+        body: count("changed") + " changed, " + count("unchanged") + " unchanged, " + count("failed") + " failed"
+      });
+    });
+  };
+
+  const handleSelectBest = () => {
+    toaster.toast({ title: "Testing outbound latency..." });
+    selectBestOutbound().then(selection => {
+      toaster.toast(selection.selected
+        ? { title: "Switched to " + selection.selected, body: selection.delay + " ms, " + selection.results.length + " outbounds tested" }
+        : { title: "No reachable outbound found" });
+    });
+  };
+
+  const handleTuneTun = () => {
+    toaster.toast({ title: "Benchmarking TUN stacks and MTUs..." });
+    tuneTun().then(tuning => {
+      toaster.toast(tuning.best
+        ? { title: "TUN tuned: " + tuning.best.stack + ", MTU " + tuning.best.mtu, body: formatRate(tuning.results![0].throughput!) }
+        : { title: "TUN tuning failed", body: tuning.error ?? "No combination worked" });
+    });
+  };
+
+  const handleMergedMode = (enabled: boolean) => {
+    setMergedMode(enabled).then(stats => {
+      if (!enabled) return;
+      toaster.toast(stats.error
+        ? { title: "Merging profiles failed", body: stats.error }
+        : { title: "Merged " + stats.sources.length + " profiles", body: stats.unique + " nodes, " + stats.duplicates + " duplicates dropped" });
+    });
+  };
+
   // Close the current modal and refresh the network list
   const closeModal = () => {
     modalResult?.Close();
@@ -92,8 +175,10 @@ function Content() {
       <PanelSection title="Service">
         <PanelSectionRow>
           {"Sing-box: " + runState.binary_version}<br />
-          {"Status: " + runState.online}<br />
-          {"Config: " + runState.config}<br />
+          {"Status: " + (runState.state ?? runState.online) + (runState.healthy === false ? " (no connectivity)" : "")}<br />
+          {runState.merged ? "Config: merged " + runState.merged.join(", ") : "Config: " + runState.config}<br />
+          {resources?.current && <>{"Usage: " + (resources.current.cpu ?? 0) + "% CPU, " + Math.round(resources.current.rss / 1048576) + " MB"}<br /></>}
+          {metrics && <>{"Traffic: \u2191 " + formatRate(metrics.up) + " \u2193 " + formatRate(metrics.down) + ", " + metrics.connections + " connections"}<br /></>}
         </PanelSectionRow>
         <PanelSectionRow>
         <ToggleField label="Start Sing-box" disabled={runState.binary_version.length==0 || runState.config.length==0} checked={runState.online} onChange={(val) => handleRunStateOnChange(val)} />
@@ -103,11 +188,25 @@ function Content() {
             Navigation.NavigateToExternalWeb("http://127.0.0.1:9090/ui")
           }}>Open WebUI</DialogButton>
         </PanelSectionRow>
+        <PanelSectionRow>
+          <DialogButton disabled={runState.config.length==0} onClick={handleSelectBest}>Pick Fastest Node</DialogButton>
+        </PanelSectionRow>
+        <PanelSectionRow>
+          <DialogButton disabled={!runState.online} onClick={handleTuneTun}>Tune TUN</DialogButton>
+        </PanelSectionRow>
         <PanelSectionRow>
           <DialogButton onClick={openAddModal}>Add New Config Profile</DialogButton>
         </PanelSectionRow>
       </PanelSection>
       <PanelSection title="Profiles">
+        <PanelSectionRow>
+          <DialogButton disabled={configs.length==0} onClick={handleRefreshAll}>Refresh All Profiles</DialogButton>
+        </PanelSectionRow>
+        <PanelSectionRow>
+          <ToggleField label="Merge Profiles" description="Run every profile marked for merging in one config"
+            disabled={configs.filter(cfg => cfg.merged).length < 2 && !runState.merged}
+            checked={!!runState.merged} onChange={handleMergedMode} />
+        </PanelSectionRow>
         {configs.map(cfg =>
           <PanelSectionRow>
             <ConfigButton config={cfg} onClick={() => openDetailModal(cfg)} />
@@ -119,11 +218,20 @@ function Content() {
 };
 
 export default definePlugin(() => {
+  // Tell the backend when games start and exit so it can switch to their routing profile
+  const appLifetimeRegistration = SteamClient.GameSessions.RegisterForAppLifetimeNotifications(
+    (update: { unAppID: number; bRunning: boolean }) => {
+      appLifetime(update.unAppID, update.bRunning);
+    }
+  );
 
   return {
     name: "Decky ZeroTier",
     version: "0.0.1",
     content: <Content />,
+    onDismount() {
+      appLifetimeRegistration.unregister();
+    },
     icon: <svg fill="currentColor" height="1em" width="1em" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path d="M4.01 0A3.999 3.999 0 0 0 .014 4v16c0 2.209 1.79 4 3.996 4h15.98a3.998 3.998 0 0 0 3.996-4V4c0-2.209-1.79-4-3.996-4zm-.672 2.834h17.326a.568.568 0 1 1 0 1.137h-8.129c.021.059.033.123.033.19v1.804A6.06 6.06 0 0 1 18.057 12c0 3.157-2.41 5.75-5.489 6.037v2.56a.568.568 0 1 1-1.136 0v-2.56A6.061 6.061 0 0 1 5.943 12a6.06 6.06 0 0 1 5.489-6.035V4.16c0-.066.012-.13.033-.19H3.338a.568.568 0 1 1 0-1.136zm8.094 4.307A4.89 4.89 0 0 0 7.113 12a4.89 4.89 0 0 0 4.319 4.86zm1.136 0v9.718A4.892 4.892 0 0 0 16.888 12a4.892 4.892 0 0 0-4.32-4.86z" /></svg>,
   };
 });
@@ -2,6 +2,13 @@ export interface RunStatus {
   binary_version: string;
   online: boolean;
   config: string;
+  state?: string;
+  pid?: number | null;
+  exit_code?: number | null;
+  restart_count?: number;
+  uptime?: number;
+  healthy?: boolean | null;
+  merged?: string[] | null;
 }
 
 export interface Network {
@@ -21,6 +28,217 @@ export interface Network {
 export interface ConfigStatus {
   name: string;
   url: string;
+  format?: "sing-box" | "clash" | "links";
   selected: boolean;
-  valid: boolean;
-}
\ No newline at end of file
+  merged?: boolean;
+  dns?: DnsOptions;
+  valid: boolean | null;
+  error?: string | null;
+  last_change?: ConfigChange | null;
+}
+
+export interface DnsOptions {
+  enabled: boolean;
+  local: string;
+  remote: string;
+  local_domain_suffix: string[];
+  fakeip: boolean;
+  independent_cache: boolean;
+  persist: boolean;
+}
+
+export interface ConfigDiff {
+  kind: "noop" | "outbounds" | "structural";
+  apply: "none" | "selector" | "reload" | "restart";
+  outbounds: { added: number; removed: number; changed: number };
+  groups: string[];
+  selectors: Record<string, string>;
+  sections: string[];
+  sample: { added: string[]; removed: string[]; changed: string[] };
+}
+
+export interface ConfigChange extends ConfigDiff {
+  time: number;
+}
+
+export interface MergeStats {
+  sources: string[];
+  nodes: number;
+  unique: number;
+  duplicates: number;
+  renamed: number;
+  skipped: string[];
+  error?: string;
+}
+
+export interface RefreshResult {
+  name: string;
+  status: "changed" | "unchanged" | "failed";
+  elapsed: number;
+  error: string | null;
+  diff: ConfigDiff | null;
+}
+
+export interface RefreshSummary {
+  results: RefreshResult[];
+  elapsed: number;
+}
+
+export interface OutboundUsage {
+  outbound: string;
+  connections: number;
+  upload: number;
+  download: number;
+}
+
+export interface TrafficSample {
+  time: number;
+  up: number;
+  down: number;
+  connections: number;
+}
+
+export interface TrafficMetrics {
+  active: boolean;
+  up: number;
+  down: number;
+  upload_total: number;
+  download_total: number;
+  connections: number;
+  outbounds: OutboundUsage[];
+  updated_at: number | null;
+  history: TrafficSample[];
+}
+
+export interface TrafficTick extends TrafficMetrics {
+  resources: ResourceStatus;
+}
+
+export interface LatencyResult {
+  tag: string;
+  type: string;
+  delay: number | null;
+  error: string | null;
+  method: "clash" | "tcp";
+  age: number;
+}
+
+export interface OutboundSelection {
+  selected: string | null;
+  delay: number | null;
+  groups: string[];
+  results: LatencyResult[];
+}
+
+export interface ResourceSample {
+  time: number;
+  pid: number;
+  cpu: number | null;
+  rss: number;
+  rss_peak: number;
+  threads: number;
+  fds: number;
+}
+
+export interface ResourceEvent {
+  time: number;
+  type: "rss_limit" | "limit_failed";
+  pid: number;
+  rss?: number;
+  limit?: number;
+  action?: "warn" | "restart";
+  error?: string;
+}
+
+export interface ResourceStatus {
+  current: ResourceSample | null;
+  limits: { nice: number | null; affinity: number[]; rss_limit: number; rss_action: "warn" | "restart" };
+  events: ResourceEvent[];
+  history: ResourceSample[];
+}
+
+export interface PluginState {
+  etag: string;
+  unchanged: boolean;
+  info: RunStatus;
+  configs: ConfigStatus[];
+}
+
+export interface RouteProfile {
+  description?: string;
+  direct_domain?: string[];
+  direct_domain_suffix?: string[];
+  direct_ip_cidr?: string[];
+  direct_private?: boolean;
+  proxy_only?: boolean;
+  proxy_domain?: string[];
+  proxy_domain_suffix?: string[];
+  proxy_ip_cidr?: string[];
+  exclude_address?: string[];
+}
+
+export interface RouteProfiles {
+  profiles: Record<string, RouteProfile>;
+  active: string;
+  app_profiles: Record<string, string>;
+  running_app: string | null;
+  current: string;
+}
+
+export interface TuneResult {
+  stack: string;
+  mtu: number;
+  latency: number | null;
+  throughput: number | null;
+  error: string | null;
+}
+
+export interface TunTuning {
+  best?: { stack: string; mtu: number } | null;
+  results?: TuneResult[];
+  error?: string;
+}
+
+export interface HealthEvent {
+  time: number;
+  type: "probe_failed" | "recovered" | "failover" | "failover_failed";
+  error?: string | null;
+  count?: number;
+  after?: number;
+  group?: string;
+  outbound?: string;
+  config?: string;
+  from?: string | null;
+}
+
+export interface HealthStatus {
+  healthy: boolean | null;
+  failures: number;
+  last_probe: { ok: boolean; delay: number | null; error: string | null; time: number } | null;
+  events: HealthEvent[];
+}
+
+export interface SpanSummary {
+  count: number;
+  errors: number;
+  mean: number;
+  max: number;
+  p50: number;
+  p95: number;
+  p99: number;
+  buckets: Record<string, number>;
+}
+
+export interface TraceSpan {
+  time: number;
+  name: string;
+  ms: number;
+  error?: string;
+  config?: string;
+}
+
+export interface TraceSnapshot {
+  spans: Record<string, SpanSummary>;
+  recent: TraceSpan[];
+  file: string | null;
+}